@@ -13,7 +13,7 @@
  All variables created as above are thougt to be independent. If you want to
  create variables with designated correlations, use "correlated_values",
  which takes a list of nominal values and a statistic and a systematic
- covariance matrix.
+ covariance matrix and returns an UncertainArray.
  
  Uncertain Variables can be used just like normal floats. They support +, -,
  *, /, ** with other uncertain variables or with floats. The result will an
@@ -25,14 +25,40 @@
  x.statistical_standard_deviation, x.stat_std_dev or x.stat respectivly
  x.systematic_standard_deviation, x.sys_std_dev or x.sys.
  All of those values are floats.
+ str(x) and format(x) round the values to their significant digits, see
+ SIGNIFICANT_DIGITS. Tables of many values are written as text, CSV or
+ LaTeX with write_table or format_table.
  
  This module also defines most functions of pyhtons math package, such as sqrt, 
  exp, log, sin, cos and others. These functions support uncertain variables
  as well as normal floats.
  
+ Sums, dot products and (weighted) means of many values are calculated
+ with usum, udot, umean and weighted_mean, which are faster than adding up
+ the values one by one. For streams of values, SumAccumulator,
+ MeanAccumulator and WeightedMeanAccumulator keep the result without
+ keeping the values.
+ 
+ Large collections of uncertain values can be handled as an UncertainArray,
+ which stores the nominal values and the derivatives in numpy arrays and
+ calculates with all values at once. It is only available if numpy is
+ installed. See uncertain_arrays for details.
+ 
  If you are interested in the covariances or correaltions, the methods
  stat_cov_mat and stat_corr_mat (and same for sys) will calculate the
  covariance respectively correlation matrices.
+ Matrices too large for the memory can be calculated in blocks, see
+ uncertain_covariances.
+ 
+ parallel_map applies a function to many uncertain values on a pool of
+ processes, keeping the correlations of the results. Datasets larger than
+ the memory are calculated chunk by chunk with chunked_map, see
+ uncertain_pipeline.
+ 
+ Uncertain values can be pickled or saved with uncertain_serialization,
+ keeping their correlations, also when they are sent to other processes.
+ Large datasets can be saved as memory-mapped arrays with save_store and
+ read in parts after open_store, see uncertain_store.
  
  Uncertain variables support comparison (==, <, <=, ...).
  For every operation except ==, the values are compared, ignoring the
@@ -45,6 +71,10 @@
  are not known, they can be performed numerically.
  Call help(wrap) for details.
  
+ Code repeating the same calculations can be run in the context
+ shared_subexpressions, which reuses earlier results and folds identities
+ like x-x, so fewer intermediate results are built and expanded.
+ 
  To find everything not listed here, look up the functions name in __all__ and
  get information with help( <function> ).
  
@@ -52,9 +82,39 @@
 """
 
 from .uncertain_values import *
-from .uncertain_values import __all__
+from .uncertain_values import __all__ as all_values
 
 from .uncertain_math import *
 from .uncertain_math import __all__ as all_math
 
-__all__.extend(all_math)
+from .uncertain_aggregates import *
+from .uncertain_aggregates import __all__ as all_aggregates
+
+from .uncertain_parallel import *
+from .uncertain_parallel import __all__ as all_parallel
+
+from .uncertain_formatting import *
+from .uncertain_formatting import __all__ as all_formatting
+
+# build a new list, extending the one of uncertain_values would change what
+# "from .uncertain_values import *" imports
+__all__ = (all_values + all_math + all_aggregates + all_parallel
+           + all_formatting)
+
+# UncertainArray needs numpy
+try:
+    import numpy
+except ImportError:
+    pass
+else:
+    from .uncertain_arrays import *
+    from .uncertain_arrays import __all__ as all_arrays
+    __all__ += all_arrays
+
+    from .uncertain_store import *
+    from .uncertain_store import __all__ as all_store
+    __all__ += all_store
+
+    from .uncertain_pipeline import *
+    from .uncertain_pipeline import __all__ as all_pipeline
+    __all__ += all_pipeline
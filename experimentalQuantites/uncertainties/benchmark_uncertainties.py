@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for uncertaincys
+
+Run from the root of the repository with
+    python -m experimentalQuantites.uncertainties.benchmark_uncertainties
+
+@author: d0cod3r
+"""
+
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer, timeit
+
+from .uncertain_values import (UncertainVariable, covariance_matrices, wrap,
+                               _general_wrapper)
+
+
+def count_paths(value):
+    """
+    Return the number of not expanded LinearParts and the number of paths
+    from value to the expanded LinearParts of its graph. Walking every path
+    was the cost of the expansion before it became graph aware.
+    """
+    (order, leaves) = value._linear_part._topological_order()
+    paths = {id(value._linear_part): 1}
+    for (node, linear_combo) in order:
+        node_paths = paths.pop(id(node))
+        for (linear_part, _) in linear_combo:
+            key = id(linear_part)
+            paths[key] = paths.get(key, 0) + node_paths
+    return len(order), sum(paths.values())
+
+
+def diamond_chain(depth):
+    """
+    Build y = f(y) with every intermediate result used three times, like in
+    a calibration chain.
+    """
+    x = UncertainVariable(1., .1, .01)
+    y = x
+    for _ in range(depth):
+        y = y*y/y + y/3 - y/3
+    return y
+
+
+def benchmark_expand():
+    print("expansion of diamond shaped graphs")
+    print("%8s %8s %12s %12s" % ("depth", "nodes", "paths", "time [ms]"))
+    for depth in (5, 10, 20, 40, 80, 160):
+        y = diamond_chain(depth)
+        (nodes, paths) = count_paths(y)
+        start = default_timer()
+        y._linear_part.expand()
+        duration = default_timer() - start
+        print("%8i %8i %12.3g %12.3f" % (depth, nodes, paths, 1000*duration))
+
+
+def benchmark_shared_subexpressions():
+    from .uncertain_values import shared_subexpressions
+    print("diamond shaped graphs with and without shared_subexpressions")
+    print("%8s %8s %8s %12s %12s" % ("depth", "nodes", "shared",
+                                      "time [ms]", "shared [ms]"))
+    for depth in (10, 40, 160):
+        start = default_timer()
+        y = diamond_chain(depth)
+        y._linear_part.expand()
+        middle = default_timer()
+        with shared_subexpressions():
+            shared = diamond_chain(depth)
+        (shared_nodes, _) = count_paths(shared)
+        shared._linear_part.expand()
+        end = default_timer()
+        print("%8i %8i %8i %12.3f %12.3f" % (
+                depth, count_paths(diamond_chain(depth))[0], shared_nodes,
+                1000*(middle-start), 1000*(end-middle)))
+
+
+def benchmark_covariances():
+    print("covariance matrices of fit results depending on all inputs")
+    print("%8s %8s %12s" % ("results", "inputs", "time [ms]"))
+    for (results, inputs) in ((100, 100), (500, 200), (2000, 500)):
+        variables = [UncertainVariable(1., .1, .01) for _ in range(inputs)]
+        values = [sum(variables[j]*(i+j) for j in range(0, inputs, 7))
+                  for i in range(results)]
+        for value in values:
+            value._linear_part.get_linear_combo()
+        start = default_timer()
+        covariance_matrices(*values)
+        duration = default_timer() - start
+        print("%8i %8i %12.3f" % (results, inputs, 1000*duration))
+
+
+def benchmark_wrap():
+    print("overhead of wrapped functions per call")
+    print("%8s %12s %12s %12s %12s" % ("function", "float [us]", "general [us]",
+                                       "wrapped [us]", "float in"))
+    x = UncertainVariable(.5, .1, .01)
+    y = UncertainVariable(.3, .1, .01)
+    cases = (("sin", (x,), [math.cos]),
+             ("exp", (x,), [math.exp]),
+             ("atan2", (x, y), [lambda x, y: y/(x**2+y**2),
+                                lambda x, y: -x/(x**2+y**2)]))
+    number = 100000
+    for (name, args, derivatives) in cases:
+        plain_function = getattr(math, name)
+        general = _general_wrapper(plain_function, derivatives)
+        wrapped = wrap(plain_function, list(derivatives))
+        nominal_args = [arg.n for arg in args]
+        times = [1e6*timeit(lambda: function(*call_args), number=number)/number
+                 for (function, call_args) in
+                 ((plain_function, nominal_args), (general, args),
+                  (wrapped, args), (wrapped, nominal_args))]
+        print("%8s %12.3f %12.3f %12.3f %12.3f" % ((name,) + tuple(times)))
+
+
+def benchmark_math():
+    from . import uncertain_math
+    print("functions of uncertain_math per call")
+    print("%8s %12s %12s %12s" % ("function", "float [us]", "wrapped [us]",
+                                  "float in"))
+    x = UncertainVariable(.5, .1, .01)
+    y = UncertainVariable(.3, .1, .01)
+    cases = (("sin", (x,)), ("exp", (x,)), ("log", (x,)), ("sqrt", (x,)),
+             ("tan", (x,)), ("tanh", (x,)), ("atan2", (x, y)),
+             ("hypot", (x, y)), ("pow", (x, y)))
+    number = 100000
+    for (name, args) in cases:
+        plain_function = getattr(math, name)
+        wrapped = getattr(uncertain_math, name, None)
+        if wrapped is None:
+            # x**y calls AffineApproximation.__pow__
+            wrapped = type(x).__pow__
+        nominal_args = [arg.n for arg in args]
+        times = [1e6*timeit(lambda: function(*call_args), number=number)/number
+                 for (function, call_args) in
+                 ((plain_function, nominal_args), (wrapped, args),
+                  (wrapped, nominal_args))]
+        print("%8s %12.3f %12.3f %12.3f" % ((name,) + tuple(times)))
+
+
+def benchmark_executor():
+    print("numeric derivatives of a slow function of six arguments")
+    print("%8s %12s" % ("threads", "time [ms]"))
+    def simulation(*args):
+        # stands for a simulation releasing the GIL, which needs floats
+        time.sleep(.01)
+        return math.fsum(args)
+    args = [UncertainVariable(i, .1) for i in range(6)]
+    print("%8s %12.3f" % ("-", 1000*timeit(lambda: wrap(simulation)(*args),
+                                           number=3)/3))
+    for threads in (4, 13):
+        with ThreadPoolExecutor(threads) as executor:
+            wrapped = wrap(simulation, executor=executor)
+            print("%8i %12.3f" % (threads, 1000*timeit(lambda: wrapped(*args),
+                                                       number=3)/3))
+
+
+def benchmark_serialization():
+    from .uncertain_serialization import dumps, loads
+    print("serialization of correlated values")
+    print("%8s %10s %12s %12s" % ("values", "size [MB]", "dumps [ms]",
+                                  "loads [ms]"))
+    offset = UncertainVariable(1, 0, .1)
+    for amount in (1000, 10000, 100000):
+        values = [UncertainVariable(i, .1)*offset for i in range(amount)]
+        start = default_timer()
+        data = dumps(values)
+        middle = default_timer()
+        loads(data)
+        end = default_timer()
+        print("%8i %10.2f %12.3f %12.3f" % (amount, len(data)/1e6,
+                                            1000*(middle-start),
+                                            1000*(end-middle)))
+
+
+def benchmark_store():
+    import tempfile
+    import numpy
+    from .uncertain_arrays import uarray
+    from .uncertain_store import save_store, open_store
+    print("memory-mapped store, reading 1000 values")
+    print("%8s %12s %12s %12s" % ("values", "save [ms]", "open [ms]",
+                                  "slice [ms]"))
+    for amount in (10000, 100000, 1000000):
+        x = uarray(numpy.arange(float(amount)), stat=.1, sparse=True)
+        values = x*2 + x[::-1]
+        with tempfile.TemporaryDirectory() as path:
+            start = default_timer()
+            save_store(path, values)
+            middle = default_timer()
+            store = open_store(path)
+            end = default_timer()
+            store[amount//2:amount//2+1000]
+            last = default_timer()
+            print("%8i %12.3f %12.3f %12.3f" % (amount, 1000*(middle-start),
+                                                1000*(end-middle),
+                                                1000*(last-end)))
+
+
+def benchmark_formatting():
+    from .uncertain_formatting import format_table
+    print("formatting tables of correlated values")
+    print("%8s %12s %12s %12s" % ("values", "repr [ms]", "str [ms]",
+                                  "table [ms]"))
+    offset = UncertainVariable(1, 0, .1)
+    for amount in (1000, 10000, 50000):
+        values = [UncertainVariable(i, .1*i+.01)*offset for i in range(amount)]
+        # the standard deviations are calculated once and cached
+        for value in values:
+            value.standard_deviations()
+        times = [timeit(lambda: "\n".join(function(value) for value in values),
+                        number=1) for function in (repr, str)]
+        times.append(timeit(lambda: format_table([values]), number=1))
+        print("%8i %12.3f %12.3f %12.3f" % ((amount,)
+                                            + tuple(1000*t for t in times)))
+
+
+if __name__ == "__main__":
+    benchmark_expand()
+    benchmark_shared_subexpressions()
+    benchmark_covariances()
+    benchmark_wrap()
+    benchmark_math()
+    benchmark_executor()
+    benchmark_serialization()
+    benchmark_store()
+    benchmark_formatting()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing aggregates of many uncertain values against adding them up
+
+@author: d0cod3r
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .uncertain_values import UncertainVariable
+from .uncertain_aggregates import (usum, udot, umean, weighted_mean,
+                                   SumAccumulator)
+
+
+values = [UncertainVariable(i, .1*i, .01) for i in range(1, 20)]
+# correlated with the values
+values.append(values[0]*values[1])
+
+
+def assert_equal(value, expected):
+    assert abs(value.n - expected.n) < 1e-12*(1+abs(expected.n))
+    assert (value - expected).stat < 1e-12
+    assert (value - expected).sys < 1e-12
+
+
+def test_sums():
+    assert_equal(usum(value for value in values + [2.]), sum(values) + 2)
+    weights = [values[-1], 2., values[3]]
+    assert_equal(udot(weights, values[:3]),
+                 values[-1]*values[0] + 2*values[1] + values[3]*values[2])
+    try:
+        udot(weights, values)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("different lengths accepted")
+    assert_equal(umean(iter(values)), sum(values)/len(values))
+    # one LinearPart referencing all values
+    (pending, _) = usum(values)._linear_part._topological_order()
+    assert len(pending) == 2
+
+
+def test_weighted_mean():
+    weights = [1/value.stat**2 for value in values]
+    expected = (sum(weight*value for (weight, value) in zip(weights, values))
+                / sum(weights))
+    assert_equal(weighted_mean(values), expected)
+    weights = [1/(value.stat**2 + value.sys**2) for value in values]
+    expected = (sum(weight*value for (weight, value) in zip(weights, values))
+                / sum(weights))
+    assert_equal(weighted_mean(values, "total"), expected)
+    try:
+        weighted_mean([values[0], UncertainVariable(1, 0, 1)])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("value without uncertainty accepted")
+
+
+def test_accumulators():
+    from .uncertain_aggregates import (SumAccumulator, MeanAccumulator,
+                                       WeightedMeanAccumulator)
+    for (kind, function) in ((SumAccumulator, usum), (MeanAccumulator, umean),
+                             (WeightedMeanAccumulator, weighted_mean)):
+        first = kind(values[:5])
+        snapshot = first.value
+        assert_equal(snapshot, function(values[:5]))
+        second = kind()
+        second.extend(values[5:])
+        first.merge(second)
+        assert len(first) == len(values)
+        assert_equal(first.value, function(values))
+        # the snapshot does not change
+        assert_equal(snapshot, function(values[:5]))
+    accumulator = SumAccumulator([values[0]]*1000)
+    assert len(accumulator._coefficients) == 1
+    try:
+        WeightedMeanAccumulator(uncertainty="sys").merge(
+                WeightedMeanAccumulator())
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("different weights merged")
+
+
+def accumulate_with_new_variable(values):
+    # runs in another process, where the new variable can get an index that
+    # belongs to another variable in the calling process
+    accumulator = SumAccumulator(values)
+    accumulator.add(UncertainVariable(1, 0, 1))
+    return accumulator
+
+
+def test_merge_from_processes():
+    with ProcessPoolExecutor(1) as executor:
+        remote = executor.submit(accumulate_with_new_variable,
+                                 values[:3]).result()
+    local = SumAccumulator([UncertainVariable(1, 0, 1), values[0]])
+    local.merge(remote)
+    expected = usum(values[:3]) + values[0]
+    assert abs(local.value.n - expected.n - 2) < 1e-12
+    assert abs(local.value.stat - expected.stat) < 1e-12
+    # the two new variables are independent
+    assert abs(local.value.sys - (expected.sys**2 + 2)**.5) < 1e-12
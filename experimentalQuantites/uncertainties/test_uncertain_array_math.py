@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing the functions for uncertain arrays against the ones for single
+values
+
+@author: d0cod3r
+"""
+
+import numpy
+
+from .uncertain_values import UncertainVariable
+from .uncertain_arrays import UncertainArray, wrap_vectorized
+from . import uncertain_math, uncertain_array_math
+
+
+values = [UncertainVariable(.7, .1, .01), UncertainVariable(.2, 0, .02),
+          UncertainVariable(-.4, .05)]
+others = [UncertainVariable(2.5, .2), 1.5, UncertainVariable(.3, .1, .1)]
+
+
+def assert_close(array_, values):
+    assert numpy.allclose(array_.n, [v.n for v in values])
+    assert numpy.allclose(array_.stat, [v.stat for v in values])
+    assert numpy.allclose(array_.sys, [v.sys for v in values])
+    for (element, value) in zip(array_, values):
+        assert (element - value).stat <= 1e-9*(1+value.stat)
+
+
+def test_unary_functions():
+    x = UncertainArray.from_values(values)
+    for name in uncertain_math.__all__:
+        if name in ("atan2", "hypot"):
+            continue
+        arguments = values
+        if name == "acosh":
+            arguments = [1 + abs(value) for value in values]
+        elif name in ("log", "log10", "sqrt"):
+            arguments = [abs(value) for value in values]
+        function = getattr(uncertain_array_math, name)
+        assert_close(function(arguments if arguments is not values else x),
+                     [getattr(uncertain_math, name)(v) for v in arguments])
+
+
+def test_binary_functions():
+    for name in ("atan2", "hypot", "log"):
+        assert_close(getattr(uncertain_array_math, name)(
+                [abs(v) for v in values], others),
+                [getattr(uncertain_math, name)(abs(v), w)
+                 for (v, w) in zip(values, others)])
+
+
+def test_not_differentiable():
+    zero = UncertainVariable(0)
+    x = uncertain_array_math.sqrt([zero, UncertainVariable(0, 1), values[0]])
+    assert x.stat[0] == 0
+    assert numpy.isnan(x.stat[1])
+    assert x.stat[2] == uncertain_math.sqrt(values[0]).stat
+
+
+def test_wrap_vectorized():
+    square = wrap_vectorized(numpy.square, [lambda x: 2*x])
+    x = square(numpy.array([[1.], [2.]]) * UncertainArray.from_values(values))
+    assert x.shape == (2, 3)
+    assert_close(x[1], [(2*v)**2 for v in values])
+    assert square([1., 2.]).stat.tolist() == [0, 0]
+    try:
+        square("text")
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("strings accepted")
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing uncertain arrays, compared to calculations with single values
+
+@author: d0cod3r
+"""
+
+import numpy
+
+from .uncertain_values import UncertainVariable, to_affine_approximation
+from .uncertain_values import NegativeStandardDeviation
+from .uncertain_arrays import (UncertainArray, uarray, correlated_values,
+                              concatenate)
+
+
+a = UncertainVariable(20, 2, .2)
+b = UncertainVariable(30, 3, .3)
+c = UncertainVariable(12, 1, .2)
+d = UncertainVariable(0, 1)
+
+
+def assert_close(array_, values):
+    """
+    Compare an UncertainArray with a list of single uncertain values.
+    """
+    assert array_.shape == numpy.shape(numpy.asarray(values, dtype=object))
+    values = [to_affine_approximation(v) for v in
+              numpy.asarray(values, dtype=object).reshape(-1)]
+    assert numpy.allclose(array_.n.reshape(-1), [v.n for v in values])
+    assert numpy.allclose(array_.stat.reshape(-1), [v.stat for v in values],
+                          equal_nan=True)
+    assert numpy.allclose(array_.sys.reshape(-1), [v.sys for v in values],
+                          equal_nan=True)
+    for (element, value) in zip(array_.ravel(), values):
+        assert (element - value).stat <= 1e-9*value.stat
+
+
+def test_arithmetics():
+    x = UncertainArray.from_values([a, b, c])
+    y = UncertainArray.from_values([c, a*b, 2.])
+    assert_close(x + y, [a+c, b+a*b, c+2])
+    assert_close(x - y, [a-c, b-a*b, c-2])
+    assert_close(x * y, [a*c, b*a*b, c*2])
+    assert_close(x / y, [a/c, b/(a*b), c/2])
+    assert_close(x ** (y/100), [a**(c/100), b**(a*b/100), c**.02])
+    assert_close(-x, [-a, -b, -c])
+    assert_close(3 - x, [3-a, 3-b, 3-c])
+    assert_close(2 / x, [2/a, 2/b, 2/c])
+    assert_close(2 ** x, [2**a, 2**b, 2**c])
+
+
+def test_broadcasting():
+    x = UncertainArray.from_values([[a, b, c], [c, 1., b]])
+    y = UncertainArray.from_values([a, b, c])
+    assert_close(x * y, [[a*a, b*b, c*c], [c*a, b, b*c]])
+    assert_close(x + a, [[a+a, b+a, c+a], [c+a, 1+a, b+a]])
+    assert_close(a * x, [[a*a, a*b, a*c], [a*c, a, a*b]])
+    assert_close(x * numpy.array([[1.], [2.]]),
+                 [[a, b, c], [2*c, 2., 2*b]])
+
+
+def test_not_differentiable():
+    # sqrt(d) has no derivative in 0, but a and b are not affected
+    x = UncertainArray.from_values([a, b, d])
+    y = x ** .5
+    assert numpy.isnan(y.stat[2])
+    assert numpy.allclose(y.stat[:2], [(a**.5).stat, (b**.5).stat])
+
+
+def test_sparse():
+    values = [UncertainVariable(i, 1, .5) for i in range(1, 50)]
+    x = UncertainArray.from_values(values, sparse=True)
+    y = UncertainArray.from_values(values, sparse=False)
+    assert_close(x * a + x, [v*a + v for v in values])
+    assert_close(y * a + x, [v*a + v for v in values])
+    assert_close(x / x, [v/v for v in values])
+
+
+def test_indexing():
+    x = UncertainArray.from_values([[a, b], [c, a*b]])
+    assert x[1, 1].derivatives[a] == b.n
+    assert_close(x[0], [a, b])
+    assert_close(x[:, 1], [b, a*b])
+    assert len(x) == 2
+    assert len(x.tolist()[1]) == 2
+    assert_close(concatenate([x, [[a, c]], x[1:].to_sparse()]),
+                 [[a, b], [c, a*b], [a, c], [c, a*b]])
+    # integer keys are wrapped like by numpy
+    assert (x[-1, -2] - c).stat == 0
+    assert (x[numpy.int64(0), -1] - b).stat == 0
+    for key in ((2, 0), (0, -3), 5):
+        try:
+            x[key]
+        except IndexError:
+            pass
+        else:
+            raise AssertionError("index %r out of bounds accepted" % (key,))
+    # iterating reads the rows of the jacobian at once, also if sparse
+    for y in (x, x.to_sparse()):
+        assert_close(y, [[a, b], [c, a*b]])
+        rows = y.tolist()
+        for (row, values) in zip(rows, [[a, b], [c, a*b]]):
+            assert all((element - value).stat == 0
+                       for (element, value) in zip(row, values))
+        assert [len(element.derivatives) for element in y.ravel()] == [1, 1,
+                                                                       1, 2]
+
+
+def test_tiled_covariance_matrix(tmp_path):
+    from .uncertain_values import stat_cov_mat, sys_cov_mat
+    offset = UncertainVariable(1, 0, .1)
+    values = [UncertainVariable(i, .1*i) * (offset if i < 20 else 1.)
+              for i in range(1, 50)]
+    x = UncertainArray.from_values(values, sparse=True)
+    (stat_matrix, sys_matrix) = x.covariance_matrices()
+    assert numpy.allclose(stat_matrix, stat_cov_mat(*values))
+
+    assert numpy.allclose(stat_cov_mat(x, block_size=8), stat_matrix)
+    assert isinstance(stat_cov_mat(x, block_size=8), list)
+    assert isinstance(stat_cov_mat(x, block_size=8, as_array=True),
+                      numpy.ndarray)
+    assert numpy.allclose(sys_cov_mat(*values, block_size=7, sparse=True)
+                          .toarray(), sys_matrix)
+    on_disk = stat_cov_mat(x, block_size=10, out=str(tmp_path/"cov.npy"))
+    assert numpy.allclose(numpy.load(str(tmp_path/"cov.npy")), stat_matrix)
+    del on_disk
+
+    band = sys_cov_mat(x, block_size=6, band=2, processes=2, as_array=True)
+    distance = numpy.subtract.outer(numpy.arange(49), numpy.arange(49))
+    assert numpy.allclose(band, numpy.where(abs(distance) <= 2, sys_matrix, 0))
+
+
+def test_correlated_values():
+    stat_matrix = numpy.array([[4., 1., 0.], [1., 9., 3.], [0., 3., 2.]])
+    sys_matrix = numpy.full((3, 3), .25)
+    for method in ("eigh", "cholesky"):
+        x = correlated_values([1, 2, 3], stat_matrix, .25, method=method)
+        assert numpy.allclose(x.n, [1, 2, 3])
+        (stat_covariances, sys_covariances) = x.covariance_matrices()
+        assert numpy.allclose(stat_covariances, stat_matrix)
+        assert numpy.allclose(sys_covariances, sys_matrix)
+    # the scalar systematic covariance needs only one variable
+    assert x.jacobian.shape == (3, 4)
+
+    # a matrix of rank one needs only one variable
+    vector = numpy.array([1., 2., 3.])
+    x = correlated_values([0, 0, 0], numpy.outer(vector, vector))
+    assert x.jacobian.shape == (3, 1)
+    assert numpy.allclose(x.stat, vector)
+    assert numpy.allclose(x.sys, 0)
+
+    # low rank approximation keeps the greatest variance
+    x = correlated_values([0, 0], [[1., 0.], [0., 4.]], rank=1)
+    assert numpy.allclose(x.stat, [0, 2])
+
+
+def test_uarray():
+    x = uarray([[1, 2, 3], [4, 5, 6]], .5, [[.1], [.2]])
+    assert x.shape == (2, 3)
+    assert numpy.allclose(x.stat, .5)
+    assert numpy.allclose(x.sys, [[.1]*3, [.2]*3])
+    element = x[1, 2]
+    (variable,) = element.derivatives
+    assert variable.n == 6 and variable.stat == .5 and variable.sys == .2
+    assert_close(x[0]*a, [v*a for v in x[0]])
+    assert numpy.allclose(UncertainVariable.from_arrays([1, 2], [1, 2]).stat,
+                          [1, 2])
+    try:
+        uarray([1, 2], [1, -1])
+    except NegativeStandardDeviation:
+        pass
+    else:
+        raise AssertionError("negative standard deviation accepted")
+    from .uncertain_arrays import MAX_DENSE_IDENTITY
+    try:
+        uarray(numpy.zeros(MAX_DENSE_IDENTITY + 1), 1., sparse=False)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("huge dense jacobian built")
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing the rounding of uncertain values and tables
+
+@author: d0cod3r
+"""
+
+import csv
+import io
+
+from . import uncertain_values
+from .uncertain_values import UncertainVariable, to_affine_approximation
+from .uncertain_arrays import uarray
+from .uncertain_formatting import (format_value, formatted_rows, write_table,
+                                   format_table)
+
+
+a = UncertainVariable(1.23456, .0123, .002)
+b = UncertainVariable(12345.6, 567, 30)
+
+
+def test_format_value():
+    assert str(a) == "1.2346+-0.0123(stat)+-0.0020(sys)"
+    assert str(b) == "12346+-567(stat)+-30(sys)"
+    assert str(to_affine_approximation(2.5)) == "2.5+-0.0(stat)+-0.0(sys)"
+    assert format(a, ".2f") == "1.23+-0.01(stat)+-0.00(sys)"
+    assert "%s" % a == "{}".format(a) == str(a)
+    assert format_value(123456., 7654.) == ("123460", "7650", "0")
+    # the setting is read when formatting
+    uncertain_values.SIGNIFICANT_DIGITS = 1
+    try:
+        assert format_value(123456., 7654.) == ("123500", "7700", "0")
+        assert list(formatted_rows([[a]]))[0] == [("1.235", "0.012",
+                                                   "0.002")]
+    finally:
+        uncertain_values.SIGNIFICANT_DIGITS = 2
+
+
+def test_tables():
+    x = uarray([1., 2.5], [.1, 0])
+    columns = [[a, b], [3., a*b], x]
+    rows = list(formatted_rows(columns, block_size=1))
+    assert rows[0] == [("1.2346", "0.0123", "0.0020"),
+                       ("3.0", None, None), ("1.000", "0.100", "0.000")]
+    assert rows[1][2] == ("2.5", None, None)
+
+    text = format_table(columns, ["a", "b", "x"]).splitlines()
+    assert len(text) == 3 and len(set(len(line) for line in text)) == 1
+    assert text[1].split() == [str(a), "3.0", "1.000+-0.100(stat)+-0.000(sys)"]
+    # later blocks widen the columns, one block aligns all rows
+    column = [[1., 12345.]]
+    assert format_table(column).splitlines() == ["    1.0", "12345.0"]
+    file = io.StringIO()
+    write_table(file, column, block_size=1)
+    assert file.getvalue().splitlines() == ["1.0", "12345.0"]
+
+    table = list(csv.reader(io.StringIO(format_table(columns, ["a", "b", "x"],
+                                                     "csv"))))
+    assert table[0] == ["a", "a_stat", "a_sys", "b", "b_stat", "b_sys",
+                        "x", "x_stat", "x_sys"]
+    assert table[2][:3] == ["12346", "567", "30"]
+    assert table[2][6:] == ["2.5", "0", "0"]
+
+    latex = format_table(columns, style="latex").splitlines()
+    assert latex[0] == r"\begin{tabular}{ccc}" and latex[-1] == r"\end{tabular}"
+    assert latex[1].startswith(r"$1.2346 \pm 0.0123_\mathrm{stat}")
+    assert latex[1].endswith(r" \\")
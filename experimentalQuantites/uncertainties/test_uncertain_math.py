@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing the wrapped math functions against numeric derivatives
+
+@author: d0cod3r
+"""
+
+import math
+
+from .uncertain_values import UncertainVariable, partial_derivate
+from . import uncertain_math
+
+
+x = UncertainVariable(.7, .1, .01)
+y = UncertainVariable(2.5, .2)
+
+
+def assert_derivatives(name, *args):
+    function = getattr(math, name)
+    nominal_args = [arg.n for arg in args]
+    result = getattr(uncertain_math, name)(*args)
+    assert result.n == function(*nominal_args)
+    for (index, arg) in enumerate(args):
+        numeric = partial_derivate(function, index)(*nominal_args)
+        assert abs(result.derivatives[arg] - numeric) < 1e-6*(1+abs(numeric))
+
+
+def test_unary_functions():
+    for name in uncertain_math.__all__:
+        if name not in ("atan2", "hypot", "acosh"):
+            assert_derivatives(name, x)
+    assert_derivatives("acosh", y)
+
+
+def test_binary_functions():
+    for name in ("atan2", "hypot", "log"):
+        assert_derivatives(name, x, y)
+    result = x**y
+    assert abs(result.derivatives[x] - y.n*x.n**(y.n-1)) < 1e-12
+    assert abs(result.derivatives[y] - math.log(x.n)*x.n**y.n) < 1e-12
+    result = 2**x
+    assert abs(result.derivatives[x] - math.log(2)*2**x.n) < 1e-12
+
+
+def test_not_differentiable():
+    zero = UncertainVariable(0)
+    assert uncertain_math.sqrt(zero).stat == 0
+    assert math.isnan(uncertain_math.sqrt(UncertainVariable(0, 1)).stat)
+    assert uncertain_math.hypot(zero, 0.).stat == 0
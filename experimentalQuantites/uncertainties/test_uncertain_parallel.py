@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing the parallel map against calculations in this process
+
+@author: d0cod3r
+"""
+
+import math
+
+from .uncertain_values import UncertainVariable
+from .uncertain_parallel import parallel_map
+from . import uncertain_math
+
+
+offset = UncertainVariable(1, 0, .1)
+events = [UncertainVariable(i, .1*i)*offset for i in range(1, 40)]
+
+
+def response(x, gain):
+    # accepts dual numbers
+    return gain*uncertain_math.sqrt(x) + x**2/3
+
+
+def plain_response(x, gain):
+    # needs floats, derivatives are calculated numerically
+    return gain*math.sqrt(x) + x**2/3
+
+
+def test_parallel_map():
+    gains = [2.]*len(events)
+    gains[3] = offset
+    for function in (response, plain_response):
+        results = parallel_map(function, events, gains, processes=2,
+                               chunksize=8)
+        assert len(results) == len(events)
+        for (result, event, gain) in zip(results, events, gains):
+            expected = response(event, gain)
+            assert abs(result.n - expected.n) < 1e-12
+            # the correlations to the variables are kept
+            assert (result - expected).stat < 1e-6*expected.stat
+            assert (result - expected).sys < 1e-6*expected.sys
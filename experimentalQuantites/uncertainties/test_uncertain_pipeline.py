@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing the chunked pipeline against a calculation with all values at once
+
+@author: d0cod3r
+"""
+
+import numpy
+
+from .uncertain_values import UncertainVariable
+from .uncertain_arrays import uarray, concatenate
+from .uncertain_pipeline import chunked_map
+from . import uncertain_array_math
+
+
+offset = UncertainVariable(1, 0, .1)
+gain = UncertainVariable(2, .01, .05)
+
+
+def calibrate(x, gain):
+    return gain*uncertain_array_math.sqrt(x + 1) + x**2/3
+
+
+def calibrate_both(x, gain):
+    return (calibrate(x, gain), x.nominal_values)
+
+
+def test_chunked_map():
+    x = uarray(numpy.arange(40.), stat=.1)*offset
+    expected = calibrate(x, gain)
+    chunks = (x[i:i+7] for i in range(0, 40, 7))
+    results = list(chunked_map(calibrate, chunks, shared=(gain,),
+                               processes=2, max_pending=2))
+    assert len(results) == 6
+    result = concatenate(results)
+    assert numpy.allclose(result.n, expected.n)
+    # the correlations between the chunks are kept
+    assert numpy.allclose((result - expected).stat, 0)
+    assert numpy.allclose((result - expected).sys, 0)
+    assert numpy.allclose(result.covariance_matrices()[1],
+                          expected.covariance_matrices()[1])
+
+    # tuples of arguments and of results
+    results = list(chunked_map(calibrate_both, [(x[:20], gain), (x[20:], 2.)],
+                               processes=1))
+    assert numpy.allclose(results[0][0].n, expected.n[:20])
+    assert numpy.allclose(results[1][1], x.n[20:])
+
+
+# a constant of this module, known to the workers without being sent
+c0 = UncertainVariable(3, .2, .1)
+
+
+def calibrate_with_constant(x):
+    return c0*x + c0
+
+
+def test_module_constants():
+    # more variables than the constant, so the positions of the columns of
+    # a chunk are indices of other variables in the workers
+    x = uarray(numpy.arange(1., 11.), stat=.1)*offset
+    expected = calibrate_with_constant(x)
+    results = list(chunked_map(calibrate_with_constant,
+                               (x[i:i+5] for i in range(0, 10, 5)),
+                               processes=1))
+    result = concatenate(results)
+    assert numpy.allclose(result.n, expected.n)
+    assert numpy.allclose((result - expected).stat, 0)
+    assert numpy.allclose((result - expected).sys, 0)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing that serialized uncertain values keep their correlations
+
+@author: d0cod3r
+"""
+
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from .uncertain_values import (UncertainVariable, registry,
+                               to_affine_approximation)
+from .uncertain_arrays import UncertainArray, uarray
+from .uncertain_serialization import dumps, loads, dump, load
+
+
+a = UncertainVariable(20, 2, .2)
+b = UncertainVariable(30, 3, .3)
+
+
+def assert_same(value, expected):
+    expected = to_affine_approximation(expected)
+    assert value.n == expected.n
+    assert (value - expected).stat == 0 and (value - expected).sys == 0
+
+
+def test_round_trip(tmp_path):
+    values = [a*b, a+1, 2., b, a/b]
+    restored = loads(dumps(values))
+    for (value, expected) in zip(restored, values):
+        assert_same(value, expected)
+    dump(values, str(tmp_path/"values.bin"))
+    for (value, expected) in zip(load(str(tmp_path/"values.bin")), values):
+        assert_same(value, expected)
+
+    x = UncertainArray.from_values([[a, b], [a*b, 3.]])
+    y = loads(dumps(x))
+    assert y.shape == (2, 2)
+    for (value, expected) in zip(y.ravel(), x.ravel()):
+        assert_same(value, expected)
+
+
+def test_pickle():
+    values = [a, a*b, UncertainArray.from_values([a, a*b]).to_sparse()]
+    restored = pickle.loads(pickle.dumps(values))
+    # the variable is the same object
+    assert restored[0] is a
+    assert_same(restored[1], values[1])
+    assert_same(restored[2][1], values[1])
+
+
+def test_foreign_variables():
+    # variables of another registry are created once
+    data = dumps([a*b])
+    other_token = b"\0"*16
+    data = data.replace(registry.token, other_token)
+    size = len(registry)
+    (first,) = loads(data)
+    (second,) = loads(data)
+    assert len(registry) == size + 2
+    assert (first - second).stat == 0
+    assert first.n == (a*b).n and abs(first.stat - (a*b).stat) < 1e-12
+    # and are shipped back with their origin
+    (third,) = loads(dumps([first*2]))
+    assert_same(third, first*2)
+
+
+def double(value):
+    return value*2
+
+
+def test_processes():
+    x = uarray(numpy.arange(100.), .1)
+    with ProcessPoolExecutor(2) as executor:
+        (value, array_) = executor.map(double, [a*b, x])
+    assert_same(value, 2*a*b)
+    assert numpy.allclose((array_ - 2*x).stat, 0)
+    assert numpy.allclose(array_.stat, .2)
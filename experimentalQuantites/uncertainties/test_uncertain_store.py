@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing that stored uncertain values are read back with their correlations
+
+@author: d0cod3r
+"""
+
+import numpy
+
+from .uncertain_values import UncertainVariable, to_affine_approximation
+from .uncertain_arrays import UncertainArray, uarray
+from .uncertain_store import save_store, open_store
+
+
+a = UncertainVariable(20, 2, .2)
+b = UncertainVariable(30, 3, .3)
+
+
+def assert_same(value, expected):
+    expected = to_affine_approximation(expected)
+    assert numpy.isclose(value.n, expected.n)
+    difference = value - expected
+    assert abs(difference.stat) < 1e-12 and abs(difference.sys) < 1e-12
+
+
+def test_store(tmp_path):
+    values = [a*b, a+1, 2., b, a/b]
+    save_store(str(tmp_path/"values"), values)
+    store = open_store(str(tmp_path/"values"))
+    assert len(store) == 5 and store.shape == (5,)
+    assert numpy.allclose(store.n, [v.n if hasattr(v, "n") else v
+                                    for v in values])
+    assert numpy.allclose(store.stat[:2], [values[0].stat, values[1].stat])
+    assert numpy.allclose(store.sys[3:], [b.sys, values[4].sys])
+
+    assert_same(store[0], values[0])
+    assert_same(store[-1], values[4])
+    for (key, expected) in ((slice(1, 4), values[1:4]),
+                            (slice(None, None, 2), values[::2]),
+                            ([4, 0], [values[4], values[0]]),
+                            (numpy.array([True, False, False, True, False]),
+                             [values[0], values[3]])):
+        loaded = store[key]
+        assert isinstance(loaded, UncertainArray)
+        for (value, expected_value) in zip(loaded.tolist(), expected):
+            assert_same(value, expected_value)
+
+    # the values are correlated with the original variables
+    assert (store[3] - b).stat == 0
+
+    covariances = UncertainArray.from_values(values).covariance_matrices()
+    assert numpy.allclose(store.covariance_block(slice(None)), covariances[0])
+    assert numpy.allclose(store.covariance_block([0, 1], slice(3, 5), "sys"),
+                          covariances[1][:2, 3:5])
+
+
+def test_store_array(tmp_path):
+    x = uarray(numpy.arange(12.).reshape(3, 4), stat=.5, sys=.1)
+    y = x*x[0] + 1
+    save_store(str(tmp_path/"array"), y)
+    store = open_store(str(tmp_path/"array"))
+    assert store.shape == (3, 4)
+    loaded = store.load()
+    assert loaded.shape == (3, 4)
+    assert numpy.allclose(loaded.n, y.n)
+    assert numpy.allclose(store.stat, y.stat.reshape(-1))
+    assert numpy.allclose((loaded - y).stat, 0)
+    assert numpy.allclose(store.covariance_block(slice(2, 6), [0, 11]),
+                          y.covariance_matrices()[0][2:6][:, [0, 11]])
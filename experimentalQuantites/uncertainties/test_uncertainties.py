@@ -6,7 +6,14 @@ Testing uncertaincys
 @author: d0cod3r
 """
 
-from uncertain_values import *
+try:
+    # imported as part of the package, e.g. by pytest
+    from .uncertain_values import *
+    from .uncertain_values import AffineApproximation, LinearPart, registry
+except ImportError:
+    # run as a script from this directory
+    from uncertain_values import *
+    from uncertain_values import AffineApproximation, LinearPart, registry
 
 a = UncertainVariable(20, 2, .2)
 b = UncertainVariable(30, 3, .3)
@@ -17,4 +24,401 @@ assert x.n == 70.0
 assert x.stat == 5.0
 assert x.sys == 0.5
 
-y = [a*b, a*2, 2*a, a+2, 2+a, 2/a, b/3, c/b, x-b, 3*(-a)]
\ No newline at end of file
+y = [a*b, a*2, 2*a, a+2, 2+a, 2/a, b/3, c/b, x-b, 3*(-a)]
+
+
+def test_shared_intermediate_results():
+    # y is reached on several paths, the derivatives of all paths are summed
+    y = a*b
+    z = y*y + y/3 - 2*y
+    dz_dy = 2*y.n + 1/3 - 2
+    assert abs(z.derivatives[a] - dz_dy*b.n) < 1e-9
+    assert abs(z.derivatives[b] - dz_dy*a.n) < 1e-9
+    assert len(z.derivatives) == 2
+
+
+def test_deep_diamond_graph():
+    # 3**200 paths, only feasible if every node is visited once
+    y = a
+    for _ in range(200):
+        y = y + y*0.5 - y*0.5
+    assert abs(y.derivatives[a] - 1) < 1e-9
+    assert y.stat == a.stat
+
+
+
+def test_registry():
+    index = c.index
+    assert registry.variable(index) is c
+    assert registry.stat_std_devs[index] == 1.
+    assert registry.sys_std_devs[index] == .2
+    
+    # the object of a variable is recreated when needed
+    y = 3*UncertainVariable(5, .5)
+    (variable,) = y.derivatives
+    variable_index = variable.index
+    del variable
+    import gc
+    gc.collect()
+    (variable,) = y.derivatives
+    assert variable.index == variable_index
+    assert variable.n == 5 and variable.stat == .5
+    assert y.derivatives[variable] == 3
+
+
+def test_free_slots():
+    import gc
+    import pickle
+    from math import sqrt
+    gc.collect()
+    size = len(registry)
+    variables = [UncertainVariable(1., .1) for _ in range(50000)]
+    total = sum(variables[:3], 0.)
+    data = pickle.dumps(total)
+    del variables
+    gc.collect()
+    # the sum still refers to its three variables
+    assert len(registry) == size + 3
+    assert abs(total.stat - sqrt(3)*.1) < 1e-12
+    del total
+    gc.collect()
+    assert len(registry) == size
+    assert len(registry.stat_std_devs) < 50000
+    # the slots are reused, but the old values are not confused with the
+    # new variables
+    reused = [UncertainVariable(4., .4) for _ in range(3)]
+    assert registry.origin(reused[0].index) != (registry.token,
+                                                reused[0].index)
+    loaded = pickle.loads(data)
+    assert not set(loaded.derivatives) & set(reused)
+    assert abs(loaded.stat - sqrt(3)*.1) < 1e-12
+    assert len(registry) == size + 6
+    # the variables of a value are shared with copies that live longer
+    again = pickle.loads(data)
+    del loaded
+    gc.collect()
+    assert abs(again.stat - sqrt(3)*.1) < 1e-12
+    assert len(registry) == size + 6
+
+
+def test_long_linear_combination():
+    # long enough to be added up with numpy, if available
+    values = [UncertainVariable(i, 3, 4) for i in range(200)]
+    total = values[0]
+    for value in values[1:]:
+        total = total + value
+    total = total - values[0]
+    assert total.n == sum(range(200))
+    assert abs(total.stat - 3*199**.5) < 1e-9
+    assert abs(total.sys - 4*199**.5) < 1e-9
+    assert total.derivatives[values[0]] == 0
+    assert len(total.stat_components()) == 200
+
+
+def test_cached_uncertainties():
+    y = a*b + c
+    assert y.standard_deviations() == (y.stat, y.sys)
+    assert y.standard_deviations() is y.standard_deviations()
+    (stat_components, sys_components) = y.uncertainty_components()
+    assert y.stat_components() is stat_components
+    assert y.sys_components() is sys_components
+    assert stat_components[c] == 1.
+    assert abs(sys_components[a] - b.n*a.sys) < 1e-12
+    assert abs(sum(d**2 for d in sys_components.values()) - y.sys**2) < 1e-9
+
+
+def test_covariance_matrices():
+    values = [x, a*b, b, 3.]
+    assert stat_cov_mat(*values)[0] == [25., 420., 9., 0.]
+    assert abs(sys_cov_mat(x, a)[0][1] - .08) < 1e-12
+    (stat_matrix, sys_matrix) = covariance_matrices(*values)
+    assert stat_matrix == stat_cov_mat(*values)
+    assert sys_matrix == sys_cov_mat(*values)
+    for i in range(3):
+        assert abs(stat_matrix[i][i] - values[i].stat**2) < 1e-9
+        assert abs(sys_matrix[i][i] - values[i].sys**2) < 1e-9
+    assert abs(stat_corr_mat(x, b)[0][1] - 3/5) < 1e-12
+    assert abs(stat_corr_mat(b, x, 2*b)[2][0] - 1) < 1e-12
+
+
+def test_wrap():
+    from math import atan2, log as math_log
+    wrapped_atan2 = wrap(atan2, [lambda x, y: y/(x**2+y**2),
+                                 lambda x, y: -x/(x**2+y**2)])
+    for (x_, y_) in ((a, b), (a, 30.), (20, b), (20., 30)):
+        result = wrapped_atan2(x_, y_)
+        assert result.n == atan2(20., 30.)
+        expected = (a.stat*30/1300 if x_ is a else 0, 
+                    b.stat*20/1300 if y_ is b else 0)
+        assert abs(result.stat - (expected[0]**2 + expected[1]**2)**.5) < 1e-12
+    
+    # the derivatives limit the arguments, but fewer can be given
+    wrapped_log = wrap(math_log, [lambda x, base=None: 1/x/math_log(base)
+                                  if base else 1/x, None])
+    assert abs(wrapped_log(a).stat - a.stat/a.n) < 1e-12
+    assert abs(wrapped_log(a, 10).stat - a.stat/a.n/math_log(10)) < 1e-12
+    assert "atan2" in wrapped_atan2.__doc__
+
+
+def test_automatic_differentiation():
+    from math import sqrt as math_sqrt
+    calls = []
+    def response(gain, offset, x, y):
+        calls.append(gain)
+        if x > y:
+            x, y = y, x
+        return gain*(x**2 - y/offset)**.5 + abs(-offset)
+    wrapped_response = wrap(response)
+    result = wrapped_response(a, c, 30., b)
+    assert len(calls) == 1
+    # derivatives of the branch taken for x <= y
+    root = (30.**2 - b.n/c.n)**.5
+    expected = {a: root, c: a.n*b.n/c.n**2/2/root + 1,
+                b: -a.n/c.n/2/root}
+    for (variable, derivative) in expected.items():
+        assert abs(result.derivatives[variable] - derivative) < 1e-12
+    assert result.n == response(a.n, c.n, 30., b.n)
+    
+    # functions of the math module do not accept dual numbers, wrapped ones do
+    wrapped_sqrt = wrap(math_sqrt)
+    assert abs(wrapped_sqrt(a).derivatives[a] - 1/2/a.n**.5) < 1e-7
+    wrapped = wrap(lambda x, y: wrapped_sqrt(x*y) / y)
+    result = wrapped(a, b)
+    assert abs(result.derivatives[a] - 1/2/(a.n*b.n)**.5) < 1e-7
+    assert wrap(lambda x: 3)(a).stat == 0
+
+
+def test_automatic_differentiation_fallback():
+    from math import sqrt as math_sqrt
+    argument_types = []
+    def response(x):
+        argument_types.append(type(x))
+        # raises a TypeError for dual numbers
+        return math_sqrt(x)
+    wrapped_response = wrap(response)
+    result = wrapped_response(a)
+    assert abs(result.derivatives[a] - 1/2/a.n**.5) < 1e-7
+    # one call with dual numbers, then numeric derivatives
+    assert len(argument_types) == 4
+    assert argument_types.count(float) == 3
+    # the fallback is decided per call
+    def branch(x):
+        # uses the math module only for large arguments
+        return math_sqrt(x) if x > 25 else x**2
+    wrapped_branch = wrap(branch)
+    assert abs(wrapped_branch(b).derivatives[b] - 1/2/b.n**.5) < 1e-7
+    assert wrapped_branch(a).derivatives[a] == 2*a.n
+    # attributes of floats and other errors fall back as well
+    x = UncertainVariable(.5, .1)
+    assert wrap(lambda t: t.real**2)(x).derivatives[x] == 1.
+    def fails(t):
+        raise ValueError("not for dual numbers")
+    try:
+        wrap(fails)(x)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("error of the function lost")
+
+
+def test_wrap_executor():
+    from concurrent.futures import ThreadPoolExecutor
+    from math import atan2
+    with ThreadPoolExecutor(4) as executor:
+        parallel_atan2 = wrap(atan2, [None, lambda x, y: -x/(x**2+y**2)],
+                              executor=executor)
+        result = parallel_atan2(a, b)
+        expected = wrap(atan2)(a, b)
+        assert result.n == expected.n
+        for variable in (a, b):
+            assert abs(result.derivatives[variable]
+                       - expected.derivatives[variable]) < 1e-9
+        assert wrap(atan2, executor=executor)(20., b).n == atan2(20., 30.)
+        
+        # the exception of the nominal value is raised
+        try:
+            wrap(lambda x: 1/x, executor=executor)(UncertainVariable(0, 1))
+        except ZeroDivisionError:
+            pass
+        else:
+            raise AssertionError("no exception raised")
+
+
+def test_wrap_cache():
+    from math import atan2
+    cached = wrap(atan2, cache=2)
+    expected = wrap(atan2)(a, b)
+    for _ in range(3):
+        result = cached(a, b)
+        assert result.n == expected.n
+        assert result.derivatives == expected.derivatives
+    assert cached.cache_info() == (2, 1, 2, 1)
+    # other uncertainties with the same nominal values use the same entry
+    other = cached(UncertainVariable(20, 1), b)
+    assert cached.cache_info().hits == 3
+    assert abs(other.stat - (expected.stat**2 - (a.stat**2-1)
+                             *expected.derivatives[a]**2)**.5) < 1e-12
+    # certain arguments are part of the key
+    assert cached(a, 30.).n == expected.n
+    # the least recently used entry is dropped
+    cached(b, a)
+    cached(a, b)
+    assert cached.cache_info() == (3, 4, 2, 2)
+    cached.cache_clear()
+    assert cached.cache_info() == (0, 0, 2, 0)
+
+
+def test_max_depth():
+    readings = [UncertainVariable(i, 1) for i in range(200)]
+    previous = set_max_depth(10)
+    try:
+        total = readings[0]
+        for reading in readings[1:]:
+            total = total + reading
+    finally:
+        set_max_depth(previous)
+    # only the intermediate results since the last expansion are referenced
+    (pending, _) = total._linear_part._topological_order()
+    assert len(pending) <= 11
+    assert total.n == sum(range(200))
+    assert abs(total.stat - 200**.5) < 1e-12
+    
+    value = readings[0]
+    for _ in range(50):
+        value = value*1.01
+    value = (value + readings[1]).freeze()
+    assert value._linear_part.is_expanded()
+    assert abs(value.derivatives[readings[0]] - 1.01**50) < 1e-12
+
+
+def test_max_depth_with_cache():
+    # eagerly expanded results must not confuse the cache of wrap
+    from math import atan2
+    previous = set_max_depth(1)
+    try:
+        for cached in (wrap(atan2, cache=4), wrap(atan2, [None, None],
+                                                   cache=4)):
+            y = (a*1.)*1.
+            expected = wrap(atan2)(y, b)
+            for _ in range(2):
+                result = cached(y, b)
+                assert abs(result.stat - expected.stat) < 1e-9
+                assert abs(result.sys - expected.sys) < 1e-9
+            assert cached.cache_info().hits == 1
+            assert abs(cached(b, y).stat - wrap(atan2)(b, y).stat) < 1e-9
+    finally:
+        set_max_depth(previous)
+
+
+def test_shared_subexpressions():
+    def generated(x, y):
+        # like generated code, with repeated and cancelling expressions
+        return (x*y + sqrt_like(x*y))*1 - (y*x - y*x) + (x/x)*(x*y)
+    
+    def sqrt_like(z):
+        return z**.5
+    
+    plain = generated(a, b)
+    with shared_subexpressions():
+        shared = generated(a, b)
+        assert a*b is b*a and a*1 is a and (a - a).stat == 0
+        assert (a/a).n == 1 and not (a/a).derivatives
+        assert a**2 is a**2 and 2 + a is a + 2
+    assert a*b is not a*b
+    
+    # wrapped functions share their results, without a wrapper of their own
+    import math
+    sin = wrap(math.sin, [math.cos], cache=4)
+    assert sin.__code__.co_varnames[0] == "args"
+    square = wrap(lambda x: x*x, [lambda x: 2*x])
+    assert square.__code__.co_varnames[0] == "x"
+    with shared_subexpressions():
+        assert sin(a) is sin(a) and square(a) is square(a)
+        assert sin(2.) is sin(2.)
+    assert sin.cache_info().misses == 2 and sin.cache_info().hits == 0
+    assert square(a) is not square(a)
+    assert shared.n == plain.n
+    assert (shared - plain).stat < 1e-12 and (shared - plain).sys < 1e-12
+    (shared_nodes, _) = shared._linear_part._topological_order()
+    (plain_nodes, _) = plain._linear_part._topological_order()
+    assert len(shared_nodes) < len(plain_nodes)
+
+
+def test_shared_subexpressions_in_threads():
+    from threading import Thread, Event
+    
+    entered = [Event(), Event()]
+    left = Event()
+    results = []
+    
+    def first():
+        with shared_subexpressions():
+            entered[0].set()
+            entered[1].wait()
+            results.append(a*b is a*b)
+        # leaves before the second thread
+        left.set()
+    
+    def second():
+        entered[0].wait()
+        with shared_subexpressions():
+            entered[1].set()
+            left.wait()
+            results.append(a*b is a*b)
+    
+    threads = [Thread(target=first), Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    entered[1].wait()
+    # the contexts of other threads do not apply here
+    assert a*b is not a*b
+    for thread in threads:
+        thread.join()
+    assert results == [True, True]
+    assert a*b is not a*b
+
+
+def test_concurrent_expansion():
+    import sys as system
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def graph(variables):
+        # intermediate results shared by many values
+        results = []
+        y = variables[0]
+        for (i, variable) in enumerate(variables[1:]):
+            y = y*y/y + variable/3
+            results.extend([y, y*(i+1), y - variable])
+        return results
+    
+    variables = [UncertainVariable(i, .1*i, .01) for i in range(1, 30)]
+    expected = [value.standard_deviations() for value in graph(variables)]
+    
+    interval = system.getswitchinterval()
+    system.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            for _ in range(20):
+                values = graph(variables)
+                # every thread expands values in another order
+                orders = [values[i::3] + values[:i:3] for i in range(8)]
+                futures = [executor.submit(lambda order: [
+                        value._linear_part.get_linear_combo() and
+                        value.standard_deviations() for value in order], order)
+                           for order in orders]
+                for future in futures:
+                    future.result()
+                for (value, std_devs) in zip(values, expected):
+                    assert abs(value.stat - std_devs[0]) <= 1e-9*std_devs[0]
+                    assert abs(value.sys - std_devs[1]) <= 1e-9*std_devs[1]
+            
+            # variables created at once get different indices
+            size = len(registry)
+            created = list(executor.map(lambda i: UncertainVariable(i, 1),
+                                        range(2000)))
+            assert len({variable.index for variable in created}) == 2000
+            assert len(registry) == size + 2000
+            assert all(registry.stat_std_devs[variable.index] == 1
+                       for variable in created)
+    finally:
+        system.setswitchinterval(interval)
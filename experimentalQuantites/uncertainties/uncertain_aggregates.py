@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file defines sums, dot products and means of many uncertain values.
+
+ Adding up n values with sum() creates n-1 intermediate results, which have
+ to be walked through when the result is expanded. The functions here
+ build a result with one LinearPart referencing all n values directly, so
+ the expansion is a single merge of their linear combinations. The values
+ can be given by any iterable, including generators.
+
+ For streams of values that can not be kept in memory, the accumulators
+ SumAccumulator, MeanAccumulator and WeightedMeanAccumulator fold every
+ value into an expanded linear combination. Their memory grows with the
+ amount of independent variables, not with the amount of values. They are
+ pickled with the origins of their variables, so accumulators of other
+ processes can be merged.
+
+ @author: d0cod3r
+"""
+
+
+from array import array
+
+from .uncertain_values import (AffineApproximation, LinearPart,
+                               FLOAT_LIKE_TYPES)
+
+
+def _split(value):
+    """
+    Return the nominal value and the LinearPart of a value, None for floats.
+    """
+    if isinstance(value, AffineApproximation):
+        return (value._nominal_value, value._linear_part)
+    if isinstance(value, FLOAT_LIKE_TYPES):
+        return (value, None)
+    raise TypeError("Can not calculate with values of the type %s."
+                    % type(value).__name__)
+
+
+def usum(values):
+    """
+    Return the sum of the uncertain values and floats given by an iterable.
+    """
+    total = 0.
+    linear_combo = []
+    for value in values:
+        (nominal_value, linear_part) = _split(value)
+        total += nominal_value
+        if linear_part is not None:
+            linear_combo.append((linear_part, 1.))
+    return AffineApproximation(total, LinearPart(linear_combo))
+
+
+def udot(weights, values):
+    """
+    Return the sum of weights[i]*values[i]. Both iterables can contain
+    uncertain values and floats and must have the same length.
+    """
+    total = 0.
+    linear_combo = []
+    length_error = ValueError("weights and values must have the same length.")
+    values = iter(values)
+    for weight in weights:
+        try:
+            value = next(values)
+        except StopIteration:
+            raise length_error
+        (nominal_weight, weight_part) = _split(weight)
+        (nominal_value, value_part) = _split(value)
+        total += nominal_weight*nominal_value
+        # product rule
+        if weight_part is not None:
+            linear_combo.append((weight_part, nominal_value))
+        if value_part is not None:
+            linear_combo.append((value_part, nominal_weight))
+    for _ in values:
+        raise length_error
+    return AffineApproximation(total, LinearPart(linear_combo))
+
+
+def umean(values):
+    """
+    Return the arithmetic mean of the uncertain values and floats given by
+    an iterable.
+    """
+    total = 0.
+    linear_parts = []
+    count = 0
+    for value in values:
+        (nominal_value, linear_part) = _split(value)
+        total += nominal_value
+        if linear_part is not None:
+            linear_parts.append(linear_part)
+        count += 1
+    if count == 0:
+        raise ValueError("The mean of no values is not defined.")
+    return AffineApproximation(total/count, LinearPart(
+            [(linear_part, 1/count) for linear_part in linear_parts]))
+
+
+def _inverse_variance(value, uncertainty):
+    """
+    Return the weight of an uncertain value in a weighted mean.
+    """
+    if not isinstance(value, AffineApproximation):
+        raise TypeError("A weighted mean needs uncertain values.")
+    (stat, sys) = value.standard_deviations()
+    variance = {"stat": stat**2, "sys": sys**2,
+                "total": stat**2 + sys**2}[uncertainty]
+    if not variance > 0:
+        raise ValueError("Values without uncertainty can not be weighted by "
+                         "it.")
+    return 1/variance
+
+
+def weighted_mean(values, uncertainty="stat"):
+    """
+    Return the mean of the uncertain values given by an iterable, weighted
+    with their inverse variances. The weights are treated as exact, the
+    correlations of the values are considered in the result.
+
+    uncertainty -- the uncertainty used for the weights: "stat" or "sys"
+    for the statistical respectively systematic standard deviation or
+    "total" for both added in quadrature
+    """
+    if uncertainty not in ("stat", "sys", "total"):
+        raise ValueError('uncertainty must be "stat", "sys" or "total".')
+
+    weighted_total = 0.
+    total_weight = 0.
+    weighted_parts = []
+    for value in values:
+        weight = _inverse_variance(value, uncertainty)
+        weighted_total += weight*value._nominal_value
+        total_weight += weight
+        weighted_parts.append((value._linear_part, weight))
+    if not weighted_parts:
+        raise ValueError("The mean of no values is not defined.")
+    return AffineApproximation(weighted_total/total_weight, LinearPart(
+            [(linear_part, weight/total_weight) for (linear_part, weight)
+             in weighted_parts]))
+
+
+class Accumulator(object):
+    """
+    Base class of the accumulators. It keeps the weighted sum of the values
+    added so far, with the linear part expanded to a map from the indices
+    of the independent variables to their coefficients, and the count and
+    the sum of the weights.
+
+    Subclasses define the weight of a value and the value property.
+    """
+
+    # _owners keeps the accumulated variables in the registry, see
+    # VariableRegistry
+    __slots__ = ("_nominal_value", "_coefficients", "_owners", "_count",
+                 "_total_weight")
+
+    def __init__(self, values=()):
+        """
+        Create an accumulator and add the values of an iterable.
+        """
+        self._nominal_value = 0.
+        self._coefficients = {}
+        self._owners = set()
+        self._count = 0
+        self._total_weight = 0.
+        self.extend(values)
+
+    def _weight(self, value):
+        return 1.
+
+    def add(self, value):
+        """
+        Add an uncertain value or a float.
+        """
+        weight = self._weight(value)
+        if isinstance(value, AffineApproximation):
+            (indices, coefficients) = value._linear_part.get_linear_combo()
+            self._owners.update(value._linear_part._owners)
+            accumulated = self._coefficients
+            for (index, coefficient) in zip(indices, coefficients):
+                accumulated[index] = (accumulated.get(index, 0.)
+                                      + weight*coefficient)
+            nominal_value = value._nominal_value
+        elif isinstance(value, FLOAT_LIKE_TYPES):
+            nominal_value = value
+        else:
+            raise TypeError("Can not calculate with values of the type %s."
+                            % type(value).__name__)
+        self._nominal_value += weight*nominal_value
+        self._count += 1
+        self._total_weight += weight
+
+    def extend(self, values):
+        """
+        Add all values of an iterable.
+        """
+        for value in values:
+            self.add(value)
+
+    def __getstate__(self):
+        # The indices of the variables are only valid in the registry of
+        # this process. The accumulated sum is pickled as an uncertain
+        # value, which keeps the origins of its variables (see
+        # uncertain_serialization), so an accumulator sent from another
+        # process is merged with the right variables.
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                state[name] = getattr(self, name)
+        state["_coefficients"] = self._snapshot(1.)
+        del state["_owners"]
+        return state
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+        linear_part = self._coefficients._linear_part
+        (indices, coefficients) = linear_part.get_linear_combo()
+        self._coefficients = dict(zip(indices, coefficients))
+        self._owners = set(linear_part._owners)
+
+    def merge(self, other):
+        """
+        Add everything accumulated by another accumulator of the same kind,
+        e.g. from another thread, or from another process if it was sent
+        pickled. Returns this accumulator.
+        """
+        if type(other) is not type(self) or not self._compatible(other):
+            raise TypeError("Only accumulators of the same kind can be "
+                            "merged.")
+        accumulated = self._coefficients
+        for (index, coefficient) in other._coefficients.items():
+            accumulated[index] = accumulated.get(index, 0.) + coefficient
+        self._owners.update(other._owners)
+        self._nominal_value += other._nominal_value
+        self._count += other._count
+        self._total_weight += other._total_weight
+        return self
+
+    def _compatible(self, other):
+        return True
+
+    def __len__(self):
+        """
+        Amount of values added.
+        """
+        return self._count
+
+    def _snapshot(self, factor):
+        """
+        Return the accumulated sum multiplied with factor as an
+        AffineApproximation, which does not change with later additions.
+        """
+        indices = sorted(self._coefficients)
+        coefficients = [factor*self._coefficients[i] for i in indices]
+        return AffineApproximation(factor*self._nominal_value, LinearPart(
+                (array("q", indices), array("d", coefficients)),
+                tuple(self._owners)))
+
+
+class SumAccumulator(Accumulator):
+    """
+    Accumulates the sum of uncertain values and floats.
+    """
+
+    __slots__ = ()
+
+    @property
+    def value(self):
+        """
+        The sum of the values added so far.
+        """
+        return self._snapshot(1.)
+
+
+class MeanAccumulator(Accumulator):
+    """
+    Accumulates the arithmetic mean of uncertain values and floats.
+    """
+
+    __slots__ = ()
+
+    @property
+    def value(self):
+        """
+        The mean of the values added so far.
+        """
+        if self._count == 0:
+            raise ValueError("The mean of no values is not defined.")
+        return self._snapshot(1/self._count)
+
+
+class WeightedMeanAccumulator(Accumulator):
+    """
+    Accumulates the mean of uncertain values weighted with their inverse
+    variances, see weighted_mean.
+    """
+
+    __slots__ = ("_uncertainty",)
+
+    def __init__(self, values=(), uncertainty="stat"):
+        """
+        Create an accumulator and add the values of an iterable.
+
+        uncertainty -- the uncertainty used for the weights: "stat", "sys"
+        or "total"
+        """
+        if uncertainty not in ("stat", "sys", "total"):
+            raise ValueError('uncertainty must be "stat", "sys" or "total".')
+        self._uncertainty = uncertainty
+        Accumulator.__init__(self, values)
+
+    def _weight(self, value):
+        return _inverse_variance(value, self._uncertainty)
+
+    def _compatible(self, other):
+        return self._uncertainty == other._uncertainty
+
+    @property
+    def value(self):
+        """
+        The weighted mean of the values added so far.
+        """
+        if self._count == 0:
+            raise ValueError("The mean of no values is not defined.")
+        return self._snapshot(1/self._total_weight)
+
+
+__all__ = ["usum", "udot", "umean", "weighted_mean", "SumAccumulator",
+           "MeanAccumulator", "WeightedMeanAccumulator"]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+ In this file, the functions of uncertain_math are defined for
+ UncertainArrays, using numpy. They also accept (nested) lists of uncertain
+ values, numpy arrays and floats and always return an UncertainArray.
+
+ erf and erfc use scipy if available, otherwise math.erf is called for
+ every element.
+
+ @author: d0cod3r
+"""
+
+
+import math
+
+import numpy
+
+# scipy provides the error function for arrays
+try:
+    import scipy.special
+except ImportError:
+    scipy = None
+
+from .uncertain_arrays import wrap_vectorized
+from .uncertain_math import (degrees_per_rad, rads_per_degree, erf_coef,
+                             log_of_10)
+
+
+# value and gradient together, like in uncertain_math
+
+def exp_value_and_gradient(x):
+    value = numpy.exp(x)
+    return (value, (value,))
+
+def expm1_value_and_gradient(x):
+    value = numpy.expm1(x)
+    return (value, (value+1,))
+
+def sqrt_value_and_gradient(x):
+    value = numpy.sqrt(x)
+    # the infinite derivative in 0 is replaced by nan in wrap_vectorized
+    return (value, (1/2/value,))
+
+def tan_value_and_gradient(x):
+    value = numpy.tan(x)
+    return (value, (1+value**2,))
+
+def hypot_value_and_gradient(x, y):
+    value = numpy.hypot(x, y)
+    return (value, (x/value, y/value))
+
+def tanh_value_and_gradient(x):
+    value = numpy.tanh(x)
+    return (value, (1-value**2,))
+
+def log_value_and_gradient(x, base=None):
+    value = numpy.log(x)
+    if base is None:
+        return (value, (1/x,))
+    log_base = numpy.log(base)
+    value = value/log_base
+    return (value, (1/x/log_base, -value/log_base/base))
+
+def log(x, base=None):
+    """
+    Logarithm of x to the given base, the natural logarithm by default.
+    """
+    if base is None:
+        return numpy.log(x)
+    return numpy.log(x)/numpy.log(base)
+
+
+if scipy is not None:
+    _erf = scipy.special.erf
+    _erfc = scipy.special.erfc
+else:
+    _erf = numpy.vectorize(math.erf, otypes=[float])
+    _erfc = numpy.vectorize(math.erfc, otypes=[float])
+    # used by wrap_vectorized
+    (_erf.__name__, _erfc.__name__) = ("erf", "erfc")
+
+
+# wrap functions
+
+__all__ = []
+
+###############################################################################
+# power and logarithmic functions
+
+exp = wrap_vectorized(numpy.exp, value_and_gradient=exp_value_and_gradient)
+
+log = wrap_vectorized(log, value_and_gradient=log_value_and_gradient)
+
+expm1 = wrap_vectorized(numpy.expm1,
+                        value_and_gradient=expm1_value_and_gradient)
+
+log1p = wrap_vectorized(numpy.log1p,
+                        [ lambda x: 1/(1+x)
+                        ])
+
+log10 = wrap_vectorized(numpy.log10,
+                        [ lambda x: 1/x/log_of_10 ])
+
+sqrt = wrap_vectorized(numpy.sqrt, value_and_gradient=sqrt_value_and_gradient)
+
+__all__.extend(["exp", "log", "expm1", "log1p", "log10", "sqrt"])
+
+###############################################################################
+# trigonometric functions
+
+sin = wrap_vectorized(numpy.sin, [numpy.cos])
+
+cos = wrap_vectorized(numpy.cos,
+                      [ lambda x: -numpy.sin(x) ])
+
+tan = wrap_vectorized(numpy.tan, value_and_gradient=tan_value_and_gradient)
+
+asin = wrap_vectorized(numpy.arcsin,
+                       [ lambda x: 1/numpy.sqrt(1-x**2) ])
+
+acos = wrap_vectorized(numpy.arccos,
+                       [ lambda x: -1/numpy.sqrt(1-x**2) ])
+
+atan = wrap_vectorized(numpy.arctan,
+                       [ lambda x: 1/(1+x**2) ])
+
+atan2 = wrap_vectorized(numpy.arctan2,
+                        [ lambda x,y: y/(x**2+y**2),
+                             lambda x,y: -x/(x**2+y**2) ])
+
+hypot = wrap_vectorized(numpy.hypot,
+                        value_and_gradient=hypot_value_and_gradient)
+
+__all__.extend(["sin", "cos", "tan", "asin", "acos", "atan", "atan2", "hypot"])
+
+###############################################################################
+# angular conversion
+
+degrees = wrap_vectorized(numpy.degrees,
+                          [ lambda x: degrees_per_rad ])
+
+radians = wrap_vectorized(numpy.radians,
+                          [ lambda x: rads_per_degree ])
+
+__all__.extend(["degrees", "radians"])
+
+###############################################################################
+# hyperbolic functions
+
+sinh = wrap_vectorized(numpy.sinh, [numpy.cosh])
+
+cosh = wrap_vectorized(numpy.cosh, [numpy.sinh])
+
+tanh = wrap_vectorized(numpy.tanh, value_and_gradient=tanh_value_and_gradient)
+
+asinh = wrap_vectorized(numpy.arcsinh,
+                        [ lambda x: 1/numpy.sqrt(1+x**2) ])
+
+acosh = wrap_vectorized(numpy.arccosh,
+                        [ lambda x: 1/numpy.sqrt(x**2-1) ])
+
+atanh = wrap_vectorized(numpy.arctanh,
+                        [ lambda x: 1/(1-x**2) ])
+
+__all__.extend(["sinh", "cosh", "tanh", "asinh", "acosh", "atanh"])
+
+###############################################################################
+# Special function
+
+erf = wrap_vectorized(_erf,
+                      [ lambda x: erf_coef*numpy.exp(-x**2) ])
+
+erfc = wrap_vectorized(_erfc,
+                       [ lambda x: -erf_coef*numpy.exp(-x**2) ])
+
+__all__.extend(["erf", "erfc"])
@@ -0,0 +1,860 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file defines UncertainArray, an environment to handle large
+ collections of uncertain values. It needs numpy.
+
+ Instead of one AffineApproximation per value, an UncertainArray stores the
+ nominal values in a numpy array and the derivatives of all values with
+ respect to the independent variables in one matrix, the jacobian. Its rows
+ belong to the values, its columns to the variables. Calculations are done
+ for all values at once, with the same error propagation as for single
+ values. If scipy is available, the jacobian can be a sparse matrix, which
+ is needed if most values depend on their own variables.
+
+ An UncertainArray is created from a (nested) list of uncertain values with
+ UncertainArray.from_values. It supports +, -, *, /, ** with other
+ UncertainArrays, uncertain values, floats and numpy arrays, following the
+ broadcasting rules of numpy. Indexing it gives an AffineApproximation for
+ a single element and an UncertainArray otherwise.
+
+ Independent variables are created in bulk from arrays of nominal values
+ and uncertainties with uarray.
+ 
+ correlated_values creates an UncertainArray of values with given
+ covariance matrices.
+ concatenate joins UncertainArrays, merging the columns of common
+ variables.
+
+ Elementwise functions of arrays are wrapped with wrap_vectorized, the
+ functions of uncertain_math are available for UncertainArrays in
+ uncertain_array_math.
+
+ @author: d0cod3r
+"""
+
+
+from array import array
+from math import sqrt
+from itertools import chain
+
+import numpy
+
+# sparse jacobians are only available with scipy
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+from .uncertain_values import (AffineApproximation, LinearPart, registry,
+                               FLOAT_LIKE_TYPES, NOT_DIFFERENTIALBE,
+                               NegativeStandardDeviation, nominal_value,
+                               is_sparse, build_jacobian, jacobian_matrix,
+                               scaled_jacobian, covariance_from_jacobian,
+                               WRAPPED_DOC)
+
+
+def scale_rows(jacobian, factors):
+    """
+    Multiply every row of the jacobian with the corresponding factor.
+    """
+    if is_sparse(jacobian):
+        # only the stored elements are scaled, so the structure is kept
+        jacobian = jacobian.tocsr()
+        data = jacobian.data*numpy.repeat(factors, numpy.diff(jacobian.indptr))
+        return scipy.sparse.csr_matrix(
+                (data, jacobian.indices, jacobian.indptr), shape=jacobian.shape)
+    with numpy.errstate(invalid="ignore"):
+        scaled = jacobian*factors[:, numpy.newaxis]
+    # A derivative can be nan, which must not spread to the variables the
+    # value does not depend on
+    if not numpy.isfinite(factors).all():
+        scaled[jacobian == 0] = 0.
+    return scaled
+
+
+def embed_columns(jacobian, positions, width):
+    """
+    Return the jacobian with its columns moved to the given positions in a
+    matrix with width columns.
+    """
+    if is_sparse(jacobian):
+        jacobian = jacobian.tocsr()
+        return scipy.sparse.csr_matrix(
+                (jacobian.data, positions[jacobian.indices], jacobian.indptr),
+                shape=(jacobian.shape[0], width))
+    embedded = numpy.zeros((jacobian.shape[0], width))
+    embedded[:, positions] = jacobian
+    return embedded
+
+
+class UncertainArray(object):
+    """
+    An array of uncertain values, stored as an array of nominal values and a
+    jacobian, which contains the derivatives of all values with respect to
+    the independent variables.
+
+    UncertainArrays are immutable, so several of them may share the same
+    arrays.
+    """
+
+    __slots__ = ("_nominal_values", "_jacobian", "_indices", "_owners",
+                 "_std_devs")
+
+    # numpy should call the reflected operators instead of handling an
+    # UncertainArray as an object
+    __array_ufunc__ = None
+
+    def __init__(self, nominal_values, jacobian, indices, owners=None):
+        """
+        Initialise an UncertainArray.
+
+        nominal_values -- array-like of floats of any shape
+
+        jacobian -- a two dimensional numpy array or scipy sparse matrix.
+        Row i contains the derivatives of the i-th element of the flattened
+        nominal values.
+
+        indices -- sorted array of the indices of the variables in the
+        registry belonging to the columns of the jacobian
+
+        owners -- the owners of the slots of these variables, see
+        VariableRegistry.owners. They are looked up if not given.
+        """
+        self._nominal_values = numpy.asarray(nominal_values, dtype=float)
+        self._indices = numpy.asarray(indices, dtype=numpy.int64)
+        if owners is None:
+            owners = registry.owners(self._indices)
+        self._owners = owners
+        self._jacobian = jacobian
+        self._std_devs = None
+
+        if jacobian.shape != (self._nominal_values.size, len(self._indices)):
+            raise ValueError("The shape of the jacobian does not fit to the "
+                             "nominal values and the variables.")
+
+    @classmethod
+    def from_values(cls, values, sparse=None):
+        """
+        Create an UncertainArray from a (nested) list of uncertain values
+        and floats.
+
+        sparse -- True or False to force a sparse respectively dense
+        jacobian. By default, the form is chosen by the density.
+        """
+        values = numpy.asarray(values, dtype=object)
+        nominal_values = numpy.array([nominal_value(value) for value in
+                                      values.flat], dtype=float)
+        (jacobian, indices) = jacobian_matrix(values.reshape(-1), sparse)
+        return cls(nominal_values.reshape(values.shape), jacobian, indices)
+
+    ###########################################################################
+    # access to the data
+
+    @property
+    def nominal_values(self):
+        """
+        Array of the nominal values.
+        """
+        return self._nominal_values
+
+    # Abbrevation to make formulars shorter
+    n = nominal_values
+
+    @property
+    def jacobian(self):
+        """
+        Matrix of the derivatives of the flattened values with respect to the
+        variables given by variable_indices.
+        """
+        return self._jacobian
+
+    @property
+    def variable_indices(self):
+        """
+        Indices of the independent variables in the registry belonging to
+        the columns of the jacobian.
+        """
+        return self._indices
+
+    @property
+    def shape(self):
+        return self._nominal_values.shape
+
+    @property
+    def size(self):
+        return self._nominal_values.size
+
+    @property
+    def ndim(self):
+        return self._nominal_values.ndim
+
+    def __len__(self):
+        return len(self._nominal_values)
+
+    def standard_deviations(self):
+        """
+        Return arrays of the statistical and the systematic standard
+        deviations. They are calculated once and cached.
+        """
+        std_devs = self._std_devs
+        if std_devs is None:
+            std_devs = tuple(
+                    numpy.sqrt(self._variances(variable_std_devs))
+                    .reshape(self.shape)
+                    for variable_std_devs in (registry.stat_std_devs,
+                                              registry.sys_std_devs))
+            self._std_devs = std_devs
+        return std_devs
+
+    def _variances(self, variable_std_devs):
+        """
+        Return the flat array of variances, with variable_std_devs being one
+        of the arrays of the registry.
+        """
+        components = scaled_jacobian(self._jacobian, self._indices,
+                                     variable_std_devs)
+        if is_sparse(components):
+            rows = numpy.repeat(numpy.arange(components.shape[0]),
+                                numpy.diff(components.indptr))
+            return numpy.bincount(rows, weights=components.data**2,
+                                  minlength=components.shape[0])
+        return (components**2).sum(axis=1)
+
+    @property
+    def statistical_standard_deviations(self):
+        """
+        Array of the resulting statistical standard deviations.
+        """
+        return self.standard_deviations()[0]
+
+    stat_std_devs = statistical_standard_deviations
+
+    stat = statistical_standard_deviations
+
+    @property
+    def systematic_standard_deviations(self):
+        """
+        Array of the resulting systematic standard deviations.
+        """
+        return self.standard_deviations()[1]
+
+    sys_std_devs = systematic_standard_deviations
+
+    sys = systematic_standard_deviations
+
+    def covariance_matrices(self):
+        """
+        Return the statistic and the systematic covariance matrix of the
+        flattened values as numpy arrays.
+        """
+        return tuple(covariance_from_jacobian(self._jacobian, self._indices,
+                                              variable_std_devs)
+                     for variable_std_devs in (registry.stat_std_devs,
+                                               registry.sys_std_devs))
+
+    def __reduce__(self):
+        # pickled in the format of uncertain_serialization, which keeps the
+        # correlations to the variables
+        from .uncertain_serialization import dumps, loads
+        return (loads, (dumps(self),))
+
+    def __repr__(self):
+        return "UncertainArray(%r,\n stat=%r,\n sys=%r)" % (
+                (self.n,) + self.standard_deviations())
+
+    ###########################################################################
+    # indexing and shape
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is not None:
+            return self._element(row)
+        # slices and fancy indices select the rows like the values
+        rows = numpy.arange(self.size).reshape(self.shape)[key]
+        if numpy.ndim(rows) == 0:
+            return self._element(int(rows))
+        return UncertainArray(self._nominal_values[key],
+                              self._jacobian[rows.reshape(-1)], self._indices,
+                              self._owners)
+
+    def _row(self, key):
+        """
+        Return the row of the jacobian of the element selected by an integer
+        or a tuple of integers, one for every axis, and None for other keys.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) != self.ndim or not all(
+                isinstance(index, (int, numpy.integer))
+                and not isinstance(index, bool) for index in key):
+            return None
+        shape = self.shape
+        wrapped = []
+        for (axis, (index, length)) in enumerate(zip(key, shape)):
+            if not -length <= index < length:
+                raise IndexError("index %i is out of bounds for axis %i with "
+                                 "size %i" % (index, axis, length))
+            wrapped.append(index + length if index < 0 else index)
+        return int(numpy.ravel_multi_index(wrapped, shape))
+
+    def _element(self, row):
+        """
+        Return the element in the given row of the jacobian as an
+        AffineApproximation.
+        """
+        coefficients = self._jacobian[row]
+        if is_sparse(coefficients):
+            coefficients = coefficients.toarray()
+        coefficients = numpy.asarray(coefficients).reshape(-1)
+        dependent = coefficients != 0
+        linear_combo = (array("q", self._indices[dependent].tobytes()),
+                        array("d", coefficients[dependent].tobytes()))
+        return AffineApproximation(self._nominal_values.flat[row],
+                                   LinearPart(linear_combo))
+
+    def _elements(self):
+        """
+        Return all elements in flattened order as a list of
+        AffineApproximations, reading the rows of the jacobian at once.
+        """
+        jacobian = self._jacobian
+        if is_sparse(jacobian):
+            jacobian = jacobian.tocsr(copy=True)
+            jacobian.eliminate_zeros()
+            jacobian.sort_indices()
+            (indptr, columns, coefficients) = (jacobian.indptr,
+                                               jacobian.indices, jacobian.data)
+        else:
+            (rows, columns) = numpy.nonzero(jacobian)
+            coefficients = jacobian[rows, columns]
+            indptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(
+                    rows, minlength=jacobian.shape[0]))))
+        # the columns are sorted within the rows, like the variables
+        index_bytes = self._indices[columns].tobytes()
+        coefficient_bytes = numpy.ascontiguousarray(
+                coefficients, dtype=numpy.float64).tobytes()
+
+        elements = []
+        bounds = indptr.tolist()
+        for (row, nominal_value) in enumerate(
+                self._nominal_values.reshape(-1).tolist()):
+            (start, stop) = (8*bounds[row], 8*bounds[row+1])
+            elements.append(AffineApproximation(nominal_value, LinearPart(
+                    (array("q", index_bytes[start:stop]),
+                     array("d", coefficient_bytes[start:stop])))))
+        return elements
+
+    def __iter__(self):
+        if self.ndim == 0:
+            raise TypeError("iteration over a 0-d array")
+        if self.ndim == 1:
+            return iter(self._elements())
+        return self._subarrays()
+
+    def _subarrays(self):
+        # the rows of every subarray are a contiguous block of the jacobian
+        jacobian = self._jacobian
+        if is_sparse(jacobian):
+            jacobian = jacobian.tocsr()
+        step = self.size//len(self) if len(self) else 0
+        for (i, nominal_values) in enumerate(self._nominal_values):
+            yield UncertainArray(nominal_values,
+                                 jacobian[i*step:(i+1)*step], self._indices,
+                                 self._owners)
+
+    def tolist(self):
+        """
+        Return the values as a (nested) list of AffineApproximations.
+        """
+        if self.ndim == 0:
+            return self._element(0)
+        elements = numpy.empty(self.size, dtype=object)
+        elements[:] = self._elements()
+        return elements.reshape(self.shape).tolist()
+
+    def reshape(self, *shape):
+        """
+        Return an UncertainArray with the same values in a new shape.
+        """
+        return UncertainArray(self._nominal_values.reshape(*shape),
+                              self._jacobian, self._indices, self._owners)
+
+    def ravel(self):
+        """
+        Return the values as a flat UncertainArray.
+        """
+        return self.reshape(-1)
+
+    def to_sparse(self):
+        """
+        Return the same values with a sparse jacobian.
+        """
+        if is_sparse(self._jacobian):
+            return self
+        if scipy is None:
+            raise ImportError("Sparse jacobians need scipy.")
+        return UncertainArray(self._nominal_values,
+                              scipy.sparse.csr_matrix(self._jacobian),
+                              self._indices, self._owners)
+
+    def to_dense(self):
+        """
+        Return the same values with a dense jacobian.
+        """
+        if not is_sparse(self._jacobian):
+            return self
+        return UncertainArray(self._nominal_values,
+                              self._jacobian.toarray(), self._indices,
+                              self._owners)
+
+    ###########################################################################
+    # arithmetics
+
+    def _broadcast_jacobian(self, shape, sparse=False):
+        """
+        Return the jacobian of this array broadcasted to the given shape.
+        
+        sparse -- if True, the jacobian is converted to a sparse matrix first
+        """
+        jacobian = self._jacobian
+        if sparse and not is_sparse(jacobian):
+            jacobian = scipy.sparse.csr_matrix(jacobian)
+        if self.shape == shape:
+            return jacobian
+        rows = numpy.broadcast_to(
+                numpy.arange(self.size).reshape(self.shape), shape)
+        return jacobian[rows.reshape(-1)]
+
+    @staticmethod
+    def _combine(nominal_values, terms):
+        """
+        Build the UncertainArray of the result of an elementwise calculation.
+
+        nominal_values -- array of the nominal results
+
+        terms -- list of (UncertainArray, derivative) pairs, one for each
+        uncertain argument. The derivatives are arrays that broadcast to
+        the shape of the result.
+        """
+        shape = nominal_values.shape
+
+        # the result is sparse if any jacobian is sparse
+        sparse = any(is_sparse(argument._jacobian) for (argument, _) in terms)
+
+        jacobians = []
+        for (argument, derivative) in terms:
+            jacobian = argument._broadcast_jacobian(shape, sparse)
+            derivative = numpy.broadcast_to(derivative, shape).reshape(-1)
+            # adding or subtracting an array can share its jacobian
+            if not numpy.all(derivative == 1):
+                jacobian = scale_rows(jacobian, derivative)
+            jacobians.append(jacobian)
+
+        # bring all jacobians to the same columns
+        indices = terms[0][0]._indices
+        if any(not numpy.array_equal(indices, argument._indices)
+               for (argument, _) in terms[1:]):
+            for (argument, _) in terms[1:]:
+                indices = numpy.union1d(indices, argument._indices)
+            jacobians = [
+                    embed_columns(jacobian,
+                                  numpy.searchsorted(indices, argument._indices),
+                                  len(indices))
+                    for (jacobian, (argument, _)) in zip(jacobians, terms)]
+
+        jacobian = jacobians[0]
+        for other in jacobians[1:]:
+            jacobian = jacobian + other
+        if sparse:
+            jacobian = jacobian.tocsr()
+
+        return UncertainArray(nominal_values, jacobian, indices,
+                              _merged_owners(argument for (argument, _)
+                                             in terms))
+
+    def _binary_operation(self, other, function, derivative_0, derivative_1,
+                          reflected=False):
+        """
+        Apply an elementwise function of two arguments.
+
+        function -- calculates the nominal result from two arrays
+
+        derivative_0, derivative_1 -- calculate the partial derivatives with
+        respect to the first respectively second argument from the nominal
+        arguments
+
+        reflected -- if True, other is the first argument
+        """
+        other = to_uncertain_operand(other)
+        if other is NotImplemented:
+            return NotImplemented
+
+        args = (other, self) if reflected else (self, other)
+        return _apply(function, (derivative_0, derivative_1), None, args)
+
+    def __add__(self, other):
+        return self._binary_operation(other, numpy.add,
+                                      lambda x, y: 1., lambda x, y: 1.)
+
+    def __radd__(self, other):
+        return self._binary_operation(other, numpy.add,
+                                      lambda x, y: 1., lambda x, y: 1., True)
+
+    def __sub__(self, other):
+        return self._binary_operation(other, numpy.subtract,
+                                      lambda x, y: 1., lambda x, y: -1.)
+
+    def __rsub__(self, other):
+        return self._binary_operation(other, numpy.subtract,
+                                      lambda x, y: 1., lambda x, y: -1., True)
+
+    def __mul__(self, other):
+        return self._binary_operation(other, numpy.multiply,
+                                      lambda x, y: y, lambda x, y: x)
+
+    def __rmul__(self, other):
+        return self._binary_operation(other, numpy.multiply,
+                                      lambda x, y: y, lambda x, y: x, True)
+
+    def __truediv__(self, other):
+        return self._binary_operation(other, numpy.true_divide,
+                                      lambda x, y: 1/y, lambda x, y: -x/y**2)
+
+    def __rtruediv__(self, other):
+        return self._binary_operation(other, numpy.true_divide,
+                                      lambda x, y: 1/y, lambda x, y: -x/y**2,
+                                      True)
+
+    def __pow__(self, other):
+        return self._binary_operation(other, numpy.power,
+                                      pow_derivative_0, pow_derivative_1)
+
+    def __rpow__(self, other):
+        return self._binary_operation(other, numpy.power,
+                                      pow_derivative_0, pow_derivative_1, True)
+
+    def __pos__(self):
+        return self
+
+    def __neg__(self):
+        return self * (-1) # Using __mul__
+
+
+UArray = UncertainArray
+
+
+def _merged_owners(arrays):
+    """
+    Return the owners of the variables of several UncertainArrays, each one
+    once.
+    """
+    return tuple(dict.fromkeys(chain.from_iterable(array_._owners
+                                                   for array_ in arrays)))
+
+
+def _apply(function, derivatives, value_and_gradient, args):
+    """
+    Apply an elementwise function to operands as returned by
+    to_uncertain_operand, see wrap_vectorized.
+    """
+    nominal_args = [arg.nominal_values if isinstance(arg, UncertainArray)
+                    else arg for arg in args]
+    pos_with_uncert = [index for (index, arg) in enumerate(args)
+                       if isinstance(arg, UncertainArray)]
+
+    with numpy.errstate(all="ignore"):
+        if value_and_gradient is not None:
+            (nominal_values, gradient) = value_and_gradient(*nominal_args)
+        else:
+            nominal_values = function(*nominal_args)
+            gradient = [derivatives[index](*nominal_args)
+                        if index in pos_with_uncert else None
+                        for index in range(len(args))]
+    nominal_values = numpy.asarray(nominal_values, dtype=float)
+
+    if not pos_with_uncert:
+        return UncertainArray(nominal_values,
+                              numpy.zeros((nominal_values.size, 0)), [], ())
+
+    terms = []
+    for index in pos_with_uncert:
+        derivative = numpy.asarray(gradient[index], dtype=float)
+        # e.g. 1/0 instead of an exception, the derivative is not defined
+        if not numpy.isfinite(derivative).all():
+            derivative = numpy.where(numpy.isfinite(derivative), derivative,
+                                     NOT_DIFFERENTIALBE)
+        terms.append((args[index], derivative))
+    return UncertainArray._combine(nominal_values, terms)
+
+
+def wrap_vectorized(function, derivatives=None, value_and_gradient=None):
+    """
+    Build a wrapper around an elementwise function of arrays, e.g. a numpy
+    ufunc. The new function accepts UncertainArrays, (nested) lists of
+    uncertain values, numpy arrays and floats, which are broadcasted
+    against each other, and returns an UncertainArray. The nominal values
+    and the derivatives are calculated for all elements at once.
+    
+    WARNING: Keyword-arguments are not supported
+    
+    function -- The function to wrap. It must accept arrays of floats.
+    
+    derivatives -- A list of the partial derivatives of the function with
+    respect to each argument. They must accept the same arrays as the
+    function and return arrays that broadcast to the shape of the result.
+    Fewer derivatives than arguments can be given, if the other arguments
+    are never uncertain.
+    
+    value_and_gradient -- Optional: A function that returns the value and a
+    sequence of all derivatives from the same arguments, used instead of
+    function and derivatives, see wrap.
+    
+    Derivatives that are not finite, e.g. of sqrt in 0, are treated as not
+    differentiable: The result only gets an uncertainty of nan if the
+    argument is uncertain in that element.
+    """
+    if derivatives is None and value_and_gradient is None:
+        raise ValueError("wrap_vectorized needs derivatives or "
+                         "value_and_gradient.")
+
+    def wrapped_function(*args):
+        operands = [to_uncertain_operand(arg) for arg in args]
+        if any(operand is NotImplemented for operand in operands):
+            raise TypeError("%s can not be applied to the types %s." % (
+                    function.__name__,
+                    ", ".join(type(arg).__name__ for arg in args)))
+        return _apply(function, derivatives, value_and_gradient, operands)
+
+    wrapped_function.__name__ = function.__name__
+    wrapped_function.__doc__ = WRAPPED_DOC % (function.__name__,
+                                              function.__doc__)
+    return wrapped_function
+
+
+def concatenate(arrays):
+    """
+    Join UncertainArrays along their first axis like numpy.concatenate.
+    The columns of common variables are merged, so the result keeps all
+    correlations, e.g. of the results of chunked_map.
+    """
+    arrays = [to_uncertain_operand(array_) for array_ in arrays]
+    arrays = [array_ if isinstance(array_, UncertainArray) else
+              UncertainArray(array_, numpy.zeros((array_.size, 0)), [], ())
+              for array_ in arrays]
+    if not arrays:
+        raise ValueError("Need at least one array to concatenate.")
+    nominal_values = numpy.concatenate([array_.nominal_values
+                                        for array_ in arrays])
+
+    indices = arrays[0].variable_indices
+    for array_ in arrays[1:]:
+        indices = numpy.union1d(indices, array_.variable_indices)
+    jacobians = [embed_columns(array_.jacobian,
+                               numpy.searchsorted(indices,
+                                                  array_.variable_indices),
+                               len(indices))
+                 for array_ in arrays]
+    # flattened in C order, joining along the first axis stacks the rows
+    if any(is_sparse(jacobian) for jacobian in jacobians):
+        jacobian = scipy.sparse.vstack(jacobians, format="csr")
+    else:
+        jacobian = numpy.vstack(jacobians)
+    return UncertainArray(nominal_values, jacobian, indices,
+                          _merged_owners(arrays))
+
+
+# The jacobian of n new variables is the n x n identity. Without scipy it
+# has to be dense, which needs 8*n**2 bytes, so uarray refuses to build it
+# for more variables than this.
+MAX_DENSE_IDENTITY = 4096
+
+
+def uarray(nominal_values, stat=0, sys=0, sparse=None):
+    """
+    Create independent variables from arrays of nominal values and
+    uncertainties at once and return them as an UncertainArray.
+
+    The variables are only stored in the registry, their objects are
+    created when needed, e.g. when indexing the array.
+
+    nominal_values, stat, sys -- array-likes, broadcasted to a common shape
+
+    sparse -- True or False to force a sparse respectively dense jacobian,
+    which is the identity. By default, it is sparse if scipy is available.
+    A dense jacobian is only built for up to MAX_DENSE_IDENTITY values, a
+    ValueError is raised for more.
+    """
+    (nominal_values, stat, sys) = numpy.broadcast_arrays(
+            numpy.asarray(nominal_values, dtype=float),
+            numpy.asarray(stat, dtype=float),
+            numpy.asarray(sys, dtype=float))
+
+    # As comparisons with nan are always False, the NOT_DIFFERENTIABLE flag
+    # does not raise an Exception
+    if (stat < 0).any() or (sys < 0).any():
+        raise NegativeStandardDeviation()
+
+    if sparse is None:
+        sparse = scipy is not None
+    size = nominal_values.size
+    if not sparse and size > MAX_DENSE_IDENTITY:
+        # checked before the variables are registered
+        raise ValueError(
+                "The dense jacobian of %i values would need %.3g GB. Install "
+                "scipy for a sparse jacobian or create at most "
+                "MAX_DENSE_IDENTITY values at once." % (size, 8e-9*size**2))
+
+    (indices, owner) = registry.register_many(nominal_values.reshape(-1),
+                                              stat.reshape(-1),
+                                              sys.reshape(-1))
+    positions = numpy.arange(size)
+    jacobian = build_jacobian(positions, positions, numpy.ones(size),
+                              (size, size), sparse)
+    return UncertainArray(nominal_values.copy(), jacobian,
+                          numpy.arange(indices.start, indices.stop), (owner,))
+
+
+def _covariance_factor(covariances, size, method, rank):
+    """
+    Factorize a covariance matrix as C*diag(std_devs**2)*C^T for
+    correlated_values. Components without uncertainty are left out.
+    Returns the coefficients C and the standard deviations.
+    """
+    if isinstance(covariances, FLOAT_LIKE_TYPES):
+        # every two values have the same covariance, so they share one
+        # variable. Negative values are treated as 0, as by the
+        # diagonalisation of the matrix.
+        if covariances <= 0 or size == 0:
+            return (numpy.zeros((size, 0)), numpy.zeros(0))
+        return (numpy.ones((size, 1)), numpy.array([sqrt(covariances)]))
+
+    covariances = numpy.asarray(covariances, dtype=float)
+    if covariances.shape != (size, size):
+        raise ValueError("The covariance matrix must be square with the "
+                         "length of the nominal values.")
+
+    if method == "cholesky":
+        # only works for positive definite matrices, but is fast
+        return (numpy.linalg.cholesky(covariances), numpy.ones(size))
+
+    if method != "eigh":
+        raise ValueError('method must be "eigh" or "cholesky".')
+
+    # diagonalize the covariance matrix to get independent variables
+    (variances, vectors) = numpy.linalg.eigh(covariances)
+
+    # some uncertainties might be calculated negative or not exactly 0 due to
+    # numeric errors. Setting them to 0 gives close and useful results
+    tolerance = size*numpy.finfo(float).eps*numpy.abs(variances).max(initial=0)
+    keep = variances > tolerance
+    if rank is not None:
+        # eigh sorts ascending, keep the greatest
+        keep[:max(size - rank, 0)] = False
+    return (vectors[:, keep], numpy.sqrt(variances[keep]))
+
+
+def correlated_values(nominal_values, statistic_covariances=0,
+                      systematic_covariances=0, method="eigh", rank=None):
+    """
+    To given covariance matrices and nominal values, create uncertain
+    variables that satisfy these relations.
+    Returns an UncertainArray of uncertain values, so that the covariance of
+    values[i] and values[j] is covariances[i,j]
+
+    nominal_values -- A list of nominal values for the created variables
+
+    statistic_covariances -- The statistic covariance matrix of the values
+    to create. Can be either a sqare matrix with the same lenght as
+    nominal_values in both dimensions, or a scalar. In the second case, the
+    covariance between any two created variables will be the given value.
+    Default to 0.
+
+    systematic_covariances -- The systematic covariance matrix of the
+    values to create. Can be either a sqare matrix with the same lenght as
+    nominal_values in both dimensions, or a scalar. In the second case, the
+    covariance between any two created variables will be the given value.
+    Default to 0.
+
+    method -- "eigh" diagonalizes the matrices and works for every positive
+    semidefinite matrix. Components with vanishing variance are left out.
+    "cholesky" uses the cholesky decomposition, which is faster, but needs
+    positive definite matrices.
+
+    rank -- Only with method "eigh": If given, at most this amount of
+    components with the greatest variances are kept, giving a low rank
+    approximation of the matrices.
+    """
+
+    # The idea of this method is to do a change of basis. The covariance
+    # matrices are factorized as C*diag(std_devs**2)*C^T, e.g. by
+    # diagonalisation. The components are independent, so they can be
+    # represented by new variables with the standard deviations std_devs.
+    # The requested values are linear combinations of them with the
+    # coefficients C, which are used as jacobian directly.
+
+    nominal_values = numpy.asarray(nominal_values, dtype=float)
+    size = len(nominal_values)
+
+    (stat_coefficients, stat_std_devs) = _covariance_factor(
+            statistic_covariances, size, method, rank)
+    (sys_coefficients, sys_std_devs) = _covariance_factor(
+            systematic_covariances, size, method, rank)
+
+    # independent variables, the objects are only created if needed
+    (stat_indices, stat_owner) = registry.register_many(
+            numpy.zeros(len(stat_std_devs)), stat_std_devs,
+            numpy.zeros(len(stat_std_devs)))
+    (sys_indices, sys_owner) = registry.register_many(
+            numpy.zeros(len(sys_std_devs)), numpy.zeros(len(sys_std_devs)),
+            sys_std_devs)
+
+    indices = numpy.concatenate((numpy.arange(stat_indices.start, stat_indices.stop),
+                                 numpy.arange(sys_indices.start, sys_indices.stop)))
+    jacobian = numpy.hstack((stat_coefficients, sys_coefficients))
+    # the slots of the systematic variables may have been freed before the
+    # statistical ones, the columns must be sorted
+    order = numpy.argsort(indices, kind="stable")
+    return UncertainArray(nominal_values, jacobian[:, order], indices[order],
+                          (stat_owner, sys_owner))
+
+
+def to_uncertain_operand(x):
+    """
+    Convert x to an operand for the calculations with UncertainArrays:
+    An UncertainArray if x is uncertain, an array of floats if x is certain,
+    NotImplemented if x is neither.
+    """
+    if isinstance(x, UncertainArray):
+        return x
+    if isinstance(x, AffineApproximation):
+        return UncertainArray.from_values(x)
+    if isinstance(x, FLOAT_LIKE_TYPES):
+        return numpy.asarray(x, dtype=float)
+    if isinstance(x, (list, tuple, numpy.ndarray)):
+        x = numpy.asarray(x)
+        if x.dtype == object:
+            return UncertainArray.from_values(x)
+        if numpy.issubdtype(x.dtype, numpy.number):
+            return x.astype(float, copy=False)
+    return NotImplemented
+
+
+# derivatives of x**y like in uncertain_values, but for arrays
+
+def pow_derivative_0(x, y):
+    # derivative of x**y with respect to x. Not differentiabe in x=0, except
+    # if y%1=0
+    return numpy.where(y == 0, 0.,
+                       numpy.where((x != 0) | (y%1 == 0),
+                                   y*numpy.power(x, y-1), NOT_DIFFERENTIALBE))
+
+def pow_derivative_1(x, y):
+    # derivative of x**y with respect to y.
+    return numpy.where((x == 0) & (y > 0), 0.,
+                       numpy.where(x > 0, numpy.log(numpy.abs(x))*numpy.power(x, y),
+                                   NOT_DIFFERENTIALBE))
+
+
+__all__ = ["UncertainArray", "UArray", "uarray", "correlated_values",
+           "wrap_vectorized", "concatenate"]
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file calculates covariance matrices that are too large to be held in
+ memory at once. It needs numpy.
+
+ The matrix J*diag(std_devs**2)*J^T is split into square blocks of
+ block_size rows and columns, which are calculated one after another or on
+ a pool of processes. The blocks can be iterated with covariance_blocks or
+ collected by tiled_covariance_matrix into an array, a memory-mapped .npy
+ file or a sparse matrix. Blocks outside a diagonal band and blocks of
+ values not depending on common variables are skipped. The memory needed
+ is then bounded by the jacobian and a few blocks.
+
+ stat_cov_mat and sys_cov_mat use this if they are given a block_size.
+
+ @author: d0cod3r
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+from numpy.lib.format import open_memmap
+
+# sparse results are only available with scipy
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+from .uncertain_values import (registry, is_sparse, jacobian_matrix,
+                               scaled_jacobian)
+from .uncertain_arrays import UncertainArray
+
+
+def _scaled_jacobian(numbers, kind):
+    """
+    Return the jacobian of numbers, with its columns multiplied by the
+    standard deviations of their variables. numbers is an UncertainArray or
+    a list of uncertain values, kind is "stat" or "sys".
+    """
+    if (not isinstance(numbers, UncertainArray) and len(numbers) == 1
+            and isinstance(numbers[0], UncertainArray)):
+        numbers = numbers[0]
+    if isinstance(numbers, UncertainArray):
+        (jacobian, indices) = (numbers.jacobian, numbers.variable_indices)
+    else:
+        (jacobian, indices) = jacobian_matrix(numbers)
+
+    if kind == "stat":
+        variable_std_devs = registry.stat_std_devs
+    elif kind == "sys":
+        variable_std_devs = registry.sys_std_devs
+    else:
+        raise ValueError('kind must be "stat" or "sys".')
+
+    scaled = scaled_jacobian(jacobian, indices, variable_std_devs)
+    if is_sparse(scaled):
+        scaled = scaled.tocsr()
+    return scaled
+
+
+def _block_product(rows, columns):
+    """
+    Calculate one block of the covariance matrix from two blocks of rows of
+    the scaled jacobian.
+    """
+    block = rows @ columns.T
+    if is_sparse(block):
+        block = block.toarray()
+    return numpy.asarray(block)
+
+
+# the scaled jacobian and the block size in the worker processes, sent once
+# per process by _init_worker instead of with every block
+_worker_jacobian = None
+
+
+def _init_worker(scaled, block_size):
+    global _worker_jacobian
+    _worker_jacobian = (scaled, block_size)
+
+
+def _worker_block(row_start, column_start):
+    """
+    Calculate the block at row_start, column_start from the scaled jacobian
+    given to _init_worker. Runs in the worker processes.
+    """
+    (scaled, block_size) = _worker_jacobian
+    return _block_product(scaled[row_start:row_start+block_size],
+                          scaled[column_start:column_start+block_size])
+
+
+def _block_pairs(size, block_size, band, scaled):
+    """
+    Generate the (row start, column start) pairs of all blocks on or above
+    the diagonal that have to be calculated.
+    """
+    starts = range(0, size, block_size)
+
+    # the variables the values of each block of rows depend on, to skip
+    # blocks without common variables
+    used_columns = None
+    if is_sparse(scaled):
+        used_columns = [numpy.unique(scaled[start:start+block_size].indices)
+                        for start in starts]
+
+    for (i, row_start) in enumerate(starts):
+        for (j, column_start) in enumerate(starts[i:], i):
+            if band is not None and column_start - (row_start+block_size) >= band:
+                break
+            if (used_columns is not None and not
+                    numpy.intersect1d(used_columns[i], used_columns[j],
+                                      assume_unique=True).size):
+                continue
+            yield (row_start, column_start)
+
+
+def covariance_blocks(numbers, kind="stat", block_size=1024, band=None,
+                      processes=None):
+    """
+    Iterate over the blocks of a covariance matrix on or above the diagonal.
+    The blocks below the diagonal are their transposes.
+
+    Yields (row_start, column_start, block), where block is a numpy array
+    of at most block_size rows and columns. Blocks that are zero because
+    their values have no variables in common are not yielded.
+
+    numbers -- an UncertainArray or a list of uncertain values
+
+    kind -- "stat" or "sys" for the statistic respectively systematic
+    covariances
+
+    block_size -- amount of rows and columns of one block
+
+    band -- if given, only blocks containing elements with a distance
+    smaller or equal to band from the diagonal are calculated
+
+    processes -- if given, the blocks are calculated on a pool of that many
+    processes. Only a few blocks per process are calculated in advance.
+    """
+    return _blocks(_scaled_jacobian(numbers, kind), block_size, band,
+                   processes)
+
+
+def _blocks(scaled, block_size, band, processes):
+    """
+    Implementation of covariance_blocks for a scaled jacobian.
+    """
+    pairs = _block_pairs(scaled.shape[0], block_size, band, scaled)
+
+    def rows(start):
+        return scaled[start:start+block_size]
+
+    if processes is None:
+        for (row_start, column_start) in pairs:
+            yield (row_start, column_start,
+                   _block_product(rows(row_start), rows(column_start)))
+        return
+
+    # every process gets the scaled jacobian once, so the data sent grows
+    # with the amount of processes instead of the amount of blocks
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(scaled, block_size)) as executor:
+        pending = []
+        for (row_start, column_start) in pairs:
+            pending.append((row_start, column_start, executor.submit(
+                    _worker_block, row_start, column_start)))
+            # bound the memory by the number of blocks calculated in advance
+            if len(pending) >= 2*processes:
+                (row_start, column_start, future) = pending.pop(0)
+                yield (row_start, column_start, future.result())
+        for (row_start, column_start, future) in pending:
+            yield (row_start, column_start, future.result())
+
+
+def tiled_covariance_matrix(numbers, kind="stat", block_size=1024,
+                            processes=None, out=None, band=None,
+                            sparse=False):
+    """
+    Calculate a covariance matrix block by block, see covariance_blocks for
+    the arguments numbers, kind, block_size, band and processes.
+
+    out -- if given, the matrix is written to a memory-mapped .npy file at
+    this path, which is returned as a numpy.memmap. Elements of skipped
+    blocks are 0.
+
+    sparse -- if True, a scipy.sparse.csr_matrix is returned, only
+    containing the calculated blocks. Needs scipy.
+
+    Without out and sparse, a numpy array is returned.
+    If band is given, elements with a greater distance from the diagonal
+    are 0 in every case.
+    """
+    scaled = _scaled_jacobian(numbers, kind)
+    size = scaled.shape[0]
+    blocks = _blocks(scaled, block_size, band, processes)
+
+    def cut_band(row_start, column_start, block):
+        # set the elements outside the band to 0
+        if band is not None:
+            distance = (numpy.arange(column_start, column_start+block.shape[1])
+                        - numpy.arange(row_start, row_start+block.shape[0])[:, None])
+            block = numpy.where(numpy.abs(distance) <= band, block, 0.)
+        return block
+
+    if sparse:
+        if scipy is None:
+            raise ImportError("Sparse covariance matrices need scipy.")
+        parts = []
+        for (row_start, column_start, block) in blocks:
+            block = scipy.sparse.coo_matrix(
+                    cut_band(row_start, column_start, block))
+            parts.append((block.row + row_start, block.col + column_start,
+                          block.data))
+            if row_start != column_start:
+                parts.append((block.col + column_start, block.row + row_start,
+                              block.data))
+        if parts:
+            (rows, columns, data) = (numpy.concatenate(part) for part in zip(*parts))
+        else:
+            (rows, columns, data) = ([], [], [])
+        return scipy.sparse.csr_matrix((data, (rows, columns)),
+                                       shape=(size, size))
+
+    if out is None:
+        matrix = numpy.zeros((size, size))
+    else:
+        matrix = open_memmap(out, mode="w+", shape=(size, size))
+    for (row_start, column_start, block) in blocks:
+        block = cut_band(row_start, column_start, block)
+        (height, width) = block.shape
+        matrix[row_start:row_start+height, column_start:column_start+width] = block
+        matrix[column_start:column_start+width, row_start:row_start+height] = block.T
+    if out is not None:
+        matrix.flush()
+    return matrix
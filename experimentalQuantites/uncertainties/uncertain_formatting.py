@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file formats uncertain values rounded to their significant digits,
+ single values as well as tables of many values as text, CSV or LaTeX.
+
+ The nominal value and both uncertainties are rounded to the same digit,
+ which is given by the greater uncertainty and SIGNIFICANT_DIGITS, see
+ AffineApproximation.significant_digits. Values without uncertainty are
+ not rounded.
+
+ write_table takes columns of uncertain values, floats or UncertainArrays
+ and writes them block by block. For every block, the standard deviations
+ are taken from the cache of the values (or calculated for a whole
+ UncertainArray at once) and the digits are rounded with numpy for the
+ whole block, so only building the strings is done per value. format_table
+ returns the table as a string.
+
+ @author: d0cod3r
+"""
+
+
+import csv
+import io
+from math import floor, log10, isfinite
+
+from . import uncertain_values
+from .uncertain_values import AffineApproximation, numpy
+
+
+###############################################################################
+# single values
+
+def _decimals(stat, sys):
+    """
+    Return the amount of decimals to round to, negative to round to tens,
+    hundreds, ..., or None if there is no finite uncertainty.
+    """
+    max_std_dev = max(stat, sys)
+    if not (max_std_dev > 0 and isfinite(max_std_dev)):
+        return None
+    # read at call time, so changes of the setting take effect
+    return (uncertain_values.SIGNIFICANT_DIGITS
+            - int(floor(log10(max_std_dev))))
+
+
+def _round(value, decimals):
+    """
+    Return value rounded to the given decimals as a string.
+    """
+    if decimals >= 0:
+        return "%.*f" % (decimals, value)
+    return "%.0f" % round(value, decimals)
+
+
+def format_value(nominal_value, stat=0., sys=0., format_spec=""):
+    """
+    Return the nominal value and the uncertainties as strings.
+
+    format_spec -- a format specification for floats applied to all
+    three. By default, they are rounded to their significant digits.
+    """
+    if format_spec:
+        return tuple(format(value, format_spec) for value in
+                     (nominal_value, stat, sys))
+    decimals = _decimals(stat, sys)
+    if decimals is None:
+        return (repr(float(nominal_value)), repr(float(stat)),
+                repr(float(sys)))
+    return tuple(_round(value, decimals) for value in
+                 (nominal_value, stat, sys))
+
+
+def format_uncertain(value, format_spec=""):
+    """
+    Return an uncertain value as a string like 1.23+-0.04(stat)+-0.01(sys),
+    see format_value. Used by AffineApproximation.__str__ and __format__.
+    """
+    return "%s+-%s(stat)+-%s(sys)" % format_value(
+            value._nominal_value, *value.standard_deviations(),
+            format_spec=format_spec)
+
+
+###############################################################################
+# blocks of values
+
+def _column_data(column, start, stop):
+    """
+    Return lists or arrays of the nominal values and standard deviations
+    of the values of a column from start to stop.
+    """
+    if hasattr(column, "jacobian"):
+        # an UncertainArray, the standard deviations are calculated for the
+        # whole array and cached
+        (stat, sys) = column.standard_deviations()
+        return (column.nominal_values.reshape(-1)[start:stop],
+                stat.reshape(-1)[start:stop], sys.reshape(-1)[start:stop])
+    nominal_values = []
+    stat = []
+    sys = []
+    for value in column[start:stop]:
+        if isinstance(value, AffineApproximation):
+            nominal_values.append(value._nominal_value)
+            std_devs = value.standard_deviations()
+            stat.append(std_devs[0])
+            sys.append(std_devs[1])
+        else:
+            nominal_values.append(float(value))
+            stat.append(0.)
+            sys.append(0.)
+    return (nominal_values, stat, sys)
+
+
+def _format_block(nominal_values, stat, sys):
+    """
+    Return lists of the rounded strings of the nominal values and the
+    uncertainties, None for values without uncertainty.
+    """
+    if numpy is None:
+        strings = ([], [], [])
+        for value in zip(nominal_values, stat, sys):
+            decimals = _decimals(*value[1:])
+            if decimals is None:
+                value_strings = (repr(float(value[0])), None, None)
+            else:
+                value_strings = [_round(part, decimals) for part in value]
+            for (column, string) in zip(strings, value_strings):
+                column.append(string)
+        return strings
+
+    (nominal_values, stat, sys) = (numpy.asarray(values, dtype=float)
+                                   for values in (nominal_values, stat, sys))
+    max_std_devs = numpy.maximum(stat, sys)
+    uncertain = (max_std_devs > 0) & numpy.isfinite(max_std_devs)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        decimals = numpy.where(
+                uncertain, uncertain_values.SIGNIFICANT_DIGITS
+                - numpy.floor(numpy.log10(max_std_devs)), 0).astype(int)
+    # round to tens, hundreds, ... with array math, decimals are rounded
+    # when the strings are built
+    scale = 10.**numpy.minimum(decimals, 0)
+    rounded = [numpy.where(decimals < 0, numpy.round(values*scale)/scale,
+                           values).tolist()
+               for values in (nominal_values, stat, sys)]
+    decimals = numpy.maximum(decimals, 0).tolist()
+    uncertain = uncertain.tolist()
+    strings = [["%.*f" % (places, value) if flag else None
+                for (places, value, flag) in zip(decimals, values, uncertain)]
+               for values in rounded]
+    # values without uncertainty are given as they are
+    strings[0] = [string if string is not None else repr(value) for
+                  (string, value) in zip(strings[0], rounded[0])]
+    return strings
+
+
+###############################################################################
+# tables
+
+def _length(column):
+    if hasattr(column, "jacobian"):
+        return column.size
+    return len(column)
+
+
+def _formatted_blocks(columns, block_size):
+    """
+    Yield the strings of the table block by block, for every column a list
+    of the nominal values, the statistical and the systematic uncertainties
+    as returned by _format_block.
+    """
+    lengths = set(_length(column) for column in columns)
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length.")
+    length = lengths.pop() if lengths else 0
+    for start in range(0, length, block_size):
+        stop = min(start+block_size, length)
+        yield [_format_block(*_column_data(column, start, stop))
+               for column in columns]
+
+
+def formatted_rows(columns, block_size=4096):
+    """
+    Yield the rows of a table as lists of (nominal value, stat, sys)
+    strings, one for each column. The uncertainties are None for values
+    without uncertainty.
+
+    columns -- lists of uncertain values and floats or UncertainArrays,
+    which are flattened, all of the same length
+    """
+    for block in _formatted_blocks(columns, block_size):
+        yield from (list(row) for row in
+                    zip(*[list(zip(*strings)) for strings in block]))
+
+
+def _cells(strings, template):
+    """
+    Return the cells of a column of a block, filled into template, or only
+    the nominal values for values without uncertainty.
+    """
+    return [nominal_value if stat is None
+            else template % (nominal_value, stat, sys)
+            for (nominal_value, stat, sys) in zip(*strings)]
+
+
+def write_table(file, columns, headers=None, style="text", block_size=4096):
+    """
+    Write a table of uncertain values to a file opened in text mode, block
+    by block, see formatted_rows.
+
+    headers -- optional names of the columns
+
+    style -- "text" for aligned columns, "csv" for three columns per
+    column (nominal value, stat, sys) or "latex" for a tabular environment
+
+    block_size -- amount of rows formatted at once. The text style aligns
+    the columns of the rows of a block, but a later block with wider cells
+    widens the columns from there on, since the rows before are already
+    written. Give a block_size of at least the amount of rows if the
+    whole table must be aligned.
+    """
+    if style not in ("text", "csv", "latex"):
+        raise ValueError('style must be "text", "csv" or "latex".')
+    blocks = _formatted_blocks(columns, block_size)
+
+    if style == "csv":
+        writer = csv.writer(file)
+        if headers is not None:
+            writer.writerow([name + suffix for name in headers
+                             for suffix in ("", "_stat", "_sys")])
+        for block in blocks:
+            # values without uncertainty get 0
+            parts = []
+            for (nominal_values, stat, sys) in block:
+                parts.extend((nominal_values,
+                              [string or "0" for string in stat],
+                              [string or "0" for string in sys]))
+            writer.writerows(zip(*parts))
+
+    elif style == "latex":
+        file.write("\\begin{tabular}{%s}\n" % ("c"*len(columns)))
+        if headers is not None:
+            file.write(" & ".join(headers) + " \\\\\n\\hline\n")
+        for block in blocks:
+            cells = [["$%s$" % cell for cell in _cells(
+                              strings, r"%s \pm %s_\mathrm{stat} "
+                                       r"\pm %s_\mathrm{sys}")]
+                     for strings in block]
+            file.writelines(" & ".join(row) + " \\\\\n"
+                            for row in zip(*cells))
+        file.write("\\end{tabular}\n")
+
+    else:
+        # the columns are as wide as the headers and the cells of the blocks
+        # so far. The alignment is best-effort: a later block can widen
+        # them, which would otherwise need all blocks in memory.
+        widths = ([len(name) for name in headers] if headers is not None
+                  else [0]*len(columns))
+        for (number, block) in enumerate(blocks):
+            cells = [_cells(strings, "%s+-%s(stat)+-%s(sys)")
+                     for strings in block]
+            widths = [max([width] + [len(cell) for cell in column_cells])
+                      for (width, column_cells) in zip(widths, cells)]
+            if number == 0 and headers is not None:
+                file.write("  ".join(name.rjust(width) for (name, width)
+                                     in zip(headers, widths)) + "\n")
+            cells = [[cell.rjust(width) for cell in column_cells]
+                     for (width, column_cells) in zip(widths, cells)]
+            file.writelines("  ".join(row) + "\n" for row in zip(*cells))
+
+
+def format_table(columns, headers=None, style="text"):
+    """
+    Return a table of uncertain values as a string, see write_table.
+    """
+    file = io.StringIO()
+    write_table(file, columns, headers, style)
+    return file.getvalue()
+
+
+__all__ = ["format_value", "formatted_rows", "write_table", "format_table"]
@@ -34,20 +34,60 @@ def nan_if_exception(function):
     return wrapped_func
 
 
-# define more complex derivatives and some constants used later
-
-def log_derivative_0(*args):
-    if len(args)==1:
-        # base e
-        return 1/args[0]
-    else:
-        return 1/args[0]/math.log(args[1])
+# define some constants used later
 
 degrees_per_rad = 180/math.pi
 rads_per_degree = math.pi/180
 
 erf_coef = 2/math.sqrt(math.pi)
 
+log_of_10 = math.log(10)
+
+
+# Many derivatives can be calculated from the value of the function, e.g.
+# exp' = exp. For these functions, value and gradient are calculated
+# together, so the transcendental function is only evaluated once.
+
+def exp_value_and_gradient(x):
+    value = math.exp(x)
+    return (value, (value,))
+
+def log_value_and_gradient(x, base=None):
+    value = math.log(x)
+    if base is None:
+        return (value, (1/x,))
+    log_base = math.log(base)
+    # raises ZeroDivisionError for the base 1, as math.log does
+    value /= log_base
+    return (value, (1/x/log_base, -value/log_base/base))
+
+def expm1_value_and_gradient(x):
+    value = math.expm1(x)
+    return (value, (value+1,))
+
+def log10_value_and_gradient(x):
+    return (math.log10(x), (1/x/log_of_10,))
+
+def sqrt_value_and_gradient(x):
+    value = math.sqrt(x)
+    if value == 0:
+        return (value, (NOT_DIFFERENTIABLE,))
+    return (value, (1/2/value,))
+
+def tan_value_and_gradient(x):
+    value = math.tan(x)
+    return (value, (1+value**2,))
+
+def hypot_value_and_gradient(x, y):
+    value = math.hypot(x, y)
+    if value == 0:
+        return (value, (NOT_DIFFERENTIABLE, NOT_DIFFERENTIABLE))
+    return (value, (x/value, y/value))
+
+def tanh_value_and_gradient(x):
+    value = math.tanh(x)
+    return (value, (1-value**2,))
+
 
 # wrap functions
 
@@ -56,30 +96,19 @@ __all__ = []
 ###############################################################################
 # power and logarithmic functions
 
-exp = wrap(math.exp,
-           [ math.exp
-           ])
+exp = wrap(math.exp, value_and_gradient=exp_value_and_gradient)
 
-log = wrap(math.log,
-           [ log_derivative_0,
-             lambda x, y: -math.log(x)/(math.log(y)**2)/y
-           ])
+log = wrap(math.log, value_and_gradient=log_value_and_gradient)
 
-expm1 = wrap(math.expm1,
-             [ math.exp
-             ])
+expm1 = wrap(math.expm1, value_and_gradient=expm1_value_and_gradient)
 
 log1p = wrap(math.log1p,
              [ lambda x: 1/(1+x)
              ])
 
-log10 = wrap(math.log10,
-            [ lambda x: 1/x/math.log(10)
-            ])
+log10 = wrap(math.log10, value_and_gradient=log10_value_and_gradient)
 
-sqrt = wrap(math.sqrt,
-            [ nan_if_exception(lambda x: 1/2/math.sqrt(x))
-            ])
+sqrt = wrap(math.sqrt, value_and_gradient=sqrt_value_and_gradient)
 
 __all__.extend(["exp", "log", "expm1", "log1p", "log10", "sqrt"])
 
@@ -91,8 +120,7 @@ sin = wrap(math.sin, [math.cos])
 cos = wrap(math.cos,
            [ lambda x: -math.sin(x) ])
 
-tan = wrap(math.tan,
-           [ lambda x: 1+math.tan(x)**2 ])
+tan = wrap(math.tan, value_and_gradient=tan_value_and_gradient)
 
 asin = wrap(math.asin,
             [ nan_if_exception(lambda x: 1/math.sqrt(1-x**2)) ])
@@ -107,9 +135,7 @@ atan2 = wrap(math.atan2,
              [ nan_if_exception(lambda x,y: y/(x**2+y**2)),
                   nan_if_exception(lambda x,y: -x/(x**2+y**2)) ])
 
-hypot = wrap(math.hypot,
-             [ nan_if_exception(lambda x,y: x/math.hypot(x,y)),
-               nan_if_exception(lambda x,y: y/math.hypot(x,y)) ])
+hypot = wrap(math.hypot, value_and_gradient=hypot_value_and_gradient)
 
 __all__.extend(["sin", "cos", "tan", "asin", "acos", "atan", "atan2", "hypot"])
 
@@ -131,8 +157,7 @@ sinh = wrap(math.sinh, [math.cosh])
 
 cosh = wrap(math.cosh, [math.sinh])
 
-tanh = wrap(math.tanh,
-            [ nan_if_exception(lambda x: 1-math.tanh(x)**2) ])
+tanh = wrap(math.tanh, value_and_gradient=tanh_value_and_gradient)
 
 asinh = wrap(math.asinh,
              [ nan_if_exception(lambda x: 1/math.sqrt(1+x**2)) ])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file applies a function to many uncertain values on a pool of
+ processes, keeping the correlations of the results.
+
+ Only the nominal values are sent to the processes. They calculate the
+ value of the function and its derivatives with respect to the uncertain
+ arguments, with dual numbers if the function accepts them and numerically
+ otherwise, see wrap. The results are built in the calling process from
+ the derivatives and the linear parts of the original arguments, so they
+ are correlated exactly as if the function had been called there.
+
+ @author: d0cod3r
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .uncertain_values import (AffineApproximation, LinearPart,
+                               partial_derivate, dual_value_and_gradient)
+
+
+def _evaluate_chunk(function, chunk):
+    """
+    Calculate the values and the derivatives of function for a list of
+    (nominal arguments, positions of uncertain arguments). Runs in the
+    worker processes.
+    """
+    results = []
+    for (nominal_args, positions) in chunk:
+        result = None
+        if positions:
+            # the function might reject Duals only for some arguments
+            result = dual_value_and_gradient(function, nominal_args, positions)
+        if result is None:
+            result = (function(*nominal_args),
+                      [partial_derivate(function, index)(*nominal_args)
+                       for index in positions])
+        results.append(result)
+    return results
+
+
+def _split_arguments(args):
+    """
+    Return the nominal arguments and the positions of the uncertain ones.
+    """
+    positions = [index for (index, arg) in enumerate(args)
+                 if isinstance(arg, AffineApproximation)]
+    nominal_args = list(args)
+    for index in positions:
+        nominal_args[index] = args[index]._nominal_value
+    return (nominal_args, positions)
+
+
+def parallel_map(function, *iterables, processes=None, chunksize=256):
+    """
+    Return the list of function(*args) for the arguments taken from the
+    iterables, like the builtin map, calculated on a pool of processes.
+
+    function -- a function accepting floats, picklable, i.e. defined at the
+    top level of a module. It is called with dual numbers first, so it can
+    use arithmetics and the functions of uncertain_math or others wrapped
+    with wrap. Otherwise numeric derivatives are calculated.
+
+    iterables -- the arguments, uncertain values or other picklable objects
+
+    processes -- amount of processes, by default the amount of processors
+
+    chunksize -- amount of calls sent to a process at once
+    """
+    events = zip(*iterables)
+    arguments = []
+    futures = []
+    with ProcessPoolExecutor(processes) as executor:
+        while True:
+            chunk = list(islice(events, chunksize))
+            if not chunk:
+                break
+            arguments.append(chunk)
+            futures.append(executor.submit(
+                    _evaluate_chunk, function,
+                    [_split_arguments(args) for args in chunk]))
+
+        results = []
+        for (chunk, future) in zip(arguments, futures):
+            for (args, (nominal_result, gradient)) in zip(chunk,
+                                                          future.result()):
+                results.append(AffineApproximation(nominal_result, LinearPart(
+                        [(arg._linear_part, derivative) for (arg, derivative)
+                         in zip((arg for arg in args if
+                                 isinstance(arg, AffineApproximation)),
+                                gradient)])))
+    return results
+
+
+__all__ = ["parallel_map"]
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file applies a vectorized calculation to a large dataset chunk by
+ chunk on a pool of processes. It needs numpy.
+
+ chunked_map takes an iterable of chunks, e.g. parts of an UncertainStore,
+ and calls a function of UncertainArrays with every chunk in a worker
+ process. The results are yielded in order as soon as they are ready,
+ while only a few chunks are read ahead, so the dataset never has to fit
+ into memory.
+
+ Every chunk is sent with the origins and the data of the variables its
+ arguments depend on, like by uncertain_serialization. The workers import
+ them into their own registry, so a variable shared by several arguments,
+ like a systematic offset, is the same variable there, and uncertain
+ values the function uses itself, e.g. calibration constants defined in
+ its module, keep their own variables. The results are sent back the same
+ way. They are therefore correlated exactly as if the function had been
+ called in this process, also between chunks. With processes started by
+ fork, the workers know the variables of this process from before the
+ pool was started, including such constants. The variables imported for
+ a chunk are freed in the worker once no value of the chunk refers to
+ them any more, so the workers keep no state from chunk to chunk.
+ concatenate joins the results, merging the columns of common variables.
+
+ @author: d0cod3r
+"""
+
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import os
+
+import numpy
+
+from .uncertain_values import registry
+from .uncertain_arrays import (UncertainArray, to_uncertain_operand,
+                               embed_columns)
+from .uncertain_serialization import _variable_table
+
+
+# an UncertainArray with the variables of its columns given by a table of
+# their origins and data as returned by uncertain_serialization._variable_table
+_Operand = namedtuple("_Operand", ["nominal_values", "jacobian", "variables"])
+
+
+def _uncertain_operand(arg):
+    """
+    Convert an argument with to_uncertain_operand, raising an error if it
+    is not supported.
+    """
+    operand = to_uncertain_operand(arg)
+    if operand is NotImplemented:
+        raise TypeError("Can not calculate with arguments of the type %s."
+                        % type(arg).__name__)
+    return operand
+
+
+def _pack(value):
+    """
+    Convert an UncertainArray to an _Operand to send it to another process.
+    Other values are returned unchanged.
+    """
+    if isinstance(value, tuple) and not isinstance(value, _Operand):
+        return tuple(_pack(part) for part in value)
+    if isinstance(value, UncertainArray):
+        return _Operand(value.nominal_values, value.jacobian,
+                        _variable_table(value.variable_indices.tolist()))
+    return value
+
+
+def _origins(variables):
+    # the origins of the variables of a table
+    (tokens, token_numbers, origin_indices, _) = variables
+    return [(tokens[number], index) for (number, index) in
+            zip(token_numbers, origin_indices)]
+
+
+def _unpack(value):
+    """
+    Convert an _Operand back to an UncertainArray of the variables of this
+    process, importing the unknown ones. Other values are returned
+    unchanged.
+    """
+    if isinstance(value, tuple) and not isinstance(value, _Operand):
+        return tuple(_unpack(part) for part in value)
+    if not isinstance(value, _Operand):
+        return value
+    (indices, owners) = registry.import_variables(_origins(value.variables),
+                                                  *value.variables[3])
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    # the columns must be sorted by the variables
+    order = numpy.argsort(indices)
+    ranks = numpy.empty_like(order)
+    ranks[order] = numpy.arange(len(order))
+    return UncertainArray(value.nominal_values,
+                          embed_columns(value.jacobian, ranks, len(order)),
+                          indices[order], owners)
+
+
+def _evaluate_chunk(function, operands):
+    """
+    Call function with the operands of a chunk, see _pack, and return the
+    packed result. Runs in the worker processes.
+    """
+    result = function(*_unpack(tuple(operands)))
+    if isinstance(result, tuple):
+        return tuple(_pack(_uncertain_operand(value)) for value in result)
+    return _pack(_uncertain_operand(result))
+
+
+def chunked_map(function, chunks, shared=(), processes=None,
+                max_pending=None):
+    """
+    Yield function(*chunk, *shared) for every chunk, calculated on a pool of
+    processes, in the order of the chunks.
+
+    function -- a function of UncertainArrays, picklable, i.e. defined at
+    the top level of a module. It can use arithmetics, the functions of
+    uncertain_array_math and others wrapped with wrap_vectorized and
+    uncertain values defined in its module, but must not create new
+    variables. It returns an UncertainArray, an array of
+    floats or a tuple of them.
+
+    chunks -- iterable of the arguments: tuples of UncertainArrays, lists
+    of uncertain values, numpy arrays and floats, or single arguments that
+    are no tuples. It is read only as far as needed.
+
+    shared -- arguments appended to every call, e.g. calibration constants
+
+    processes -- amount of processes, by default the amount of processors
+
+    max_pending -- amount of chunks sent to the processes before waiting
+    for the first result, 2*processes by default. Bounds the memory needed.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2*processes
+    if max_pending < 1:
+        raise ValueError("max_pending must be at least 1.")
+    shared = [_pack(_uncertain_operand(arg)) for arg in shared]
+
+    chunks = iter(chunks)
+    pending = []
+
+    def submit(chunk):
+        if not isinstance(chunk, tuple):
+            chunk = (chunk,)
+        operands = [_pack(_uncertain_operand(arg)) for arg in chunk] + shared
+        pending.append(executor.submit(_evaluate_chunk, function, operands))
+
+    with ProcessPoolExecutor(processes) as executor:
+        for chunk in islice(chunks, max_pending):
+            submit(chunk)
+        while pending:
+            result = pending.pop(0).result()
+            # read the next chunk before the result is processed further
+            for chunk in islice(chunks, 1):
+                submit(chunk)
+            yield _unpack(result)
+
+
+__all__ = ["chunked_map"]
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file stores uncertain values in a compact binary format, keeping
+ their correlations, e.g. to send them to other processes or to save them
+ to disk.
+
+ dumps converts a list of uncertain values and floats or an UncertainArray
+ to bytes, loads restores them. dump and load do the same with files.
+
+ The format consists of a table of the independent variables the values
+ depend on, with their nominal values and uncertainties, and the
+ coefficients of the values as a sparse matrix in compressed row format.
+ Every variable is stored with its origin in the registry that created it
+ (see VariableRegistry), so loading it again in any process gives the same
+ variable and values loaded separately stay correlated.
+
+ Uncertain values and UncertainArrays are pickled in this format as well.
+
+ @author: d0cod3r
+"""
+
+
+import gc
+import os
+import struct
+import sys
+from array import array
+
+from .uncertain_values import (AffineApproximation, LinearPart, registry,
+                               FLOAT_LIKE_TYPES, numpy)
+
+
+MAGIC = b"UNCV"
+VERSION = 1
+
+# magic, version, kind, amount of tokens, variables, values, entries and
+# dimensions
+HEADER = struct.Struct("<4sHHqqqqq")
+
+# kinds of stored objects
+LIST = 0
+ARRAY = 1
+
+TOKEN_SIZE = 16
+
+
+def _to_bytes(values):
+    """
+    Return the bytes of an array in little endian byte order.
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(data, offset, typecode, length):
+    """
+    Read an array of length elements written by _to_bytes and return it with
+    the offset after it.
+    """
+    values = array(typecode)
+    end = offset + length*values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return (values, end)
+
+
+def _variable_table(indices):
+    """
+    Return the tokens, the token numbers, the origin indices and the data of
+    the variables with the given indices in the registry.
+    """
+    tokens = {}
+    token_numbers = array("q")
+    origin_indices = array("q")
+    for index in indices:
+        (token, origin_index) = registry.origin(index)
+        token_numbers.append(tokens.setdefault(token, len(tokens)))
+        origin_indices.append(origin_index)
+    if numpy is not None:
+        positions = numpy.asarray(indices, dtype=numpy.int64)
+        data = [array("d", numpy.frombuffer(values, dtype=numpy.float64)
+                      [positions].tobytes())
+                for values in (registry.nominal_values, registry.stat_std_devs,
+                               registry.sys_std_devs)]
+    else:
+        data = [array("d", [values[index] for index in indices])
+                for values in (registry.nominal_values, registry.stat_std_devs,
+                               registry.sys_std_devs)]
+    return (list(tokens), token_numbers, origin_indices, data)
+
+
+def _rows_of_values(values):
+    """
+    Return the nominal values, the row pointers, the registry indices and
+    the coefficients of a list of uncertain values and floats.
+    """
+    nominal_values = array("d")
+    indptr = array("q", [0])
+    columns = array("q")
+    coefficients = array("d")
+    for value in values:
+        if isinstance(value, AffineApproximation):
+            (indices, value_coefficients) = value._linear_part.get_linear_combo()
+            columns.extend(indices)
+            coefficients.extend(value_coefficients)
+            nominal_values.append(value._nominal_value)
+        elif isinstance(value, FLOAT_LIKE_TYPES):
+            nominal_values.append(value)
+        else:
+            raise TypeError("Can not serialize values of the type %s."
+                            % type(value).__name__)
+        indptr.append(len(columns))
+    return (nominal_values, indptr, columns, coefficients)
+
+
+def _rows_of_array(uncertain_array):
+    """
+    Like _rows_of_values for an UncertainArray, with the columns of the
+    jacobian instead of registry indices.
+    """
+    from .uncertain_values import is_sparse
+
+    jacobian = uncertain_array.jacobian
+    if is_sparse(jacobian):
+        jacobian = jacobian.tocsr()
+        (indptr, columns, coefficients) = (jacobian.indptr, jacobian.indices,
+                                           jacobian.data)
+    else:
+        (rows, columns) = numpy.nonzero(jacobian)
+        coefficients = jacobian[rows, columns]
+        indptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(
+                rows, minlength=jacobian.shape[0]))))
+    return [array(typecode, numpy.ascontiguousarray(values, dtype=dtype)
+                  .tobytes())
+            for (typecode, dtype, values) in (
+                    ("d", numpy.float64, uncertain_array.nominal_values),
+                    ("q", numpy.int64, indptr), ("q", numpy.int64, columns),
+                    ("d", numpy.float64, coefficients))]
+
+
+def _sparse_rows(values):
+    """
+    Return the kind, the shape, the registry indices of the variable table,
+    the nominal values, and the row pointers, positions in the variable
+    table and coefficients of the sparse rows of a list of uncertain values
+    and floats or of an UncertainArray.
+    """
+    if hasattr(values, "jacobian"):
+        # an UncertainArray, its columns are the variable table
+        kind = ARRAY
+        shape = values.shape
+        indices = values.variable_indices.tolist()
+        (nominal_values, indptr, columns, coefficients) = _rows_of_array(values)
+    else:
+        kind = LIST
+        (nominal_values, indptr, columns, coefficients) = _rows_of_values(values)
+        shape = (len(nominal_values),)
+        # replace the registry indices by positions in the variable table
+        if numpy is not None:
+            (indices, positions) = numpy.unique(
+                    numpy.frombuffer(columns, dtype=numpy.int64),
+                    return_inverse=True)
+            indices = indices.tolist()
+            columns = array("q", positions.astype(numpy.int64).tobytes())
+        else:
+            indices = sorted(set(columns))
+            positions = {index: position for (position, index)
+                         in enumerate(indices)}
+            columns = array("q", [positions[index] for index in columns])
+    return (kind, shape, indices, nominal_values, indptr, columns,
+            coefficients)
+
+
+def dumps(values):
+    """
+    Return the bytes of a list of uncertain values and floats or of an
+    UncertainArray, from which loads restores them.
+    """
+    (kind, shape, indices, nominal_values, indptr, columns,
+     coefficients) = _sparse_rows(values)
+    (tokens, token_numbers, origin_indices, data) = _variable_table(indices)
+
+    parts = [HEADER.pack(MAGIC, VERSION, kind, len(tokens), len(indices),
+                         len(nominal_values), len(columns), len(shape)),
+             _to_bytes(array("q", shape))]
+    parts.extend(tokens)
+    parts.extend(_to_bytes(values) for values in
+                 [token_numbers, origin_indices] + data
+                 + [nominal_values, indptr, columns, coefficients])
+    return b"".join(parts)
+
+
+def loads(data):
+    """
+    Restore the values stored by dumps. Returns a list of uncertain values
+    or an UncertainArray. Variables that are already known are not created
+    again, so the values are correlated with them.
+    """
+    # Creating many objects triggers the garbage collector again and again,
+    # which would take most of the time. The new objects have no cycles.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _loads(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _loads(data):
+    """
+    Implementation of loads.
+    """
+    data = memoryview(data)
+    (magic, version, kind, token_count, variable_count, value_count,
+     entry_count, ndim) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("The data are no serialized uncertain values.")
+    if version != VERSION:
+        raise ValueError("Unknown version %i of the format." % version)
+    offset = HEADER.size
+
+    (shape, offset) = _read_array(data, offset, "q", ndim)
+    tokens = []
+    for _ in range(token_count):
+        tokens.append(bytes(data[offset:offset+TOKEN_SIZE]))
+        offset += TOKEN_SIZE
+    arrays = []
+    for (typecode, length) in (("q", variable_count), ("q", variable_count),
+                               ("d", variable_count), ("d", variable_count),
+                               ("d", variable_count), ("d", value_count),
+                               ("q", value_count+1), ("q", entry_count),
+                               ("d", entry_count)):
+        (values, offset) = _read_array(data, offset, typecode, length)
+        arrays.append(values)
+    (token_numbers, origin_indices, variable_nominal_values, stat, sys_,
+     nominal_values, indptr, columns, coefficients) = arrays
+
+    # owners keeps the variables in the registry until the values refer to
+    # them, the LinearParts of the values look them up
+    (local_indices, owners) = registry.import_variables(
+            [(tokens[number], index) for (number, index) in
+             zip(token_numbers, origin_indices)],
+            variable_nominal_values, stat, sys_)
+
+    if kind == ARRAY:
+        return _load_array(nominal_values, tuple(shape), local_indices, indptr,
+                           columns, coefficients, owners)
+    if kind != LIST:
+        raise ValueError("Unknown kind of stored object %i." % kind)
+
+    if numpy is not None:
+        return _load_values_numpy(nominal_values, local_indices, indptr,
+                                  columns, coefficients)
+
+    values = []
+    for row in range(value_count):
+        (start, stop) = (indptr[row], indptr[row+1])
+        # expanded linear combinations are sorted by the indices
+        entries = sorted(zip([local_indices[column] for column in
+                              columns[start:stop]],
+                             coefficients[start:stop]))
+        values.append(AffineApproximation(nominal_values[row], LinearPart(
+                (array("q", [index for (index, _) in entries]),
+                 array("d", [coefficient for (_, coefficient) in entries])))))
+    return values
+
+
+def _load_values_numpy(nominal_values, local_indices, indptr, columns,
+                       coefficients):
+    """
+    Build the list of values restored by loads with numpy, sorting all
+    linear combinations at once.
+    """
+    indptr = numpy.frombuffer(indptr, dtype=numpy.int64)
+    rows = numpy.repeat(numpy.arange(len(indptr)-1), numpy.diff(indptr))
+    indices = numpy.asarray(local_indices, dtype=numpy.int64)[
+            numpy.frombuffer(columns, dtype=numpy.int64)]
+    coefficients = numpy.frombuffer(coefficients, dtype=numpy.float64)
+    if len(indices) and not (numpy.diff(indices)[numpy.diff(rows) == 0] > 0).all():
+        order = numpy.lexsort((indices, rows))
+        (indices, coefficients) = (indices[order], coefficients[order])
+    index_bytes = indices.tobytes()
+    coefficient_bytes = coefficients.tobytes()
+
+    values = []
+    bounds = indptr.tolist()
+    for (row, nominal_value) in enumerate(nominal_values):
+        (start, stop) = (8*bounds[row], 8*bounds[row+1])
+        values.append(AffineApproximation(nominal_value, LinearPart(
+                (array("q", index_bytes[start:stop]),
+                 array("d", coefficient_bytes[start:stop])))))
+    return values
+
+
+def _load_array(nominal_values, shape, local_indices, indptr, columns,
+                coefficients, owners=None):
+    """
+    Build the UncertainArray restored by loads. The arguments can be arrays
+    or numpy arrays, indptr does not have to start with 0. owners are the
+    owners of the slots of the variables, see VariableRegistry.owners.
+    """
+    from .uncertain_arrays import UncertainArray
+    from .uncertain_values import build_jacobian
+
+    # the columns of the jacobian must be sorted by the variables
+    local_indices = numpy.asarray(local_indices, dtype=numpy.int64)
+    order = numpy.argsort(local_indices)
+    ranks = numpy.empty_like(order)
+    ranks[order] = numpy.arange(len(order))
+
+    indptr = numpy.asarray(indptr, dtype=numpy.int64)
+    rows = numpy.repeat(numpy.arange(len(indptr)-1), numpy.diff(indptr))
+    columns = ranks[numpy.asarray(columns, dtype=numpy.int64)]
+    jacobian = build_jacobian(rows, columns,
+                              numpy.asarray(coefficients, dtype=numpy.float64),
+                              (len(indptr)-1, len(order)))
+    return UncertainArray(numpy.array(nominal_values, dtype=numpy.float64)
+                          .reshape(shape), jacobian, local_indices[order],
+                          owners)
+
+
+def dump(values, file):
+    """
+    Write values to a file as dumps does. file is a path or a file opened
+    in binary mode.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "wb") as opened_file:
+            opened_file.write(dumps(values))
+    else:
+        file.write(dumps(values))
+
+
+def load(file):
+    """
+    Read values written by dump. file is a path or a file opened in binary
+    mode.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as opened_file:
+            return loads(opened_file.read())
+    return loads(file.read())
+
+
+def _restore_value(data):
+    # used to unpickle a single AffineApproximation
+    return loads(data)[0]
+
+
+def _restore_variable(token, index, nominal_value, stat, sys):
+    # used to unpickle an UncertainVariable, the same object is returned if
+    # the variable is known
+    ((local_index,), owners) = registry.import_variables(
+            [(token, index)], [nominal_value], [stat], [sys])
+    return registry.variable(local_index)
+
+
+__all__ = ["dumps", "loads", "dump", "load"]
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file stores large datasets of uncertain values on disk as
+ memory-mapped arrays. It needs numpy.
+
+ save_store writes a list of uncertain values and floats or an
+ UncertainArray to a directory of .npy files: the nominal values and the
+ standard deviations of the values, the table of the independent variables
+ they depend on and the coefficients as a sparse matrix in compressed row
+ format, like uncertain_serialization does in a single file.
+
+ open_store maps these files into memory without reading them. The
+ returned UncertainStore reads only the parts needed for what is accessed:
+ store.n[1000:2000] or store.stat[1000:2000] touch the pages of these
+ values, store[1000:2000] additionally their coefficients and the rows of
+ the variable table they depend on. The values are indexed in flattened
+ order, store.shape is the shape they were saved with.
+
+ Values loaded from a store are correlated with each other, with values
+ loaded from other stores of the same variables and with the variables
+ themselves, if they exist in this process, see VariableRegistry.
+
+ @author: d0cod3r
+"""
+
+
+import os
+
+import numpy
+
+from .uncertain_values import registry, build_jacobian, is_sparse
+from .uncertain_serialization import (_sparse_rows, _variable_table,
+                                      _load_array, TOKEN_SIZE)
+
+
+VERSION = 1
+
+# the arrays of a store, saved as <name>.npy
+FILES = ("header", "nominal_values", "stat", "sys", "indptr", "columns",
+         "coefficients", "variable_nominal_values", "variable_stat",
+         "variable_sys", "variable_tokens", "variable_origins", "tokens")
+
+
+def _standard_deviations(indptr, columns, coefficients, variable_std_devs):
+    """
+    Return the standard deviations of the values given by sparse rows, with
+    the standard deviations of the variables in the table.
+    """
+    rows = numpy.repeat(numpy.arange(len(indptr)-1), numpy.diff(indptr))
+    std_devs = variable_std_devs[columns]
+    with numpy.errstate(invalid="ignore"):
+        components = coefficients*std_devs
+    # derivative can be nan if uncertainty is 0
+    components[std_devs == 0] = 0.
+    return numpy.sqrt(numpy.bincount(rows, weights=components**2,
+                                     minlength=len(indptr)-1))
+
+
+def save_store(path, values):
+    """
+    Save a list of uncertain values and floats or an UncertainArray to the
+    directory path, which is created if needed. Existing files of a store
+    are overwritten.
+    """
+    (_, shape, indices, nominal_values, indptr, columns,
+     coefficients) = _sparse_rows(values)
+    (tokens, token_numbers, origin_indices, data) = _variable_table(indices)
+
+    arrays = {
+        "header": numpy.array((VERSION, len(shape)) + tuple(shape),
+                              dtype=numpy.int64),
+        "nominal_values": numpy.asarray(nominal_values, dtype=numpy.float64),
+        "indptr": numpy.asarray(indptr, dtype=numpy.int64),
+        "columns": numpy.asarray(columns, dtype=numpy.int64),
+        "coefficients": numpy.asarray(coefficients, dtype=numpy.float64),
+        "variable_tokens": numpy.asarray(token_numbers, dtype=numpy.int64),
+        "variable_origins": numpy.asarray(origin_indices, dtype=numpy.int64),
+        "tokens": numpy.frombuffer(b"".join(tokens), dtype=numpy.uint8)
+                  .reshape(len(tokens), TOKEN_SIZE)}
+    for (name, variable_data) in zip(("variable_nominal_values",
+                                      "variable_stat", "variable_sys"), data):
+        arrays[name] = numpy.asarray(variable_data, dtype=numpy.float64)
+    for kind in ("stat", "sys"):
+        arrays[kind] = _standard_deviations(
+                arrays["indptr"], arrays["columns"], arrays["coefficients"],
+                arrays["variable_" + kind])
+
+    os.makedirs(path, exist_ok=True)
+    for name in FILES:
+        numpy.save(os.path.join(path, name + ".npy"), arrays[name])
+
+
+def open_store(path):
+    """
+    Open a store written by save_store, see UncertainStore.
+    """
+    return UncertainStore(path)
+
+
+class UncertainStore(object):
+    """
+    Read-only access to a store written by save_store. The arrays are
+    memory-mapped, so opening a store reads nothing but their headers.
+    """
+
+    __slots__ = ("_arrays", "_shape", "_tokens")
+
+    def __init__(self, path):
+        """
+        Open the store in the directory path.
+        """
+        arrays = {name: numpy.load(os.path.join(path, name + ".npy"),
+                                   mmap_mode="r")
+                  for name in FILES}
+        header = arrays["header"]
+        if header[0] != VERSION:
+            raise ValueError("Unknown version %i of the format." % header[0])
+        self._shape = tuple(int(length) for length in header[2:2+header[1]])
+        self._arrays = arrays
+        self._tokens = [bytes(token) for token in arrays["tokens"]]
+
+    ###########################################################################
+    # access to the data
+
+    @property
+    def shape(self):
+        """
+        Shape of the saved values.
+        """
+        return self._shape
+
+    @property
+    def size(self):
+        return len(self._arrays["nominal_values"])
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nominal_values(self):
+        """
+        Memory-mapped array of the flattened nominal values.
+        """
+        return self._arrays["nominal_values"]
+
+    # Abbrevation to make formulars shorter
+    n = nominal_values
+
+    @property
+    def statistical_standard_deviations(self):
+        """
+        Memory-mapped array of the flattened statistical standard deviations.
+        """
+        return self._arrays["stat"]
+
+    stat_std_devs = statistical_standard_deviations
+
+    stat = statistical_standard_deviations
+
+    @property
+    def systematic_standard_deviations(self):
+        """
+        Memory-mapped array of the flattened systematic standard deviations.
+        """
+        return self._arrays["sys"]
+
+    sys_std_devs = systematic_standard_deviations
+
+    sys = systematic_standard_deviations
+
+    def __repr__(self):
+        return "UncertainStore(shape=%r, variables=%i)" % (
+                self._shape, len(self._arrays["variable_origins"]))
+
+    ###########################################################################
+    # reading values
+
+    def _rows(self, key):
+        """
+        Return the rows selected by an integer, a slice, an array of
+        integers or a boolean mask, and the row pointers, the positions in
+        the variable table and the coefficients of these rows.
+        """
+        size = self.size
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(size)
+            if step == 1:
+                # a contiguous part of the files
+                stop = max(start, stop)
+                indptr = numpy.asarray(self._arrays["indptr"][start:stop+1])
+                (first, last) = (indptr[0], indptr[-1])
+                return (slice(start, stop), indptr - first,
+                        self._arrays["columns"][first:last],
+                        self._arrays["coefficients"][first:last])
+            rows = numpy.arange(start, stop, step)
+        else:
+            rows = numpy.asarray(key)
+            if rows.dtype == bool:
+                if rows.shape != (size,):
+                    raise IndexError("The mask must have the length of the "
+                                     "store.")
+                rows = numpy.flatnonzero(rows)
+            elif rows.dtype.kind not in "iu":
+                raise IndexError("Only integers, slices, integer arrays and "
+                                 "boolean masks are valid indices.")
+            rows = rows.reshape(-1).astype(numpy.int64)
+            if len(rows) and not (-size <= rows.min() and rows.max() < size):
+                raise IndexError("Index out of range for a store of %i "
+                                 "values." % size)
+            rows = rows % max(size, 1)
+
+        # gather the entries of the rows
+        indptr = self._arrays["indptr"]
+        starts = numpy.asarray(indptr[rows])
+        lengths = numpy.asarray(indptr[rows+1]) - starts
+        offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+        entries = (numpy.arange(offsets[-1])
+                   + numpy.repeat(starts - offsets[:-1], lengths))
+        return (rows, offsets, self._arrays["columns"][entries],
+                self._arrays["coefficients"][entries])
+
+    def __getitem__(self, key):
+        """
+        Return an AffineApproximation for an integer and an UncertainArray
+        otherwise. Only the variables the values depend on are read.
+        """
+        scalar = numpy.ndim(key) == 0 and not isinstance(key, slice)
+        (rows, indptr, columns, coefficients) = self._rows(key)
+
+        # import the used rows of the variable table, see
+        # uncertain_serialization
+        (used, columns) = numpy.unique(columns, return_inverse=True)
+        tokens = self._tokens
+        token_numbers = self._arrays["variable_tokens"][used].tolist()
+        origin_indices = self._arrays["variable_origins"][used].tolist()
+        (local_indices, owners) = registry.import_variables(
+                [(tokens[number], index) for (number, index) in
+                 zip(token_numbers, origin_indices)],
+                self._arrays["variable_nominal_values"][used],
+                self._arrays["variable_stat"][used],
+                self._arrays["variable_sys"][used])
+
+        nominal_values = self._arrays["nominal_values"][rows]
+        values = _load_array(nominal_values, numpy.shape(nominal_values),
+                             local_indices, indptr, columns.reshape(-1),
+                             coefficients, owners)
+        if scalar:
+            return values[0]
+        return values
+
+    def load(self):
+        """
+        Return all values as an UncertainArray of the saved shape.
+        """
+        return self[:].reshape(self._shape)
+
+    def covariance_block(self, rows, columns=None, kind="stat"):
+        """
+        Return the block of the covariance matrix of the flattened values
+        with the given rows and columns as a numpy array.
+
+        rows, columns -- slices, arrays of integers or boolean masks. By
+        default, the columns are the same as the rows.
+
+        kind -- "stat" or "sys"
+        """
+        if kind not in ("stat", "sys"):
+            raise ValueError('kind must be "stat" or "sys".')
+        selections = [self._rows(rows)]
+        if columns is not None:
+            selections.append(self._rows(columns))
+
+        used = numpy.unique(numpy.concatenate(
+                [numpy.asarray(positions) for (_, _, positions, _)
+                 in selections]))
+        variable_std_devs = numpy.asarray(
+                self._arrays["variable_" + kind][used])
+        scaled = []
+        for (_, indptr, positions, coefficients) in selections:
+            positions = numpy.searchsorted(used, positions)
+            # like scaled_jacobian with the standard deviations of the table
+            std_devs = variable_std_devs[positions]
+            with numpy.errstate(invalid="ignore"):
+                coefficients = coefficients*std_devs
+            # derivative can be nan if uncertainty is 0
+            coefficients[std_devs == 0] = 0.
+            scaled.append(build_jacobian(
+                    numpy.repeat(numpy.arange(len(indptr)-1),
+                                 numpy.diff(indptr)),
+                    positions, coefficients, (len(indptr)-1, len(used))))
+        block = scaled[0] @ scaled[-1].T
+        if is_sparse(block):
+            block = block.toarray()
+        return numpy.asarray(block)
+
+
+__all__ = ["save_store", "open_store", "UncertainStore"]
@@ -24,13 +24,42 @@
 # If the derivative of an operation is not definded, the calculation can still
 # be correct if the uncertainty is 0. To handle this, nan is allowed as a
 # derivative and will only raise an error if the uncertainty is not 0.
+#
+# The independent variables are numbered. Their nominal values and
+# uncertainties are stored in the arrays of a VariableRegistry and an
+# expanded LinearPart only holds the indices of the variables it depends on
+# and the coefficients as two arrays. This needs much less memory than a dict
+# and allows numpy to work on long linear combinations.
 
 from numbers import Number
 from sys import float_info
-from itertools import repeat
-from collections import defaultdict
+from array import array
+from itertools import repeat, chain
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock, RLock
 from math import sqrt, floor, log, log10
+from operator import add, sub
 from types import MappingProxyType
+from uuid import uuid4
+import inspect
+import os
+import weakref
+
+# numpy is optional. If it is available, it is used for long linear
+# combinations and some more methods are defined at the end of this file.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# with scipy, jacobians of many values can be stored as sparse matrices
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
 
 
 # float("nan") is used for derivatives that could not be calculated.
@@ -43,6 +72,13 @@ NOT_DIFFERENTIALBE = float("nan")
 SIGNIFICANT_DIGITS = 2
 
 FLOAT_LIKE_TYPES = (Number,)
+if numpy is not None:
+    # numpy brings more types of numbers
+    FLOAT_LIKE_TYPES += (numpy.number,)
+
+# Linear combinations with more entries than this are added up using numpy,
+# for shorter ones the overhead of creating numpy arrays does not pay off.
+NUMPY_THRESHOLD = 64
 
 # Step size for numeric differentiation
 try:
@@ -104,6 +140,280 @@ def pow_derivative_1(x, y):
     else: # cases x<0 and (x,y)=(0,0)
         return NOT_DIFFERENTIALBE
 
+def pow_value_and_gradient(x, y):
+    # x**y and both derivatives as above, reusing the value
+    value = x**y
+    if y==0:
+        derivative_0 = 0.
+    elif x != 0:
+        derivative_0 = y*value/x
+    elif y%1==0:
+        derivative_0 = y*x**(y-1)
+    else:
+        derivative_0 = NOT_DIFFERENTIALBE
+    if x==0 and y>0:
+        derivative_1 = 0.
+    elif x>0:
+        derivative_1 = log(x)*value
+    else:
+        derivative_1 = NOT_DIFFERENTIALBE
+    return (value, (derivative_0, derivative_1))
+
+
+def empty_linear_combo():
+    """
+    Return an expanded linear combination without any variables.
+    """
+    # the same arrays are shared by all constants, they are never changed
+    return _EMPTY_LINEAR_COMBO
+
+_EMPTY_LINEAR_COMBO = (array("q"), array("d"))
+
+
+def sparse_sum(terms):
+    """
+    Add up scaled sparse vectors.
+    
+    terms -- An iterable of (factor, indices, coefficients), where indices
+    and coefficients are arrays and describe a vector as in an expanded
+    LinearPart.
+    
+    Returns the sum as a pair of arrays (indices, coefficients), sorted by
+    the indices.
+    """
+    terms = list(terms)
+    length = sum(len(indices) for (_, indices, _) in terms)
+    
+    if numpy is not None and length > NUMPY_THRESHOLD:
+        # vectorized: concatenate everything and sum up equal indices
+        indices = numpy.concatenate([
+                numpy.frombuffer(indices, dtype=numpy.int64)
+                for (_, indices, _) in terms])
+        coefficients = numpy.concatenate([
+                factor*numpy.frombuffer(coefficients, dtype=numpy.float64)
+                for (factor, _, coefficients) in terms])
+        (indices, positions) = numpy.unique(indices, return_inverse=True)
+        coefficients = numpy.bincount(positions, weights=coefficients,
+                                      minlength=len(indices))
+        return (array("q", indices.tobytes()),
+                array("d", coefficients.tobytes()))
+    
+    sums = {}
+    for (factor, indices, coefficients) in terms:
+        for (index, coefficient) in zip(indices, coefficients):
+            sums[index] = sums.get(index, 0.) + factor*coefficient
+    indices = sorted(sums)
+    return (array("q", indices), array("d", [sums[i] for i in indices]))
+
+
+def standard_deviations(indices, coefficients):
+    """
+    Return the statistical and the systematic standard deviation of a linear
+    combination of independent variables, calculated in one pass.
+    
+    indices, coefficients -- the arrays of an expanded LinearPart
+    """
+    stat_std_devs = registry.stat_std_devs
+    sys_std_devs = registry.sys_std_devs
+    
+    if numpy is not None and len(indices) > NUMPY_THRESHOLD:
+        # gather the standard deviations and build the dot products
+        indices = numpy.frombuffer(indices, dtype=numpy.int64)
+        coefficients = numpy.frombuffer(coefficients, dtype=numpy.float64)
+        variances = []
+        for std_devs in (stat_std_devs, sys_std_devs):
+            std_devs = numpy.frombuffer(std_devs, dtype=numpy.float64)[indices]
+            components = coefficients*std_devs
+            # derivative can be nan if uncertainty is 0
+            components[std_devs == 0] = 0.
+            variances.append(numpy.dot(components, components))
+        return (sqrt(variances[0]), sqrt(variances[1]))
+    
+    stat_variance = 0.
+    sys_variance = 0.
+    for (index, coefficient) in zip(indices, coefficients):
+        # derivative can be nan if uncertainty is 0
+        std_dev = stat_std_devs[index]
+        if std_dev != 0:
+            stat_variance += (coefficient*std_dev)**2
+        std_dev = sys_std_devs[index]
+        if std_dev != 0:
+            sys_variance += (coefficient*std_dev)**2
+    return (sqrt(stat_variance), sqrt(sys_variance))
+
+
+def _reflected_pow(x, y):
+    # value and gradient of y**x for __rpow__, with swapped derivatives
+    (value, (derivative_0, derivative_1)) = pow_value_and_gradient(x, y)
+    return (value, (derivative_1, derivative_0))
+
+
+class Dual(object):
+    """
+    A dual number with several infinitesimal components, used by wrap to
+    calculate all derivatives of a function in one call (forward mode
+    automatic differentiation).
+
+    A Dual can not be converted to float, so functions that need floats, like
+    the ones of the math module, raise a TypeError and wrap falls back to
+    numeric derivatives for that call. The functions wrapped by wrap accept
+    Duals, their derivatives are exact if they were wrapped with derivatives
+    or value_and_gradient and numeric otherwise.
+    """
+
+    __slots__ = ("value", "gradient")
+
+    def __init__(self, value, gradient):
+        """
+        value -- the real part
+
+        gradient -- list of the derivatives to each of the arguments
+        """
+        self.value = value
+        self.gradient = gradient
+
+    def _scaled_gradient(self, factor):
+        return [factor*g for g in self.gradient]
+
+    def __add__(self, other):
+        if type(other) is Dual:
+            return Dual(self.value + other.value,
+                        list(map(add, self.gradient, other.gradient)))
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            return Dual(self.value + other, self.gradient)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if type(other) is Dual:
+            return Dual(self.value - other.value,
+                        list(map(sub, self.gradient, other.gradient)))
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            return Dual(self.value - other, self.gradient)
+        return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            return Dual(other - self.value, self._scaled_gradient(-1.))
+        return NotImplemented
+
+    def __mul__(self, other):
+        if type(other) is Dual:
+            (x, y) = (self.value, other.value)
+            return Dual(x*y, [y*a + x*b for (a, b) in
+                              zip(self.gradient, other.gradient)])
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            return Dual(self.value*other, self._scaled_gradient(other))
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if type(other) is Dual:
+            (x, y) = (self.value, other.value)
+            value = x/y
+            return Dual(value, [(a - value*b)/y for (a, b) in
+                                zip(self.gradient, other.gradient)])
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            return Dual(self.value/other, self._scaled_gradient(1./other))
+        return NotImplemented
+
+    def __rtruediv__(self, other):
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            value = other/self.value
+            return Dual(value, self._scaled_gradient(-value/self.value))
+        return NotImplemented
+
+    def __pow__(self, other):
+        if type(other) is Dual:
+            (value, (derivative_0, derivative_1)) = pow_value_and_gradient(
+                    self.value, other.value)
+            return Dual(value, [derivative_0*a + derivative_1*b for (a, b) in
+                                zip(self.gradient, other.gradient)])
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            return Dual(self.value**other, self._scaled_gradient(
+                    pow_derivative_0(self.value, other)))
+        return NotImplemented
+
+    def __rpow__(self, other):
+        if isinstance(other, FLOAT_LIKE_TYPES):
+            (value, (_, derivative)) = pow_value_and_gradient(other,
+                                                              self.value)
+            return Dual(value, self._scaled_gradient(derivative))
+        return NotImplemented
+
+    def __neg__(self):
+        return Dual(-self.value, self._scaled_gradient(-1.))
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        # the derivative in 0 is not defined
+        if self.value == 0:
+            return Dual(0., self._scaled_gradient(NOT_DIFFERENTIALBE))
+        return self if self.value > 0 else -self
+
+    # like floats, a Dual is its own real part
+    @property
+    def real(self):
+        return self
+
+    @property
+    def imag(self):
+        return 0.
+
+    def conjugate(self):
+        return self
+
+    # comparisons use the real part, so branches in the function are taken
+    # as for floats
+    def __eq__(self, other):
+        return self.value == (other.value if type(other) is Dual else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.value < (other.value if type(other) is Dual else other)
+
+    def __le__(self, other):
+        return self.value <= (other.value if type(other) is Dual else other)
+
+    def __gt__(self, other):
+        return self.value > (other.value if type(other) is Dual else other)
+
+    def __ge__(self, other):
+        return self.value >= (other.value if type(other) is Dual else other)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    __hash__ = None
+
+    def __float__(self):
+        # converting would lose the derivatives
+        raise TypeError("A Dual can not be converted to float.")
+
+
+def _dual_call(value_and_gradient, args):
+    """
+    Call a function given as value_and_gradient with arguments of which some
+    are Duals and return the resulting Dual using the chain rule.
+    """
+    nominal_args = [arg.value if type(arg) is Dual else arg for arg in args]
+    (value, gradient) = value_and_gradient(*nominal_args)
+    result_gradient = None
+    for (arg, derivative) in zip(args, gradient):
+        if type(arg) is Dual:
+            if result_gradient is None:
+                result_gradient = arg._scaled_gradient(derivative)
+            else:
+                result_gradient = [a + derivative*b for (a, b) in
+                                   zip(result_gradient, arg.gradient)]
+    return Dual(value, result_gradient)
+
 
 class IndexableIterator(object):
     """
@@ -156,12 +466,13 @@ def to_affine_approximation(x):
     if isinstance(x, FLOAT_LIKE_TYPES):
         # Return a AffineApproximation, not a Variable, as the uncertainty does
         # not have to be saved, it is 0 by default
-        return AffineApproximation(x, LinearPart({}))
+        return AffineApproximation(x, LinearPart(empty_linear_combo()))
     raise ValueError("Can not transform other than floatlike values to a"
                      "constant AffineApproximation.")
 
 
-def wrap(function, derivatives=None):
+def wrap(function, derivatives=None, value_and_gradient=None, executor=None,
+         cache=None):
     """
     Build a wrapper around a function. The new function will accept uncertain
     values as well as other types and return an uncertain variable with the
@@ -183,11 +494,85 @@ def wrap(function, derivatives=None):
     If None occours, it will be replaced by a numerical derivative.
     If the argument is a list, it must have the same length as the amount
     of arguments given to the function.
+    If no derivatives are given at all, the function is called once with
+    dual numbers to calculate all derivatives. This is exact for arithmetics
+    and for functions wrapped with derivatives or value_and_gradient, like
+    the ones of uncertain_math. Functions wrapped without derivatives, or
+    with None for some, use numeric derivatives when called with dual
+    numbers. If the call raises a TypeError, AttributeError or ValueError,
+    e.g. because the function uses the math module, or does not return a
+    Dual or a number, numeric derivatives are used instead for this call.
+    Any such error has this effect, even if it is not caused by the dual
+    numbers; the function is then called again with floats.
+    
+    value_and_gradient -- Optional: A function that accepts the same
+    arguments as the original function and returns a pair of the value and
+    a sequence of all partial derivatives. It is used instead of function
+    and derivatives if an argument is uncertain, so the value and the
+    derivatives can be calculated together, e.g. the derivative of exp is
+    its value. Derivatives that can not be calculated should be nan.
+    
+    executor -- Optional: A concurrent.futures executor, e.g. a
+    ThreadPoolExecutor or ProcessPoolExecutor. The nominal value, the
+    function values needed for the numeric derivatives and the given
+    derivatives are then calculated in parallel on it, so that the time
+    needed by slow functions is about that of one call. With a
+    ProcessPoolExecutor, the function and the derivatives must be picklable.
+    Dual numbers are not used in this case.
+    
+    cache -- Optional: The maximal amount of nominal results and derivatives
+    to store, keyed on the nominal values of the arguments and the positions
+    of the uncertain ones. A call with the same nominal arguments then only
+    builds the linear part of the result. The least recently used entries
+    are dropped first, None disables the cache. The wrapped function gets
+    the methods cache_info and cache_clear, like with functools.lru_cache.
+    Arguments must be hashable to be cached.
+    """
+    
+    wrapped_function = _build_wrapper(function, derivatives,
+                                      value_and_gradient, executor)
+    if cache is not None:
+        wrapped_function = _cached_wrapper(wrapped_function, cache)
+    
+    wrapped_function.__name__ = function.__name__
+    wrapped_function.__doc__ = WRAPPED_DOC % (function.__name__,
+                                              function.__doc__)
+    
+    return wrapped_function
+
+
+def _build_wrapper(function, derivatives, value_and_gradient, executor):
+    """
+    Choose and build the wrapper for the arguments of wrap.
     """
+    if executor is not None:
+        if value_and_gradient is not None:
+            raise ValueError("value_and_gradient can not be used with an "
+                             "executor.")
+        if derivatives is None:
+            derivatives = repeat(None)
+        if not isinstance(derivatives, list):
+            derivatives = IndexableIterator(derivatives)
+        return _parallel_wrapper(function, derivatives, executor)
+    
+    if value_and_gradient is not None:
+        # specialized like the wrappers with derivatives below, the amount
+        # of arguments is taken from value_and_gradient
+        wrapped_function = _fused_wrapper(function, value_and_gradient)
+        arity = _arity(value_and_gradient)
+        if arity == 1:
+            wrapped_function = _fused_unary_wrapper(
+                    function, value_and_gradient, wrapped_function)
+        elif arity == 2:
+            wrapped_function = _fused_binary_wrapper(
+                    function, value_and_gradient, wrapped_function)
+        return wrapped_function
     
     # if no derivatives are given, use itertools.repeat to generate numeric
-    # derivatives for any amount of arguments
-    if derivatives is None:
+    # derivatives for any amount of arguments, which are used if the
+    # function does not accept dual numbers
+    automatic = derivatives is None
+    if automatic:
         derivatives = repeat(None)
     
     # in case of a list we do not need an IndexableIterator
@@ -200,14 +585,47 @@ def wrap(function, derivatives=None):
         none_converter = lambda i: partial_derivate(function, i)
         derivatives = IndexableIterator(derivatives, none_converter)
     
+    wrapped_function = _general_wrapper(function, derivatives)
+    if automatic:
+        wrapped_function = _automatic_wrapper(function, wrapped_function)
+    
+    # Most functions have one or two arguments. If this is known from the
+    # derivatives, specialized wrappers avoid the overhead of the general
+    # one, which handles any amount of arguments.
+    if isinstance(derivatives, list):
+        if len(derivatives) == 1:
+            wrapped_function = _unary_wrapper(function, derivatives,
+                                              wrapped_function)
+        elif len(derivatives) == 2:
+            wrapped_function = _binary_wrapper(function, derivatives,
+                                               wrapped_function)
+    
+    return wrapped_function
+
+
+WRAPPED_DOC = """
+    A wrapped version of %s to also accept uncertain values as arguments
+    and to return an uncertain value.
+    
+    Original documentation:
+    %s
+    """
+
+# default for an argument that was not given
+_MISSING = object()
+
+
+def _general_wrapper(function, derivatives):
+    """
+    Return the wrapper used by wrap for any amount of arguments.
+    derivatives must be indexable.
+    """
     def wrapped_function(*args):
-        """
-        A wrapped version of %s to also accept uncertain values as arguments
-        and to return an uncertain value.
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, args)
+            if result is not None:
+                return result
         
-        Original documentation:
-        %s
-        """ % (function.__name__, function.__doc__) 
         # Search uncertain inputs
         pos_with_uncert = [index for (index, value) in enumerate(args) if
                    isinstance(value, AffineApproximation)]
@@ -219,6 +637,13 @@ def wrap(function, derivatives=None):
         nominal_args = list(args)
         for index in pos_with_uncert:
             nominal_args[index] = args[index].nominal_value
+
+        # dual numbers from a function differentiated by _automatic_wrapper
+        if not pos_with_uncert and any(type(arg) is Dual for arg in args):
+            return _dual_call(lambda *nominal_args: (function(*nominal_args), [
+                    derivatives[index](*nominal_args)
+                    for index in range(len(nominal_args))]), args)
+
         nominal_result = function(*nominal_args)
         
         # build the linear part using the derivatives
@@ -232,11 +657,611 @@ def wrap(function, derivatives=None):
         
         return AffineApproximation(nominal_result, LinearPart(linear_part))
     
-    wrapped_function.__name__ = function.__name__
+    return wrapped_function
+
+
+def dual_value_and_gradient(function, args, positions):
+    """
+    Call function once with Duals to calculate its value and the partial
+    derivatives with respect to the arguments at the given positions.
+    
+    args -- the nominal arguments, floats at the given positions
+    
+    Returns the value and the list of derivatives or None if the function
+    does not accept Duals, i.e. raises a TypeError, AttributeError or
+    ValueError or does not return a Dual or a number.
+    """
+    # one component of the dual numbers per argument
+    size = len(positions)
+    dual_args = list(args)
+    for (component, index) in enumerate(positions):
+        gradient = [0.]*size
+        gradient[component] = 1.
+        dual_args[index] = Dual(args[index], gradient)
+    
+    try:
+        result = function(*dual_args)
+    except (TypeError, AttributeError, ValueError):
+        # e.g. math functions or attributes of floats that Duals lack. A
+        # real error is raised again by the call with floats.
+        return None
+    
+    if type(result) is Dual:
+        return (result.value, result.gradient)
+    if isinstance(result, FLOAT_LIKE_TYPES):
+        # the result does not depend on the arguments
+        return (result, [0.]*size)
+    return None
+
+
+def _automatic_wrapper(function, numeric_wrapper):
+    """
+    Return the wrapper used by wrap if no derivatives are given. It calls
+    function once with Duals to get all derivatives. numeric_wrapper is used
+    instead for the calls in which function does not accept Duals, e.g. if
+    it takes another branch for other arguments.
+    """
+    def wrapped_function(*args):
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, args)
+            if result is not None:
+                return result
+        pos_with_uncert = [index for (index, value) in enumerate(args) if
+                   isinstance(value, AffineApproximation)]
+        if not pos_with_uncert:
+            return numeric_wrapper(*args)
+
+        nominal_args = list(args)
+        for index in pos_with_uncert:
+            nominal_args[index] = args[index]._nominal_value
+        result = dual_value_and_gradient(function, nominal_args,
+                                         pos_with_uncert)
+        if result is None:
+            return numeric_wrapper(*args)
+        (nominal_result, gradient) = result
+
+        return AffineApproximation(nominal_result, LinearPart(
+                [(args[index]._linear_part, derivative) for (index, derivative)
+                 in zip(pos_with_uncert, gradient)]))
+
+    return wrapped_function
+
+
+def _parallel_wrapper(function, derivatives, executor):
+    """
+    Return the wrapper used by wrap if an executor is given. derivatives
+    must be indexable, None stands for a numeric derivative.
+    """
+    def wrapped_function(*args):
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, args)
+            if result is not None:
+                return result
+        pos_with_uncert = [index for (index, value) in enumerate(args) if
+                   isinstance(value, AffineApproximation)]
+        nominal_args = list(args)
+        for index in pos_with_uncert:
+            nominal_args[index] = args[index]._nominal_value
+        
+        # submit everything before waiting for the first result
+        nominal_future = executor.submit(function, *nominal_args)
+        pending = []
+        for index in pos_with_uncert:
+            derivative = derivatives[index]
+            if derivative is not None:
+                pending.append((index, None,
+                                [executor.submit(derivative, *nominal_args)]))
+                continue
+            # the same steps as in partial_derivate
+            epsilon = EPSILON*(abs(nominal_args[index])+1)
+            futures = []
+            for step in (epsilon, -epsilon):
+                shifted_args = list(nominal_args)
+                shifted_args[index] += step
+                futures.append(executor.submit(function, *shifted_args))
+            pending.append((index, epsilon, futures))
+        
+        try:
+            # in case of an error the exception of the nominal value is raised
+            nominal_result = nominal_future.result()
+            linear_part = []
+            for (index, epsilon, futures) in pending:
+                if epsilon is None:
+                    coefficient = futures[0].result()
+                else:
+                    coefficient = ((futures[0].result() - futures[1].result())
+                                   /epsilon /2)
+                linear_part.append((args[index]._linear_part, coefficient))
+        except BaseException:
+            for (_, _, futures) in pending:
+                for future in futures:
+                    future.cancel()
+            raise
+        
+        return AffineApproximation(nominal_result, LinearPart(linear_part))
+    
+    return wrapped_function
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize",
+                                     "currsize"])
+
+
+def _cached_wrapper(wrapped_function, maxsize):
+    """
+    Return a wrapper around a function returned by the other wrappers, which
+    stores the nominal results and the coefficients of their linear parts in
+    a least recently used cache of maxsize entries.
+    """
+    # maps (nominal arguments, positions of uncertain arguments) to
+    # (nominal result, coefficients)
+    cache = OrderedDict()
+    statistics = [0, 0]
+    lock = Lock()
+    
+    def cached_function(*args):
+        if _shared_contexts:
+            result = _shared_result(cached_function, args)
+            if result is not None:
+                return result
+        pos_with_uncert = [index for (index, value) in enumerate(args) if
+                   isinstance(value, AffineApproximation)]
+        nominal_args = list(args)
+        for index in pos_with_uncert:
+            nominal_args[index] = args[index]._nominal_value
+        key = (tuple(nominal_args), tuple(pos_with_uncert))
+        
+        try:
+            with lock:
+                entry = cache.get(key)
+                if entry is not None:
+                    cache.move_to_end(key)
+                    statistics[0] += 1
+        except TypeError:
+            # not hashable arguments are not cached
+            return wrapped_function(*args)
+        
+        if entry is None:
+            # The uncertain arguments are replaced by stand-ins with empty
+            # LinearParts of their own, so the coefficients can be read from
+            # the result. The LinearPart of the result is never expanded
+            # eagerly, as it is only one calculation away from expanded
+            # ones, see set_max_depth.
+            stand_ins = list(args)
+            for index in pos_with_uncert:
+                stand_ins[index] = AffineApproximation(
+                        nominal_args[index], LinearPart(empty_linear_combo()))
+            result = wrapped_function(*stand_ins)
+            if not isinstance(result, AffineApproximation):
+                return result
+            if pos_with_uncert:
+                derivatives = {id(linear_part): coefficient for
+                               (linear_part, coefficient) in
+                               result._linear_part._linear_combo}
+                coefficients = tuple(
+                        derivatives.get(id(stand_ins[index]._linear_part), 0.)
+                        for index in pos_with_uncert)
+            else:
+                coefficients = ()
+            entry = (result._nominal_value, coefficients)
+            with lock:
+                statistics[1] += 1
+                if maxsize > 0:
+                    cache[key] = entry
+                    if len(cache) > maxsize:
+                        cache.popitem(last=False)
+        
+        (nominal_result, coefficients) = entry
+        return AffineApproximation(nominal_result, LinearPart(
+                [(args[index]._linear_part, coefficient) for
+                 (index, coefficient) in zip(pos_with_uncert, coefficients)]))
+    
+    def cache_info():
+        """
+        Return the hits, misses, maximal and current size of the cache.
+        """
+        with lock:
+            return CacheInfo(statistics[0], statistics[1], maxsize, len(cache))
+    
+    def cache_clear():
+        """
+        Remove all entries from the cache and reset the statistics.
+        """
+        with lock:
+            cache.clear()
+            statistics[:] = [0, 0]
+    
+    cached_function.cache_info = cache_info
+    cached_function.cache_clear = cache_clear
+    return cached_function
+
+
+def _fused_wrapper(function, value_and_gradient):
+    """
+    Return the wrapper used by wrap if value_and_gradient is given.
+    """
+    def wrapped_function(*args):
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, args)
+            if result is not None:
+                return result
+        
+        # Search uncertain inputs
+        pos_with_uncert = [index for (index, value) in enumerate(args) if
+                   isinstance(value, AffineApproximation)]
+        
+        # without uncertain arguments, the gradient is not needed
+        if not pos_with_uncert:
+            if any(type(arg) is Dual for arg in args):
+                return _dual_call(value_and_gradient, args)
+            return AffineApproximation(function(*args),
+                                       LinearPart(empty_linear_combo()))
+        
+        # the common case of one argument is handled directly
+        if len(args) == 1:
+            x = args[0]
+            (nominal_result, (derivative,)) = value_and_gradient(
+                    x._nominal_value)
+            return AffineApproximation(nominal_result, LinearPart(
+                    [(x._linear_part, derivative)]))
+        
+        nominal_args = list(args)
+        for index in pos_with_uncert:
+            nominal_args[index] = args[index]._nominal_value
+        (nominal_result, gradient) = value_and_gradient(*nominal_args)
+        
+        return AffineApproximation(nominal_result, LinearPart(
+                [(args[index]._linear_part, gradient[index])
+                 for index in pos_with_uncert]))
+    
+    return wrapped_function
+
+
+def _arity(function):
+    """
+    Return the amount of positional arguments function needs, None if it
+    can not be determined.
+    """
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    if any(parameter.kind == parameter.VAR_POSITIONAL
+           for parameter in parameters):
+        return None
+    return sum(1 for parameter in parameters
+               if parameter.default is parameter.empty
+               and parameter.kind in (parameter.POSITIONAL_ONLY,
+                                      parameter.POSITIONAL_OR_KEYWORD))
+
+
+def _fused_unary_wrapper(function, value_and_gradient, general_wrapper):
+    """
+    Return a wrapper for functions of one argument given with
+    value_and_gradient, which falls back to general_wrapper if called with
+    more arguments.
+    """
+    def wrapped_function(x, *more_args):
+        if more_args:
+            return general_wrapper(x, *more_args)
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, (x,))
+            if result is not None:
+                return result
+        
+        # checking the exact type is fastest for the common certain types
+        if (type(x) is float or type(x) is int
+                or not isinstance(x, AffineApproximation)):
+            if type(x) is Dual:
+                return _dual_call(value_and_gradient, (x,))
+            return AffineApproximation(function(x),
+                                       LinearPart(empty_linear_combo()))
+        
+        (nominal_result, (derivative,)) = value_and_gradient(x._nominal_value)
+        return AffineApproximation(nominal_result, LinearPart(
+                [(x._linear_part, derivative)]))
+    
+    return wrapped_function
+
+
+def _fused_binary_wrapper(function, value_and_gradient, general_wrapper):
+    """
+    Return a wrapper for functions of two arguments given with
+    value_and_gradient, which falls back to general_wrapper if called with
+    another amount of arguments.
+    """
+    def wrapped_function(x, y=_MISSING, *more_args):
+        if y is _MISSING:
+            return general_wrapper(x)
+        if more_args:
+            return general_wrapper(x, y, *more_args)
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, (x, y))
+            if result is not None:
+                return result
+        
+        # checking the exact type is fastest for the common certain types
+        x_uncertain = (type(x) is not float and type(x) is not int
+                       and isinstance(x, AffineApproximation))
+        y_uncertain = (type(y) is not float and type(y) is not int
+                       and isinstance(y, AffineApproximation))
+        if not (x_uncertain or y_uncertain):
+            if type(x) is Dual or type(y) is Dual:
+                return _dual_call(value_and_gradient, (x, y))
+            return AffineApproximation(function(x, y),
+                                       LinearPart(empty_linear_combo()))
+        
+        (nominal_result, (derivative_0, derivative_1)) = value_and_gradient(
+                x._nominal_value if x_uncertain else x,
+                y._nominal_value if y_uncertain else y)
+        if not y_uncertain:
+            linear_part = [(x._linear_part, derivative_0)]
+        elif not x_uncertain:
+            linear_part = [(y._linear_part, derivative_1)]
+        else:
+            linear_part = [(x._linear_part, derivative_0),
+                           (y._linear_part, derivative_1)]
+        return AffineApproximation(nominal_result, LinearPart(linear_part))
+    
+    return wrapped_function
+
+
+def _unary_wrapper(function, derivatives, general_wrapper):
+    """
+    Return a wrapper for functions of one argument, which falls back to
+    general_wrapper if called with more arguments.
+    """
+    (derivative,) = derivatives
+    
+    def wrapped_function(x, *more_args):
+        if more_args:
+            return general_wrapper(x, *more_args)
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, (x,))
+            if result is not None:
+                return result
+        
+        # checking the exact type is fastest for the common certain types
+        if (type(x) is float or type(x) is int
+                or not isinstance(x, AffineApproximation)):
+            if type(x) is Dual:
+                return _dual_call(lambda nominal_value: (
+                        function(nominal_value), (derivative(nominal_value),)),
+                                  (x,))
+            return AffineApproximation(function(x),
+                                       LinearPart(empty_linear_combo()))
+        
+        # the nominal result is calculated first, so in case of an error
+        # the exception is raised there
+        nominal_value = x._nominal_value
+        return AffineApproximation(function(nominal_value), LinearPart(
+                [(x._linear_part, derivative(nominal_value))]))
     
     return wrapped_function
 
 
+def _binary_wrapper(function, derivatives, general_wrapper):
+    """
+    Return a wrapper for functions of two arguments, which falls back to
+    general_wrapper if called with another amount of arguments.
+    """
+    (derivative_0, derivative_1) = derivatives
+    
+    def wrapped_function(x, y=_MISSING, *more_args):
+        if y is _MISSING:
+            return general_wrapper(x)
+        if more_args:
+            return general_wrapper(x, y, *more_args)
+        if _shared_contexts:
+            result = _shared_result(wrapped_function, (x, y))
+            if result is not None:
+                return result
+        
+        # checking the exact type is fastest for the common certain types
+        x_uncertain = (type(x) is not float and type(x) is not int
+                       and isinstance(x, AffineApproximation))
+        y_uncertain = (type(y) is not float and type(y) is not int
+                       and isinstance(y, AffineApproximation))
+        if not (x_uncertain or y_uncertain) and (type(x) is Dual
+                                                 or type(y) is Dual):
+            return _dual_call(lambda x, y: (function(x, y), (
+                    derivative_0(x, y), derivative_1(x, y))), (x, y))
+        x_nominal = x._nominal_value if x_uncertain else x
+        y_nominal = y._nominal_value if y_uncertain else y
+        
+        # the nominal result is calculated first, so in case of an error
+        # the exception is raised there
+        nominal_result = function(x_nominal, y_nominal)
+        
+        if x_uncertain:
+            if y_uncertain:
+                linear_part = [
+                        (x._linear_part, derivative_0(x_nominal, y_nominal)),
+                        (y._linear_part, derivative_1(x_nominal, y_nominal))]
+            else:
+                linear_part = [
+                        (x._linear_part, derivative_0(x_nominal, y_nominal))]
+        elif y_uncertain:
+            linear_part = [(y._linear_part, derivative_1(x_nominal, y_nominal))]
+        else:
+            return AffineApproximation(nominal_result,
+                                       LinearPart(empty_linear_combo()))
+        
+        return AffineApproximation(nominal_result, LinearPart(linear_part))
+    
+    return wrapped_function
+
+
+# Every result of a calculation references the LinearParts of its operands
+# until it is expanded, so a long chain like total = total + x keeps all
+# intermediate results in memory. If a LinearPart would be more than
+# _max_depth calculations away from expanded ones, it is expanded at once.
+# None means no limit.
+_max_depth = None
+
+def set_max_depth(max_depth):
+    """
+    Limit the length of chains of calculations kept in memory. Results that
+    are more than max_depth calculations away from independent variables or
+    expanded results are expanded at once, dropping the references to the
+    intermediate results. The memory needed is then proportional to the
+    amount of independent variables and max_depth instead of the amount of
+    calculations. Long linear combinations are expanded less often, so the
+    time needed per calculation stays constant.
+    
+    max_depth -- positive integer or None to disable the limit, which is the
+    default.
+    
+    Returns the previous value.
+    """
+    global _max_depth
+    if max_depth is not None and max_depth < 1:
+        raise ValueError("max_depth must be positive or None.")
+    (previous, _max_depth) = (_max_depth, max_depth)
+    return previous
+
+
+# Generated code often calculates the same expressions again and again. While
+# shared_subexpressions is active, the results of the operators and of
+# wrapped functions are kept in a map from (operation, keys of the operands)
+# to (result, operands), the value of _shared_nodes in the current context.
+# The operands of a result are kept alive, so their ids are not reused. None
+# if not active.
+_shared_nodes = ContextVar("shared_nodes", default=None)
+# The amount of active contexts in all threads. While it is 0, the operators
+# and wrapped functions skip looking up _shared_nodes.
+_shared_contexts = 0
+_shared_contexts_lock = Lock()
+# key in _shared_nodes while a wrapped function calculates a shared result,
+# so the wrappers it calls do not share their results again
+_COMPUTING = object()
+
+@contextmanager
+def shared_subexpressions():
+    """
+    Context in which calculations reuse existing results: An operation
+    applied to the same uncertain values (the same objects) and constants
+    as before returns the same result instead of a new one. Trivial
+    identities are folded: x-x and x*0 give a constant without uncertainty,
+    x*1 and x+0 give x itself, x/x gives the constant 1. This reduces the
+    size of the graph of calculations and the time needed to expand it,
+    e.g. for generated code with repeated subexpressions.
+    
+    The results are kept until the outermost context is left. The context
+    is only active in the current thread (or asyncio task), other threads
+    calculate as usual.
+    
+    Use as: with shared_subexpressions(): ...
+    """
+    global _shared_contexts
+    nodes = _shared_nodes.get()
+    token = _shared_nodes.set({} if nodes is None else nodes)
+    with _shared_contexts_lock:
+        _shared_contexts += 1
+    try:
+        yield
+    finally:
+        with _shared_contexts_lock:
+            _shared_contexts -= 1
+        _shared_nodes.reset(token)
+
+
+def _operand_key(x):
+    # uncertain values are identified by the object, constants by the value
+    if isinstance(x, AffineApproximation):
+        return id(x)
+    return (x,)
+
+
+def _is_constant(x, value):
+    return isinstance(x, FLOAT_LIKE_TYPES) and x == value
+
+
+def _folded(operation, x, y):
+    """
+    Return the result of a trivial identity for x <operation> y, None if
+    there is none.
+    """
+    if operation == "add":
+        if _is_constant(y, 0):
+            return x
+    elif operation == "sub":
+        if y is x:
+            return AffineApproximation(x._nominal_value - x._nominal_value,
+                                       LinearPart([]))
+        if _is_constant(y, 0):
+            return x
+    elif operation == "mul":
+        if _is_constant(y, 1):
+            return x
+        if _is_constant(y, 0):
+            return AffineApproximation(x._nominal_value*0, LinearPart([]))
+    elif operation == "truediv":
+        if y is x:
+            return AffineApproximation(x._nominal_value/x._nominal_value,
+                                       LinearPart([]))
+        if _is_constant(y, 1):
+            return x
+    return None
+
+
+def _shared(operation, commutative=False):
+    """
+    Decorator for the arithmetic operators of AffineApproximation, which
+    folds trivial identities and reuses earlier results while
+    shared_subexpressions is active. Reflected operators give the
+    operation of the original one, e.g. "add" for __radd__.
+    """
+    def decorator(method):
+        def shared_method(self, other):
+            nodes = _shared_nodes.get() if _shared_contexts else None
+            if nodes is None or not isinstance(
+                    other, (AffineApproximation,) + FLOAT_LIKE_TYPES):
+                return method(self, other)
+            result = _folded(operation, self, other)
+            if result is not None:
+                return result
+            if commutative and isinstance(other, AffineApproximation):
+                # x*y and y*x are the same
+                key = (operation,) + tuple(sorted((id(self), id(other))))
+            else:
+                key = (operation, id(self), _operand_key(other))
+            entry = nodes.get(key)
+            if entry is None:
+                entry = nodes.setdefault(key, (method(self, other), self,
+                                               other))
+            return entry[0]
+        shared_method.__name__ = method.__name__
+        shared_method.__doc__ = method.__doc__
+        return shared_method
+    return decorator
+
+
+def _shared_result(wrapped_function, args):
+    """
+    Return the result of a wrapped function for args while
+    shared_subexpressions is active, reusing an earlier result for the same
+    arguments. Returns None if the wrapper has to calculate the result
+    itself: if no context is active in this thread, a shared result is
+    being calculated already or an argument is no number.
+    """
+    nodes = _shared_nodes.get()
+    if nodes is None or _COMPUTING in nodes or not all(
+            isinstance(arg, (AffineApproximation,) + FLOAT_LIKE_TYPES)
+            for arg in args):
+        return None
+    key = (wrapped_function,) + tuple(_operand_key(arg) for arg in args)
+    entry = nodes.get(key)
+    if entry is None:
+        nodes[_COMPUTING] = True
+        try:
+            result = wrapped_function(*args)
+        finally:
+            del nodes[_COMPUTING]
+        entry = nodes.setdefault(key, (result, args))
+    return entry[0]
+
+
 class LinearPart(object):
     """
     This helper class stores the linear part of an uncertain variable.
@@ -250,83 +1275,162 @@ class LinearPart(object):
     contain the same content.
     """
     
-    __slots__ = "_linear_combo"
+    # _owners keeps the slots of the variables in the registry, see
+    # VariableRegistry
+    __slots__ = ("_linear_combo", "_depth", "_owners")
     
-    def __init__(self, linear_combination):
+    def __init__(self, linear_combination, owners=None):
         """
         The given linear_combo can be modified by the object.
         This is needed when expanding it, when replacing the depencies
         from the given variables to the independent ones lying
         underneath.
 
-        linear_combination -- Can be either a dict or a list.
-        If it is a dict, it should represent an expanded linear combination
-        and map underlying independet variables to the coefficient of their
-        differential.
+        linear_combination -- Can be either a tuple or a list.
+        If it is a tuple, it should represent an expanded linear combination
+        and contain two arrays of the same length: array("q") with the sorted
+        indices of the underlying independet variables in the registry and
+        array("d") with the coefficients of their differentials.
         If it is a list, it should contain (LinearPart, coefficient) pairs
         to map (not independent) variables to the coefficient of their
-        differential. This form might be converted to a dict.
+        differential. This form might be converted to a tuple.
+        
+        owners -- the owners of the slots of the variables of an expanded
+        linear combination, see VariableRegistry.owners. They are looked up
+        if not given.
         """
         
+        if isinstance(linear_combination, tuple):
+            if owners is None:
+                indices = linear_combination[0]
+                owners = registry.owners(indices) if len(indices) else ()
+            self._owners = owners
+        else:
+            self._owners = None
         self._linear_combo = linear_combination
+        
+        # _depth is the length of the longest chain of not expanded
+        # LinearParts below this one. Expanding costs about the length of
+        # the result, so an expanded LinearPart starts with a negative
+        # depth of its length: a long linear combination is expanded again
+        # only after as many operations, which keeps the cost per operation
+        # constant.
+        if isinstance(linear_combination, tuple):
+            self._depth = -len(linear_combination[0])
+            return
+        depth = None
+        for (linear_part, _) in linear_combination:
+            if depth is None or linear_part._depth > depth:
+                depth = linear_part._depth
+        depth = 0 if depth is None else depth + 1
+        self._depth = depth
+        
+        # expand eagerly, dropping the references to the intermediate
+        # results, see set_max_depth
+        if _max_depth is not None and depth > _max_depth:
+            self.expand()
     
     def is_expanded(self):
         """
         Returns True if the linear combination is expanded, False otherwise.
         """
-        return isinstance(self._linear_combo, dict)
+        return isinstance(self._linear_combo, tuple)
     
     def expand(self):
         """
-        Expands the linear combination, converts a list to a dict.
+        Expands the linear combination, converts a list to a tuple of arrays
+        (indices, coefficients).
         
         This method should only be called if the linear combination is not yet
         expanded.
-        
-        The new linear combination will be a collections.defaultdict(float)
         """
         
-        # The list in self._linear_combo will be emptied and each element be
-        # used to build the derivatives. Expanded LinearParts are directly
-        # added to the factors, non expanded LinearParts will be appended
-        # and expanded here.
+        # The not expanded LinearParts form a directed acyclic graph, where
+        # intermediate results can be reached on several paths, e.g. y in
+        # y*y + y/3. Walking every path would take exponential time in the
+        # depth of such graphs.
+        # Instead, this is a reverse mode differentiation: The nodes are
+        # sorted topologically, so every node comes before the nodes it
+        # depends on. Then the coefficients (adjoints) are passed down in
+        # this order, so each node is visited once, after all paths to it
+        # have been summed up. Expanded LinearParts are the leaves of the
+        # graph and are added to the result once with their total factor.
         
-        # Alternative method: Call not expanded LinearParts recursively. This
-        # would need more space, but save time if several calculations are
-        # done with the same variables.
-        # The here used method is more efficient in large calculations with
-        # only one result, which is the more typical case. For example, large
-        # sums have linear runtime with this, quadratic runtime with the
-        # recursive method
+        # Expanding is safe with several threads without a lock: The linear
+        # combination of every node is read only once, as another thread
+        # might expand it meanwhile and change its form. The result is
+        # built in local variables and published with a single assignment,
+        # so readers see either the old or the new form. Threads expanding
+        # the same LinearPart at once calculate the same result.
+        linear_combo = self._linear_combo
+        if isinstance(linear_combo, tuple):
+            # expanded by another thread
+            return
+        (order, leaves) = self._topological_order(linear_combo)
         
-        # new linear combination, start with an empty dict
-        new_linear_combo = defaultdict(float)
+        # adjoints of all nodes, mapped by id as the nodes are not hashable
+        adjoints = dict.fromkeys(leaves, 0.)
+        adjoints[id(self)] = 1.
         
-        # disasseble the list
-        while self._linear_combo:
-            
-            # extract one list element
-            (main_linear_part, main_factor) = self._linear_combo.pop()
-            
-            if main_linear_part.is_expanded():
-                for (variable, factor) in main_linear_part._linear_combo.items():
-                    
-                    # adjust derivative
-                    new_linear_combo[variable] += main_factor*factor
-            
-            else: # non expanded form
-                for (linear_part, factor) in main_linear_part._linear_combo:
-                    
-                    # add all elements with combined factor
-                    self._linear_combo.append((linear_part, main_factor*factor))
-            
-        self._linear_combo = new_linear_combo
+        for (node, linear_combo) in order:
+            adjoint = adjoints.pop(id(node))
+            for (linear_part, factor) in linear_combo:
+                key = id(linear_part)
+                adjoints[key] = adjoints.get(key, 0.) + adjoint*factor
+        
+        linear_combo = sparse_sum(
+                (adjoints[key],) + leaf._linear_combo
+                for (key, leaf) in leaves.items())
+        self._depth = -len(linear_combo[0])
+        # the owners are set first, an expanded LinearPart always has them
+        self._owners = tuple(dict.fromkeys(chain.from_iterable(
+                leaf._owners for leaf in leaves.values())))
+        self._linear_combo = linear_combo
+    
+    def _topological_order(self, linear_combo=None):
+        """
+        Return all not expanded LinearParts this one depends on, including
+        itself, as a list of (LinearPart, linear combination) pairs in
+        topological order, together with a dict mapping the ids of the
+        expanded LinearParts reached to these LinearParts.
+        
+        linear_combo -- the not expanded linear combination of this
+        LinearPart, if it was already read
+        """
+        order = []
+        leaves = {}
+        seen = {id(self)}
+        
+        # iterative depth first search, a node is added after all nodes it
+        # depends on, so the reversed list is the topological order
+        if linear_combo is None:
+            linear_combo = self._linear_combo
+        stack = [(self, linear_combo, iter(linear_combo))]
+        while stack:
+            (node, linear_combo, children) = stack[-1]
+            for (linear_part, _) in children:
+                key = id(linear_part)
+                if key in seen:
+                    continue
+                seen.add(key)
+                child_combo = linear_part._linear_combo
+                if isinstance(child_combo, tuple):
+                    leaves[key] = linear_part
+                else:
+                    stack.append((linear_part, child_combo, iter(child_combo)))
+                    break
+            else:
+                stack.pop()
+                order.append((node, linear_combo))
+        
+        order.reverse()
+        return (order, leaves)
     
     def get_linear_combo(self):
         """
         Expands the linear combo, if it not already is expanded.
         
-        Returns the linear combo, a collections.defaultdict(float)
+        Returns the linear combo, a tuple of arrays (indices, coefficients)
         """
         
         if not self.is_expanded():
@@ -350,7 +1454,9 @@ class AffineApproximation(object):
     """
     
     # faster acces and less storage consumption
-    __slots__ = ("_nominal_value", "_linear_part")
+    # As the objects are immutable, the uncertainties are cached in
+    # _std_devs and _components once they are calculated
+    __slots__ = ("_nominal_value", "_linear_part", "_std_devs", "_components")
     
     def __init__(self, nominal_value, linear_part):
         """
@@ -371,6 +1477,9 @@ class AffineApproximation(object):
         # The linear part will only be expanded if needed. This should
         # make calculations faster. See LinearPart for details.
         self._linear_part = linear_part
+        
+        self._std_devs = None
+        self._components = None
     
     @property
     def nominal_value(self):
@@ -388,8 +1497,43 @@ class AffineApproximation(object):
         Return a map from variables to derivatives of this function to these
         variables.
         """
+        (indices, coefficients) = self._linear_part.get_linear_combo()
         # Using types.MappingProxyType to give a readonly view
-        return MappingProxyType( self._linear_part.get_linear_combo() )
+        return MappingProxyType({registry.variable(index): coefficient
+                        for (index, coefficient) in zip(indices, coefficients)})
+    
+    def uncertainty_components(self):
+        """
+        Return two maps from variables to the statistical respectively
+        systematic uncertainty of this object coming from that variable.
+        The variables will be the independent ones lying underneath.
+        
+        Both maps are calculated in one pass and cached, they are read only.
+        """
+        components = self._components
+        if components is None:
+            (indices, coefficients) = self._linear_part.get_linear_combo()
+            stat_std_devs = registry.stat_std_devs
+            sys_std_devs = registry.sys_std_devs
+            
+            stat_components = {}
+            sys_components = {}
+            
+            for (index, derivative) in zip(indices, coefficients):
+                variable = registry.variable(index)
+                # derivative can be nan if uncertainty is 0
+                uncert = stat_std_devs[index]
+                stat_components[variable] = (0 if uncert == 0
+                                             else abs(derivative*uncert))
+                uncert = sys_std_devs[index]
+                sys_components[variable] = (0 if uncert == 0
+                                            else abs(derivative*uncert))
+            
+            # Using types.MappingProxyType to give a readonly view
+            components = (MappingProxyType(stat_components),
+                          MappingProxyType(sys_components))
+            self._components = components
+        return components
     
     def statistical_uncertainty_components(self):
         """
@@ -397,18 +1541,7 @@ class AffineApproximation(object):
         object coming from that variable. 
         The variables will be the independent ones lying underneath.
         """
-        derivatives = self.derivatives
-        
-        uncertainty_components = {}
-        
-        for (variable, derivative) in derivatives.items():
-            uncert = variable.stat_std_dev
-            # derivative can be nan if uncertainty is 0
-            if uncert == 0:
-                uncertainty_components[variable] = 0
-            else:
-                uncertainty_components[variable] = abs(derivative*uncert)
-        return uncertainty_components
+        return self.uncertainty_components()[0]
     
     stat_components = statistical_uncertainty_components
     
@@ -418,30 +1551,46 @@ class AffineApproximation(object):
         object coming from that variable. 
         The variables will be the independent ones lying underneath.
         """
-        derivatives = self.derivatives
-        
-        uncertainty_components = {}
-        
-        for (variable, derivative) in derivatives.items():
-            uncert = variable.sys_std_dev
-            # derivative can be nan if uncertainty is 0
-            if uncert == 0:
-                uncertainty_components[variable] = 0
-            else:
-                uncertainty_components[variable] = abs(derivative*uncert)
-        return uncertainty_components
+        return self.uncertainty_components()[1]
     
     sys_components = systematic_uncertainty_components
     
+    def __reduce__(self):
+        # pickled in the format of uncertain_serialization, which keeps the
+        # correlations to the variables
+        from .uncertain_serialization import dumps, _restore_value
+        return (_restore_value, (dumps([self]),))
+    
+    def freeze(self):
+        """
+        Expand the linear part now, so the references to the intermediate
+        results of the calculation are dropped. Useful for values that are
+        updated in a loop, see also set_max_depth.
+        
+        Returns the object itself.
+        """
+        self._linear_part.get_linear_combo()
+        return self
+    
+    def standard_deviations(self):
+        """
+        Return the statistical and the systematic standard deviation.
+        
+        Both are calculated in one pass and cached.
+        """
+        std_devs = self._std_devs
+        if std_devs is None:
+            (indices, coefficients) = self._linear_part.get_linear_combo()
+            std_devs = standard_deviations(indices, coefficients)
+            self._std_devs = std_devs
+        return std_devs
+    
     @property
     def statistical_standard_deviation(self):
         """
         Resulting statistical standard deviation.
         """
-        stat_std_dev = sqrt(sum(
-                d**2 for d in self.stat_components().values()))
-        
-        return stat_std_dev
+        return self.standard_deviations()[0]
     
     stat_std_dev = statistical_standard_deviation
     
@@ -452,10 +1601,7 @@ class AffineApproximation(object):
         """
         Resulting systematical standard deviation
         """
-        sys_std_dev = sqrt(sum(
-                d**2 for d in self.sys_components().values()))
-        
-        return sys_std_dev
+        return self.standard_deviations()[1]
     
     sys_std_dev = systematic_standard_deviation
     
@@ -469,15 +1615,28 @@ class AffineApproximation(object):
         magnitude as the greater uncertainty are relevant is set in the
         constant SIGNIFICANT_DIGITS.
         """
-        max_std_dev = max(self.stat_std_dev, self.sys_std_dev)
+        max_std_dev = max(self.standard_deviations())
         return int(floor(log10(abs(max_std_dev))))-SIGNIFICANT_DIGITS
     
     def __repr__(self):
-        #TODO only give significant digits (or dont?)
-        return "%r+-%r(stat)+-%r(sys)" % (self.n, self.stat, self.sys)
-        
-    # TODO __str__, __format__
+        return "%r+-%r(stat)+-%r(sys)" % ((self.n,) + self.standard_deviations())
     
+    def __str__(self):
+        # rounded to the significant digits
+        from .uncertain_formatting import format_uncertain
+        return format_uncertain(self)
+    
+    def __format__(self, format_spec):
+        """
+        Format the nominal value and both uncertainties with format_spec, a
+        format specification for floats. An empty one rounds them to the
+        significant digits like str. Tables of many values are formatted
+        faster with uncertain_formatting.
+        """
+        from .uncertain_formatting import format_uncertain
+        return format_uncertain(self, format_spec)
+    
+    @_shared("add", commutative=True)
     def __add__(self, other):
         if isinstance(other, AffineApproximation):
             linear_part = LinearPart([(self._linear_part, 1), (other._linear_part, 1)])
@@ -489,6 +1648,7 @@ class AffineApproximation(object):
             return NotImplemented
         return AffineApproximation(nominal_value, linear_part)
     
+    @_shared("sub")
     def __sub__(self, other):
         if isinstance(other, AffineApproximation):
             linear_part = LinearPart([(self._linear_part, 1), (other._linear_part, -1)])
@@ -500,6 +1660,7 @@ class AffineApproximation(object):
             return NotImplemented
         return AffineApproximation(nominal_value, linear_part)
     
+    @_shared("mul", commutative=True)
     def __mul__(self, other):
         if isinstance(other, AffineApproximation):
             linear_part = LinearPart([(self._linear_part, other.nominal_value),
@@ -512,6 +1673,7 @@ class AffineApproximation(object):
             return NotImplemented
         return AffineApproximation(nominal_value, linear_part)
     
+    @_shared("truediv")
     def __truediv__(self, other):
         if isinstance(other, AffineApproximation):
             linear_part = LinearPart([(self._linear_part, 1/other.nominal_value),
@@ -527,6 +1689,7 @@ class AffineApproximation(object):
     # The reflected operators are only called if the left operand is not an
     # AffineApproximation, so there is no need to consider this case
     
+    @_shared("add", commutative=True)
     def __radd__(self, other):
         if isinstance(other, FLOAT_LIKE_TYPES):
             linear_part = LinearPart([(self._linear_part, 1)])
@@ -535,6 +1698,7 @@ class AffineApproximation(object):
         else:
             return NotImplemented
     
+    @_shared("rsub")
     def __rsub__(self, other):
         if isinstance(other, FLOAT_LIKE_TYPES):
             linear_part = LinearPart([(self._linear_part, -1)])
@@ -543,6 +1707,7 @@ class AffineApproximation(object):
             return NotImplemented
         return AffineApproximation(nominal_value, linear_part)
     
+    @_shared("mul", commutative=True)
     def __rmul__(self, other):
         if isinstance(other, FLOAT_LIKE_TYPES):
             linear_part = LinearPart([(self._linear_part, other)])
@@ -551,6 +1716,7 @@ class AffineApproximation(object):
         else:
             return NotImplemented
     
+    @_shared("rtruediv")
     def __rtruediv__(self, other):
         if isinstance(other, FLOAT_LIKE_TYPES):
             linear_part = LinearPart([(self._linear_part, -other/self.nominal_value**2)])
@@ -624,21 +1790,24 @@ class AffineApproximation(object):
     
     # TODO round, floor, ceil,
     
-    __pow__ = wrap(lambda x,y: x**y, [pow_derivative_0, pow_derivative_1])
-    __rpow__ = wrap(lambda x,y: y**x, [lambda x,y: pow_derivative_1(y,x),
-                                       lambda x,y: pow_derivative_0(y,x)])
+    __pow__ = wrap(lambda x,y: x**y,
+                   value_and_gradient=pow_value_and_gradient)
+    __rpow__ = wrap(lambda x,y: y**x,
+                    value_and_gradient=lambda x,y: _reflected_pow(y, x))
 
 class UncertainVariable(AffineApproximation):
     """
     Represents a number with a statistical deviations and a systematical
     uncertainty.
     Diffrent from AffineApproximation, it represents an independet value,
-    while AffineApproximations can have correlations. In return, an
-    UncertainVariable stores its statistical and systematical standard
-    deviation.
+    while AffineApproximations can have correlations. In return, the
+    statistical and systematical standard deviation of an UncertainVariable
+    are stored, in the registry.
     """
     
-    __slots__ = ("_stat_std_dev", "_sys_std_dev")
+    # The uncertainties are stored in the registry, the variable only knows
+    # its index there
+    __slots__ = ("_index", "__weakref__")
     
     def __init__(self, nominal_value, stat=0, sys=0):
         """
@@ -648,25 +1817,66 @@ class UncertainVariable(AffineApproximation):
         stat -- statistic uncertainty, float-like
         sys -- systematic uncertainty, float-like
         """
-        # With this, calculations can be handled the same as with
-        # other AffineApproximations
-        linear_part = LinearPart({self: 1.})
-        super().__init__(nominal_value, linear_part)
-        
         # As comparisons with nan are always False, the NOT_DIFFERENTIABLE flag
         # does not raise an Exception
         if (stat < 0 or sys < 0):
             raise NegativeStandardDeviation()
         
-        self._stat_std_dev = float(stat)
-        self._sys_std_dev = float(sys)
+        nominal_value = float(nominal_value)
+        (self._index, owner) = registry.register(self, nominal_value,
+                                                 float(stat), float(sys))
+        
+        # With this, calculations can be handled the same as with
+        # other AffineApproximations
+        super().__init__(nominal_value, LinearPart((array("q", [self._index]),
+                                                    array("d", [1.])),
+                                                   (owner,)))
+    
+    @staticmethod
+    def from_arrays(nominal_values, stat=0, sys=0):
+        """
+        Create many independent variables from arrays of nominal values and
+        uncertainties at once. They are returned as an UncertainArray, see
+        uncertain_arrays.uarray. Needs numpy.
+        """
+        from .uncertain_arrays import uarray
+        return uarray(nominal_values, stat, sys)
+    
+    @classmethod
+    def _from_index(cls, index):
+        """
+        Create the object of a variable that already is in the registry.
+        Use registry.variable instead, only one object should exist per index.
+        """
+        variable = cls.__new__(cls)
+        variable._index = index
+        variable._nominal_value = registry.nominal_values[index]
+        variable._linear_part = LinearPart((array("q", [index]),
+                                            array("d", [1.])))
+        variable._std_devs = None
+        variable._components = None
+        return variable
+    
+    @property
+    def index(self):
+        """
+        Index of this variable in the registry.
+        """
+        return self._index
+    
+    def standard_deviations(self):
+        """
+        Return the statistical and the systematic standard deviation.
+        """
+        return (registry.stat_std_devs[self._index],
+                registry.sys_std_devs[self._index])
     
     @property
     def statistical_standard_deviation(self):
         """
         Resulting statistical standard deviation.
         """
-        return self._stat_std_dev
+        return registry.stat_std_devs[self._index]
     
     stat_std_dev = statistical_standard_deviation
     
@@ -677,18 +1887,442 @@ class UncertainVariable(AffineApproximation):
         """
         Resulting systematical standard deviation
         """
-        return self._sys_std_dev
+        return registry.sys_std_devs[self._index]
     
     sys_std_dev = systematical_standard_deviation
     
     sys = systematical_standard_deviation
     
     def __hash__(self):
-        return id(self)
+        return self._index
+    
+    def __reduce__(self):
+        # unpickling gives the same variable again, also in other processes
+        from .uncertain_serialization import _restore_variable
+        (token, index) = registry.origin(self._index)
+        return (_restore_variable, (token, index, self._nominal_value)
+                + self.standard_deviations())
 
 UVar = UncertainVariable
 
 
+class _SlotOwner(object):
+    """
+    Keeps a range of slots of the registry in use, see VariableRegistry.
+    """
+    
+    __slots__ = ("__weakref__",)
+
+
+class _SlotReference(weakref.ref):
+    # The weak reference of the registry to a _SlotOwner, with the range of
+    # its slots and the number of the variable in the first one, see
+    # VariableRegistry.origin. number is None for imported variables.
+    __slots__ = ("start", "stop", "number")
+
+
+class VariableRegistry(object):
+    """
+    Stores the nominal values and uncertainties of all independent variables
+    in contiguous arrays, numbered by a dense integer index.
+    
+    Expanded LinearParts refer to the variables by this index. The objects
+    of the variables are only referenced weakly and recreated if needed, so
+    calculations do not keep them alive.
+    
+    There is one registry per process, registry in this module.
+    
+    The slots of the variables created together, e.g. by one call of
+    register_many, belong to an owner object. Everything refering to
+    variables by their index keeps the owners of their slots: expanded
+    LinearParts, UncertainArrays and accumulators. Once the last of them is
+    garbage collected, the slots are freed, like the objects of the
+    variables would be. Free slots are reused by later variables and the
+    arrays shrink again if the slots at their end are free. Code using the
+    indices directly has to keep an owner, see owners.
+    
+    To recognize variables shipped between processes, each registry has a
+    random token. A variable is identified everywhere by its origin, the
+    token of the registry that created it and its number there. The
+    variables are numbered in the order they are created, which is their
+    index unless slots were reused. Variables imported from another
+    registry keep their origin, so importing them again gives the same
+    variables. A forked process gets a new token and remembers the
+    variables it inherited.
+    """
+    
+    def __init__(self, capacity=1024):
+        """
+        Initialise an empty registry.
+        
+        capacity -- amount of variables to reserve space for. More space is
+        allocated if needed.
+        """
+        # _size is the amount of slots used so far, including free ones
+        # before the last used slot
+        self._size = 0
+        self._capacity = capacity
+        self.nominal_values = array("d", bytes(8*capacity))
+        self.stat_std_devs = array("d", bytes(8*capacity))
+        self.sys_std_devs = array("d", bytes(8*capacity))
+        # weak references to the objects of the variables, None if not
+        # created yet
+        self._variables = []
+        # the _SlotReference of every slot, None for free slots
+        self._slots = []
+        # the free slots as a sorted list of [start, stop) ranges
+        self._free = []
+        self._free_count = 0
+        # references to owners that were garbage collected. Their slots are
+        # freed the next time the lock is held, as the garbage collector
+        # may run at any time.
+        self._dead = []
+        
+        # Adding variables must not be interrupted by other threads. Reading
+        # does not need the lock, the arrays are replaced, not resized.
+        self._lock = RLock()
+        
+        self.token = uuid4().bytes
+        # the amount of variables numbered so far
+        self._count = 0
+        # (token, count) of the registries this one was forked from
+        self._inherited = []
+        # the origins of imported variables and their indices here
+        self._origins = {}
+        self._imported = {}
+        # the references with slots numbered differently from their indices,
+        # sorted by their numbers, and these numbers
+        self._moved = []
+        self._moved_numbers = []
+        self._moved_compacted = 0
+    
+    def __len__(self):
+        """
+        Amount of variables in the registry, without the free slots.
+        """
+        with self._lock:
+            self._collect()
+            return self._size - self._free_count
+    
+    def _reserve(self, amount):
+        """
+        Make sure there is space for amount more variables.
+        """
+        size = self._size + amount
+        capacity = len(self.stat_std_devs)
+        if size <= capacity:
+            return
+        self._resize(max(size, 2*capacity))
+    
+    def _resize(self, capacity):
+        # The arrays are copied instead of resized, so arrays or buffers
+        # obtained before stay valid
+        for name in ("nominal_values", "stat_std_devs", "sys_std_devs"):
+            old = getattr(self, name)
+            new = array("d", bytes(8*capacity))
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+    
+    def _owner_died(self, reference):
+        # callback of the _SlotReferences, only appending is safe here
+        self._dead.append(reference)
+    
+    def _collect(self):
+        """
+        Free the slots of the owners that were garbage collected. Called
+        with the lock.
+        """
+        if not self._dead:
+            return
+        while self._dead:
+            self._free_slots(self._dead.pop())
+        
+        # the free slots at the end are dropped
+        if self._free and self._free[-1][1] == self._size:
+            (start, _) = self._free.pop()
+            self._free_count -= self._size - start
+            del self._variables[start:]
+            del self._slots[start:]
+            self._size = start
+            if len(self.stat_std_devs) > 4*max(self._size, self._capacity):
+                self._resize(2*max(self._size, self._capacity))
+        
+        # forget the moved references of freed slots from time to time
+        if len(self._moved) > 2*self._moved_compacted + 16:
+            self._moved = [reference for reference in self._moved
+                           if reference.start < self._size
+                           and self._slots[reference.start] is reference]
+            self._moved_numbers = [reference.number
+                                   for reference in self._moved]
+            self._moved_compacted = len(self._moved)
+    
+    def _free_slots(self, reference):
+        """
+        Free the slots of a reference to a collected owner.
+        """
+        (start, stop) = (reference.start, reference.stop)
+        amount = stop - start
+        if amount == 0:
+            return
+        self._slots[start:stop] = repeat(None, amount)
+        self._variables[start:stop] = repeat(None, amount)
+        if reference.number is None:
+            for index in range(start, stop):
+                del self._imported[self._origins.pop(index)]
+        zeros = array("d", bytes(8*amount))
+        for values in (self.nominal_values, self.stat_std_devs,
+                       self.sys_std_devs):
+            values[start:stop] = zeros
+        self._free_count += amount
+        
+        # insert the range, merging it with its neighbours
+        position = bisect_left(self._free, (start, stop))
+        if position < len(self._free) and self._free[position][0] == stop:
+            stop = self._free.pop(position)[1]
+        if position > 0 and self._free[position-1][1] == start:
+            position -= 1
+            start = self._free.pop(position)[0]
+        self._free.insert(position, (start, stop))
+    
+    def _allocate(self, amount, numbered=True):
+        """
+        Return a range of amount free indices, reusing free slots if
+        possible, and the new owner of the slots. Called with the lock.
+        
+        numbered -- False for imported variables, which keep their origin
+        """
+        self._collect()
+        indices = None
+        for (position, (start, stop)) in enumerate(self._free):
+            if 0 < amount <= stop - start:
+                if stop - start == amount:
+                    del self._free[position]
+                else:
+                    self._free[position] = (start + amount, stop)
+                self._free_count -= amount
+                indices = range(start, start + amount)
+                break
+        if indices is None:
+            self._reserve(amount)
+            indices = range(self._size, self._size + amount)
+            self._variables.extend(repeat(None, amount))
+            self._slots.extend(repeat(None, amount))
+            self._size += amount
+        
+        owner = _SlotOwner()
+        reference = _SlotReference(owner, self._owner_died)
+        reference.start = indices.start
+        reference.stop = indices.stop
+        reference.number = None
+        if numbered:
+            reference.number = self._count
+            self._count += amount
+            if reference.number != indices.start:
+                self._moved.append(reference)
+                self._moved_numbers.append(reference.number)
+        self._slots[indices.start:indices.stop] = repeat(reference, amount)
+        return (indices, owner)
+    
+    def register(self, variable, nominal_value, stat, sys):
+        """
+        Add a variable to the registry and return its index and the owner
+        of its slot.
+        """
+        with self._lock:
+            ((index,), owner) = self._allocate(1)
+            self.nominal_values[index] = nominal_value
+            self.stat_std_devs[index] = stat
+            self.sys_std_devs[index] = sys
+            self._variables[index] = weakref.ref(variable)
+        return (index, owner)
+    
+    def register_many(self, nominal_values, stat, sys):
+        """
+        Add many variables at once, without creating their objects, and
+        return the range of their indices and the owner of their slots.
+        
+        nominal_values, stat, sys -- sequences of floats of the same length
+        """
+        with self._lock:
+            return self._register_many(nominal_values, stat, sys)
+    
+    def _register_many(self, nominal_values, stat, sys, numbered=True):
+        # implementation of register_many, called with the lock
+        columns = []
+        for values in (nominal_values, stat, sys):
+            if numpy is not None:
+                values = numpy.ascontiguousarray(values, dtype=float).tobytes()
+            columns.append(array("d", values))
+        
+        # the objects are created when needed
+        (indices, owner) = self._allocate(len(columns[0]), numbered)
+        for (name, values) in zip(("nominal_values", "stat_std_devs",
+                                   "sys_std_devs"), columns):
+            getattr(self, name)[indices.start:indices.stop] = values
+        return (indices, owner)
+    
+    def owners(self, indices):
+        """
+        Return a tuple of the owners of the slots of the variables with the
+        given indices. Keeping them keeps the variables in the registry.
+        
+        indices -- sorted sequence of indices of variables in use
+        """
+        owners = []
+        slots = self._slots
+        position = 0
+        count = len(indices)
+        while position < count:
+            index = indices[position]
+            reference = slots[index]
+            owner = None if reference is None else reference()
+            if owner is None:
+                raise ValueError("The variable %i is freed." % index)
+            owners.append(owner)
+            # skip the other indices of the same owner
+            position += 1
+            if position < count and indices[position] < reference.stop:
+                position = bisect_left(indices, reference.stop, position)
+        return tuple(owners)
+    
+    def variable(self, index):
+        """
+        Return the UncertainVariable with the given index.
+        """
+        reference = self._variables[index]
+        variable = None if reference is None else reference()
+        if variable is None:
+            with self._lock:
+                if self._slots[index] is None:
+                    raise ValueError("The variable %i is freed." % index)
+                # another thread might have created it meanwhile
+                reference = self._variables[index]
+                variable = None if reference is None else reference()
+                if variable is None:
+                    # nobody refers to the old object, so a new one can take
+                    # its place
+                    variable = UncertainVariable._from_index(index)
+                    self._variables[index] = weakref.ref(variable)
+        return variable
+    
+    def _token(self, number):
+        # the token of the registry that numbered a variable
+        for (token, count) in self._inherited:
+            if number < count:
+                return token
+        return self.token
+    
+    def origin(self, index):
+        """
+        Return the origin (token, number) of the variable with the given
+        index.
+        """
+        reference = self._slots[index]
+        if reference is None:
+            raise ValueError("The variable %i is freed." % index)
+        if reference.number is None:
+            return self._origins[index]
+        number = reference.number + index - reference.start
+        return (self._token(number), number)
+    
+    def _numbered_index(self, number):
+        """
+        Return the index of the variable numbered by this registry or the
+        ones it was forked from with the given number, None if its slot is
+        free.
+        """
+        if number < self._size:
+            # the slots that were never reused
+            reference = self._slots[number]
+            if reference is not None and reference.number == reference.start:
+                return number
+        position = bisect_right(self._moved_numbers, number) - 1
+        if position >= 0:
+            reference = self._moved[position]
+            index = reference.start + number - reference.number
+            if (index < reference.stop and index < self._size
+                    and self._slots[index] is reference):
+                return index
+        return None
+    
+    def _known_index(self, origin):
+        """
+        Return the index of the variable with the given origin or None if it
+        is unknown.
+        """
+        (token, number) = origin
+        if 0 <= number < self._count and self._token(number) == token:
+            index = self._numbered_index(number)
+            if index is not None and self._slots[index]() is not None:
+                return index
+        return self._imported.get(origin)
+    
+    def local_index(self, token, index):
+        """
+        Return the index of the variable with the given origin in this
+        registry or None if it is unknown.
+        """
+        return self._known_index((token, index))
+    
+    def import_variables(self, origins, nominal_values, stat, sys):
+        """
+        Return the indices of variables given by their origins, adding the
+        unknown ones with the given data, and a tuple of the owners of their
+        slots, which must be kept while the indices are used.
+        
+        origins -- list of (token, number) pairs
+        
+        nominal_values, stat, sys -- sequences of floats, one per origin
+        """
+        with self._lock:
+            return self._import_variables(origins, nominal_values, stat, sys)
+    
+    def _import_variables(self, origins, nominal_values, stat, sys):
+        # implementation of import_variables, called with the lock
+        self._collect()
+        indices = []
+        # the owners by their references
+        owners = {}
+        for origin in origins:
+            index = self._known_index(origin)
+            if index is not None:
+                reference = self._slots[index]
+                owner = reference()
+                if owner is None:
+                    # collected meanwhile
+                    index = None
+                else:
+                    owners[reference] = owner
+            indices.append(index)
+        unknown = [position for (position, index) in enumerate(indices)
+                   if index is None]
+        if unknown:
+            (new_indices, owner) = self._register_many(
+                    [nominal_values[position] for position in unknown],
+                    [stat[position] for position in unknown],
+                    [sys[position] for position in unknown], numbered=False)
+            owners[None] = owner
+            for (position, index) in zip(unknown, new_indices):
+                origin = origins[position]
+                indices[position] = index
+                self._origins[index] = origin
+                self._imported[origin] = index
+        return (indices, tuple(owners.values()))
+    
+    def _after_fork(self):
+        # the child must not create variables with the origins the parent
+        # uses for its new variables
+        self._inherited.append((self.token, self._count))
+        # the lock might have been held by a thread of the parent
+        self._lock = RLock()
+        self.token = uuid4().bytes
+
+registry = VariableRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
 def nominal_value(x):
     """
     Return the nominal value of x if it is an uncertain value as
@@ -741,7 +2375,111 @@ def systematic_standard_deviation(x, default=0.0):
 sys = sys_std_dev = systematic_standard_deviation
 
 
-def statistical_covariance_matrix(*numbers):
+def _covariance_matrices(numbers, variable_std_devs, as_array):
+    """
+    Calculate covariance matrices of the uncertain values in numbers, one
+    for each array of standard deviations of the variables given in
+    variable_std_devs, e.g. registry.stat_std_devs.
+    The jacobian of the numbers is only built once.
+    Returns a list of matrices.
+    """
+    if numpy is not None:
+        (jacobian, indices) = jacobian_matrix(numbers)
+        matrices = [covariance_from_jacobian(jacobian, indices, std_devs)
+                    for std_devs in variable_std_devs]
+        if as_array:
+            return matrices
+        return [matrix.tolist() for matrix in matrices]
+    
+    if as_array:
+        raise ImportError("Returning arrays needs numpy.")
+    
+    # without numpy, the matrices are built from the expanded linear
+    # combinations
+    linear_combos = [dict(zip(*to_affine_approximation(number)
+                              ._linear_part.get_linear_combo()))
+                     for number in numbers]
+    size = len(numbers)
+    matrices = []
+    for std_devs in variable_std_devs:
+        # build the left under part of the matrix
+        covariance_matrix = []
+        for (i, linear_combo1) in enumerate(linear_combos):
+            matrix_line = []
+            for linear_combo2 in linear_combos[:i+1]:
+                # using dict.get to define 0 as default, as number2 may not
+                # depend on var. Derivatives can be nan if the uncertainty is 0
+                matrix_line.append(sum(
+                        factor*linear_combo2.get(var, 0.)*std_devs[var]**2
+                        for (var, factor) in linear_combo1.items()
+                        if std_devs[var] != 0)
+                        # All elements shold be floats by convention, so add .0
+                        + .0)
+            covariance_matrix.append(matrix_line)
+        
+        # make the matrix symmetric
+        for i in range(size-1):
+            for j in range(i+1, size):
+                covariance_matrix[i].append(covariance_matrix[j][i])
+        matrices.append(covariance_matrix)
+    return matrices
+
+
+def _correlation_matrix(covariance_matrix, as_array):
+    """
+    Normalize a covariance matrix given as a list of lists or an array.
+    Elements belonging to values without uncertainty are nan.
+    """
+    if numpy is not None:
+        covariance_matrix = numpy.asarray(covariance_matrix)
+        std_devs = numpy.sqrt(numpy.diag(covariance_matrix))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            matrix = covariance_matrix/numpy.outer(std_devs, std_devs)
+        if as_array:
+            return matrix
+        return matrix.tolist()
+    
+    size = len(covariance_matrix)
+    std_devs = [sqrt(covariance_matrix[i][i]) for i in range(size)]
+    return [[covariance_matrix[i][j]/(std_devs[i]*std_devs[j])
+             if std_devs[i]*std_devs[j] else NOT_DIFFERENTIALBE
+             for j in range(size)] for i in range(size)]
+
+
+def _tiled_covariance_matrix(numbers, kind, as_array, block_size,
+                             tile_options):
+    """
+    Calculate a covariance matrix block by block for
+    statistical_covariance_matrix and systematic_covariance_matrix.
+    """
+    if as_array and tile_options.get("sparse"):
+        raise ValueError("A sparse matrix can not be returned as array.")
+    from .uncertain_covariances import tiled_covariance_matrix
+    matrix = tiled_covariance_matrix(numbers, kind, block_size,
+                                     **tile_options)
+    if (as_array or tile_options.get("out") is not None
+            or tile_options.get("sparse")):
+        return matrix
+    return matrix.tolist()
+
+
+def covariance_matrices(*numbers, as_array=False):
+    """
+    Calculate the matrices of statistic and systematic covariances to a
+    vector of uncertain values at once, see statistical_covariance_matrix.
+    Returns the pair (statistic matrix, systematic matrix).
+    
+    numbers -- Some uncertain values
+    
+    as_array -- If True, return numpy arrays instead of lists of lists
+    """
+    return tuple(_covariance_matrices(
+            numbers, (registry.stat_std_devs, registry.sys_std_devs), as_array))
+
+cov_mats = covariance_matrices
+
+def statistical_covariance_matrix(*numbers, as_array=False, block_size=None,
+                                  **tile_options):
     """
     Calculate a matrix of statistic covariances to a vector of uncertain
     values. The order of the matrix depends on the order of the elements in
@@ -749,36 +2487,31 @@ def statistical_covariance_matrix(*numbers):
     numbers[j].
     Returns a list of lists.
     
-    numbers -- Some uncertain values
-    """
-    # build the left under part of the matrix
-    covariance_matrix = []
-    for (i, number1) in enumerate(numbers):
-        derivatives1 = number1.derivatives
-        vars1 = derivatives1.keys()
-        matrix_line = []
-        for number2 in numbers[:i+1]:
-            derivatives2 = number2.derivatives
-            # using dict.get to define 0 as default, as number2 may not depend
-            # on var.
-            matrix_line.append(sum(
-                    ((derivatives1[var]*derivatives2.get(var,0.)*(var.stat_std_dev)**2)
-                    for var in vars1))
-                    # All elements shold be floats by convention, so add .0
-                     + .0)
-        covariance_matrix.append(matrix_line)
-    
-    # make the matrix symmetric
-    size = len(numbers)
-    for i in range(size-1):
-        for j in range(i+1, size):
-            covariance_matrix[i].append(covariance_matrix[j][i])
+    If numpy is available, the matrix is calculated as J*diag(stat**2)*J^T,
+    where J is the jacobian of the numbers with respect to the independent
+    variables.
+    
+    numbers -- Some uncertain values, or one UncertainArray if block_size
+    is given
     
-    return covariance_matrix
+    as_array -- If True, return a numpy array instead of a list of lists
+    
+    block_size -- If given, the matrix is calculated in blocks of this size
+    to limit the memory needed, see
+    uncertain_covariances.tiled_covariance_matrix for the further keyword
+    arguments processes, out, band and sparse. With out or sparse, the
+    matrix is returned as memmap respectively sparse matrix, as_array only
+    applies to a matrix held in memory. Needs numpy.
+    """
+    if block_size is not None:
+        return _tiled_covariance_matrix(numbers, "stat", as_array, block_size,
+                                        tile_options)
+    return _covariance_matrices(numbers, (registry.stat_std_devs,), as_array)[0]
 
 stat_cov_mat = statistical_covariance_matrix
 
-def systematic_covariance_matrix(*numbers):
+def systematic_covariance_matrix(*numbers, as_array=False, block_size=None,
+                                 **tile_options):
     """
     Calculate a matrix of systematic covariances to a vector of uncertain
     values. The order of the matrix depends on the order of the elements in
@@ -786,84 +2519,77 @@ def systematic_covariance_matrix(*numbers):
     numbers[j].
     Returns a list of lists.
     
-    numbers -- Some uncertain values
-    """
-    # build the left under part of the matrix
-    covariance_matrix = []
-    for (i, number1) in enumerate(numbers):
-        derivatives1 = number1.derivatives
-        vars1 = derivatives1.keys()
-        matrix_line = []
-        for number2 in numbers[:i+1]:
-            derivatives2 = number2.derivatives
-            # using dict.get to define 0 as default, as number2 may not depend
-            # on var.
-            matrix_line.append(sum(
-                    ((derivatives1[var]*derivatives2.get(var,0.)*(var.sys_std_dev)**2)
-                    for var in vars1))
-                    # All elements shold be floats by convention, so add .0
-                     + .0)
-        covariance_matrix.append(matrix_line)
-    
-    # make the matrix symmetric
-    size = len(numbers)
-    for i in range(size-1):
-        for j in range(i+1, size):
-            covariance_matrix[i].append(covariance_matrix[j][i])
+    If numpy is available, the matrix is calculated as J*diag(sys**2)*J^T,
+    where J is the jacobian of the numbers with respect to the independent
+    variables.
     
-    return covariance_matrix
+    numbers -- Some uncertain values, or one UncertainArray if block_size
+    is given
     
-    # make the matrix symmetric
-    size = len(numbers)
-    for i in range(size-1):
-        for j in range(i+1, size):
-            covariance_matrix[i].append(covariance_matrix[j][i])
+    as_array -- If True, return a numpy array instead of a list of lists
     
-    return covariance_matrix
+    block_size -- If given, the matrix is calculated in blocks of this size
+    to limit the memory needed, see
+    uncertain_covariances.tiled_covariance_matrix for the further keyword
+    arguments processes, out, band and sparse. With out or sparse, the
+    matrix is returned as memmap respectively sparse matrix, as_array only
+    applies to a matrix held in memory. Needs numpy.
+    """
+    if block_size is not None:
+        return _tiled_covariance_matrix(numbers, "sys", as_array, block_size,
+                                        tile_options)
+    return _covariance_matrices(numbers, (registry.sys_std_devs,), as_array)[0]
 
 sys_cov_mat = systematic_covariance_matrix
 
 
-def statistical_correlation_matrix(*numbers):
+def correlation_matrices(*numbers, as_array=False):
+    """
+    Calculate the matrices of statistic and systematic correlations to a
+    vector of uncertain values at once, see statistical_correlation_matrix.
+    Returns the pair (statistic matrix, systematic matrix).
+    
+    numbers -- Some uncertain values
+    
+    as_array -- If True, return numpy arrays instead of lists of lists
+    """
+    return tuple(_correlation_matrix(matrix, as_array) for matrix in
+                 covariance_matrices(*numbers, as_array=numpy is not None))
+
+corr_mats = correlation_matrices
+
+def statistical_correlation_matrix(*numbers, as_array=False):
     """
     Calculate a matrix of statistic correlations to a vector of uncertain
     values. The order of the matrix depends on the order of the elements in
     the vector, correlation_matrix[i][j] is the correlation of numbers[i]
-    and numbers[j].
+    and numbers[j]. It is nan if one of them has no statistic uncertainty.
     Returns a list of lists.
     
     numbers -- Some uncertain values
+    
+    as_array -- If True, return a numpy array instead of a list of lists
     """
-    size = len(numbers)
-    matrix = statistical_covariance_matrix(*numbers)
-    # copy variances, as the matrix is altered
-    variances = [matrix[i][i] for i in range(size)]
-    for i in range(size):
-        for j in range(size):
-            matrix[i][j] /= sqrt(variances[i]*variances[j])
-    return matrix
+    return _correlation_matrix(statistical_covariance_matrix(
+            *numbers, as_array=numpy is not None), as_array)
 
 stat_corr_mat = statistical_correlation_matrix
 
 
-def systematic_correlation_matrix(*numbers):
+def systematic_correlation_matrix(*numbers, as_array=False):
     """
     Calculate a matrix of systematic correlations to a vector of uncertain
     values. The order of the matrix depends on the order of the elements in
     the vector, correlation_matrix[i][j] is the correlation of numbers[i]
-    and numbers[j].
+    and numbers[j]. It is nan if one of them has no systematic uncertainty.
     Returns a list of lists.
     
     numbers -- Some uncertain values
+    
+    as_array -- If True, return a numpy array instead of a list of lists
     """
-    size = len(numbers)
-    matrix = systematic_covariance_matrix(*numbers)
-    # copy variances, as the matrix is altered
-    variances = [matrix[i][i] for i in range(size)]
-    for i in range(size):
-        for j in range(size):
-            matrix[i][j] /= sqrt(variances[i]*variances[j])
-    return matrix
+    return _correlation_matrix(systematic_covariance_matrix(
+            *numbers, as_array=numpy is not None), as_array)
 
 sys_corr_mat = systematic_correlation_matrix
 
@@ -884,81 +2610,114 @@ __all__ = [ "UncertainVariable",               # init an uncertain variable
             "stat_cov_mat",
             "systematic_covariance_matrix",    # systematic covariances
             "sys_cov_mat",
+            "covariance_matrices",             # both covariances at once
+            "cov_mats",
             "statistical_correlation_matrix",  # statistic correlations
             "stat_corr_mat",
             "systematic_correlation_matrix",   # systematic correlations
             "sys_corr_mat",
-            "wrap"                             # wrap functions
+            "correlation_matrices",            # both correlations at once
+            "corr_mats",
+            "wrap",                            # wrap functions
+            "set_max_depth",                   # limit chains in memory
+            "shared_subexpressions"            # reuse common results
           ]
 
 # some methods depend on numpy and are only defined if its is available
-try:
-    import numpy
-    import numpy.matlib
-except ImportError:
-    pass
-else:
+if numpy is not None:
     
-    # numpy brings more types of numbers
-    FLOAT_LIKE_TYPES += (numpy.number,)
+    # A jacobian created from single values is stored sparse if less than
+    # this fraction of its elements is non zero and scipy is available
+    SPARSE_DENSITY = .1
     
-    def correlated_values(nominal_values, statistic_covariances=0,
-                          systematic_covariances=0):
+    def is_sparse(jacobian):
         """
-        To given covariance matrices and nominal values, create uncertain
-        variables that satisfy these relations.
-        Returns a list of uncertain variables, so that the covariance of
-        variables[i] and variables[j] is covariances[i,j]
-        
-        nominal_values -- A list of nominal values for the created variables
-        
-        statistic_covariances -- The statistic covariance matrix of the values
-        to create. Can be either a sqare matrix with the same lenght as
-        nominal_values in both dimensions, or a scalar. In the second case, the
-        covariance between any two created variables will be the given value.
-        Default to 0.
-        
-        systematic_covariances -- The systematic covariance matrix of the
-        values to create. Can be either a sqare matrix with the same lenght as
-        nominal_values in both dimensions, or a scalar. In the second case, the
-        covariance between any two created variables will be the given value.
-        Default to 0.
+        Return True if the jacobian is a scipy sparse matrix.
         """
+        return scipy is not None and scipy.sparse.issparse(jacobian)
+    
+    def build_jacobian(rows, columns, coefficients, shape, sparse=None):
+        """
+        Build a jacobian from its non zero elements.
         
-        # The idea of this method is to do a change of basis. The covariance
-        # matrices are diagonalised and the inital basis is expressed as a
-        # linear combination of the eigenvectors. As the eigenvectors are
-        # uncorrelated, they can be represented by an UncertainVariable.
-        
-        # if a scalar is given, create a matrix
-        size = len(nominal_values)
-        if isinstance(statistic_covariances, FLOAT_LIKE_TYPES):
-            statistic_covariances = [[statistic_covariances]*size]*size
-        if isinstance(systematic_covariances, FLOAT_LIKE_TYPES):
-            systematic_covariances = [[systematic_covariances]*size]*size
+        rows, columns, coefficients -- arrays of the same length describing
+        the elements, no position may occur twice
         
-        # diagonalize the covariance matrix to get independent variables
-        variances, vectors1 = numpy.linalg.eigh(statistic_covariances)
+        shape -- (number of values, number of variables)
         
-        # some uncertainties might be calculated negative due to numertic
-        # errors. Setting them to 0 gives close and useful results
-        variances[variances < 0] = 0.
+        sparse -- True for a sparse, False for a dense matrix. If None, the
+        form is chosen by the density of the matrix.
+        """
+        if sparse is None:
+            sparse = (scipy is not None and
+                      len(coefficients) < SPARSE_DENSITY*shape[0]*shape[1])
+        if sparse:
+            if scipy is None:
+                raise ImportError("Sparse jacobians need scipy.")
+            return scipy.sparse.csr_matrix((coefficients, (rows, columns)),
+                                           shape=shape)
+        jacobian = numpy.zeros(shape)
+        jacobian[rows, columns] = coefficients
+        return jacobian
+    
+    def jacobian_matrix(numbers, sparse=None):
+        """
+        Build the jacobian of some uncertain values or floats, the matrix of
+        their derivatives with respect to the independent variables.
+        Returns the jacobian and the indices of the variables in the
+        registry belonging to its columns.
         
-        # indepentend variables
-        variables1 = [UncertainVariable(0, sqrt(var), 0) for var in variances]
+        sparse -- see build_jacobian
+        """
+        lengths = numpy.zeros(len(numbers), dtype=numpy.int64)
+        all_indices = [numpy.zeros(0, dtype=numpy.int64)]
+        all_coefficients = [numpy.zeros(0)]
+        for (i, number) in enumerate(numbers):
+            if isinstance(number, AffineApproximation):
+                (indices, coefficients) = number._linear_part.get_linear_combo()
+                lengths[i] = len(indices)
+                all_indices.append(numpy.frombuffer(indices, dtype=numpy.int64))
+                all_coefficients.append(numpy.frombuffer(coefficients))
         
-        # same for systematic uncertainties
-        variances, vectors2 = numpy.linalg.eigh(systematic_covariances)
-        variances[variances < 0] = 0.
-        variables2 = [UncertainVariable(0, 0, sqrt(var)) for var in variances]
+        (indices, columns) = numpy.unique(numpy.concatenate(all_indices),
+                                          return_inverse=True)
+        rows = numpy.repeat(numpy.arange(len(numbers)), lengths)
+        jacobian = build_jacobian(rows, columns,
+                                  numpy.concatenate(all_coefficients),
+                                  (len(numbers), len(indices)), sparse)
+        return (jacobian, indices)
+    
+    def scaled_jacobian(jacobian, indices, variable_std_devs):
+        """
+        Multiply every column of the jacobian with the standard deviation
+        of its variable, taken from variable_std_devs, e.g.
+        registry.stat_std_devs.
+        """
+        std_devs = numpy.frombuffer(variable_std_devs)[indices]
+        if is_sparse(jacobian):
+            scaled = jacobian.tocsr(copy=True)
+            std_devs = std_devs[scaled.indices]
+            scaled.data *= std_devs
+            # derivative can be nan if uncertainty is 0
+            scaled.data[std_devs == 0] = 0.
+            return scaled
+        scaled = jacobian*std_devs
+        # derivative can be nan if uncertainty is 0
+        scaled[:, std_devs == 0] = 0.
+        return scaled
+    
+    def covariance_from_jacobian(jacobian, indices, variable_std_devs):
+        """
+        Calculate the covariance matrix J*diag(std_devs**2)*J^T of values with
+        the given jacobian.
         
-        # recreate requested variables from independent variables
-        values = []
-        for n, coefs1, coefs2 in zip(nominal_values, vectors1, vectors2):
-            linear_part = dict(zip(variables1, coefs1))
-            linear_part.update(dict(zip(variables2, coefs2)))
-            values.append(AffineApproximation(n, LinearPart(linear_part)))
+        indices -- indices of the variables belonging to the columns
         
-        return values
-    
-    __all__.append("correlated_values")
\ No newline at end of file
+        variable_std_devs -- standard deviations of all variables, e.g.
+        registry.stat_std_devs
+        """
+        scaled = scaled_jacobian(jacobian, indices, variable_std_devs)
+        covariance_matrix = scaled @ scaled.T
+        if is_sparse(covariance_matrix):
+            covariance_matrix = covariance_matrix.toarray()
+        return numpy.asarray(covariance_matrix)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This module adds units to values, which can be floats, uncertain values
+ from the module uncertainties, numpy arrays or UncertainArrays.
+
+ A quantity is created by multiplying a value with a unit, e.g. 3*m or
+ UVar(3, .1)*m/s. The units of the SI and some others are defined under
+ their symbols (see unit_definitions), other units can be combined with
+ *, / and ** or created with Unit. Quantities support +, -, *, /, ** and
+ comparisons. Values in different, compatible units are converted, e.g.
+ 1*km + 1*m gives 1.001 km, values of different dimensions raise
+ IncompatibleUnits.
+
+ A quantity of an array has one unit for all elements. Quantity.from_values
+ creates it from a list of quantities.
+
+ Dimensions are interned and the results of combining and converting
+ units are cached, so the units add little to the costs of the
+ calculations, see quantities.
+
+ @author: d0cod3r
+"""
+
+from .quantities import *
+from .quantities import __all__ as all_quantities
+
+from .unit_definitions import *
+from .unit_definitions import __all__ as all_definitions
+
+__all__ = all_quantities + all_definitions
@@ -0,0 +1,627 @@
+# -*- coding: utf-8 -*-
+
+"""
+ This file defines dimensions, units and quantities, i.e. values with a
+ unit. The values can be floats, uncertain values, numpy arrays or
+ UncertainArrays.
+
+ A Dimension is a vector of small integer exponents of the SI base
+ dimensions. Dimensions are interned: there is only one object for every
+ vector, so two units are compatible if their dimensions are the same
+ object.
+
+ A Unit has a symbol, a dimension and the factor converting it to the
+ coherent SI unit of its dimension. Units are combined with *, / and **,
+ the results are cached per pair of units, so calculating with quantities
+ does not build new units again and again. Combined units are interned by
+ the named units they consist of, so e.g. m*m/m is m. Named units are
+ registered by their symbol, so unpickling a unit gives the same object
+ again. Conversion factors between two units are cached as well.
+
+ A Quantity is created by multiplying a value with a unit, e.g.
+ UVar(3, .1)*m or uarray(...)*m/s. It supports +, -, *, /, ** and
+ comparisons, converting the units where needed and raising
+ IncompatibleUnits if the dimensions do not fit. An array of values has a
+ single unit, so the units are checked once for the whole array.
+
+ @author: d0cod3r
+"""
+
+
+from operator import add, sub
+
+from ..uncertainties.uncertain_values import (AffineApproximation,
+                                              FLOAT_LIKE_TYPES)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# symbols of the SI base dimensions in the order of the exponents
+BASE_DIMENSIONS = ("m", "kg", "s", "A", "K", "mol", "cd")
+
+
+class IncompatibleUnits(ValueError):
+    """
+    Raised if values of different dimensions are added, compared or
+    converted.
+    """
+    pass
+
+
+class Dimension(object):
+    """
+    Vector of the exponents of the SI base dimensions, see BASE_DIMENSIONS.
+    Only one object exists for every vector, so dimensions are compared by
+    identity.
+    """
+
+    __slots__ = ("_exponents",)
+
+    _instances = {}
+
+    def __new__(cls, exponents=()):
+        """
+        Return the dimension with the given integer exponents. Missing
+        exponents are 0.
+        """
+        exponents = tuple(int(exponent) for exponent in exponents)
+        exponents += (0,)*(len(BASE_DIMENSIONS)-len(exponents))
+        if len(exponents) != len(BASE_DIMENSIONS):
+            raise ValueError("A dimension has %i exponents."
+                             % len(BASE_DIMENSIONS))
+        instance = cls._instances.get(exponents)
+        if instance is None:
+            instance = object.__new__(cls)
+            instance._exponents = exponents
+            # another thread may have added it meanwhile
+            instance = cls._instances.setdefault(exponents, instance)
+        return instance
+
+    @property
+    def exponents(self):
+        return self._exponents
+
+    def __mul__(self, other):
+        return Dimension(map(add, self._exponents, other._exponents))
+
+    def __truediv__(self, other):
+        return Dimension(map(sub, self._exponents, other._exponents))
+
+    def __pow__(self, power):
+        exponents = [exponent*power for exponent in self._exponents]
+        if any(exponent % 1 for exponent in exponents):
+            raise IncompatibleUnits("%r to the power of %r has no integer "
+                                    "exponents." % (self, power))
+        return Dimension(exponents)
+
+    def __reduce__(self):
+        # unpickled dimensions are interned as well
+        return (Dimension, (self._exponents,))
+
+    def __repr__(self):
+        return "Dimension(%s)" % _symbol_of_exponents(
+                zip(BASE_DIMENSIONS, self._exponents))
+
+
+def _symbol_of_exponents(exponents):
+    """
+    Return a symbol like m*s**-2 from (symbol, exponent) pairs.
+    """
+    parts = ["%s**%i" % (symbol, exponent) if exponent != 1 else symbol
+             for (symbol, exponent) in exponents if exponent != 0]
+    return "*".join(parts) or "1"
+
+
+dimensionless = Dimension()
+
+
+class Unit(object):
+    """
+    A unit, given by its symbol, its dimension and the factor converting it
+    to the coherent SI unit of the dimension, e.g. Unit("km", length, 1e3).
+    """
+
+    __slots__ = ("_symbol", "_dimension", "_factor", "_terms")
+
+    # numpy should call the reflected operators instead of handling a unit
+    # as an object
+    __array_ufunc__ = None
+
+    def __init__(self, symbol, dimension, factor=1., terms=None):
+        """
+        Initialise a unit.
+
+        terms -- the named units a combined unit consists of, as (unit,
+        exponent) pairs. By default, the unit is a named unit, which is
+        its only term.
+        """
+        self._symbol = symbol
+        self._dimension = dimension
+        self._factor = float(factor)
+        if terms is None:
+            self._terms = ((self, 1),)
+            # so that e.g. m*m/m is m
+            _combined_units[frozenset(self._terms)] = self
+            # the first unit with a symbol is the one unpickled
+            _named_units.setdefault(symbol, self)
+        else:
+            self._terms = tuple(terms)
+
+    @property
+    def symbol(self):
+        return self._symbol
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    @property
+    def factor(self):
+        """
+        Factor converting this unit to the coherent SI unit.
+        """
+        return self._factor
+
+    def is_compatible(self, other):
+        """
+        True if values can be converted between this and the other unit.
+        """
+        return self._dimension is other._dimension
+
+    def __reduce__(self):
+        # unpickled units are the same objects again, see _named_unit and
+        # _combined_unit
+        if self._terms != ((self, 1),):
+            return (_combined_unit, (self._terms, self._dimension,
+                                     self._factor))
+        if _named_units.get(self._symbol) is self:
+            return (_named_unit, (self._symbol, self._dimension,
+                                  self._factor))
+        # another unit has the same symbol
+        return (Unit, (self._symbol, self._dimension, self._factor))
+
+    def __repr__(self):
+        return "Unit(%r, %r, %r)" % (self._symbol, self._dimension,
+                                     self._factor)
+
+    def __str__(self):
+        return self._symbol
+
+    ###########################################################################
+    # combining units, the results are cached per pair
+
+    def __mul__(self, other):
+        if isinstance(other, Unit):
+            return _combine(_products, self, other, _multiply)
+        if _is_value(other):
+            return Quantity(other, self)
+        return NotImplemented
+
+    def __rmul__(self, other):
+        # value*unit creates a quantity
+        if _is_value(other):
+            return Quantity(other, self)
+        return NotImplemented
+
+    def __truediv__(self, other):
+        if isinstance(other, Unit):
+            return _combine(_quotients, self, other, _divide)
+        return NotImplemented
+
+    def __rtruediv__(self, other):
+        if _is_value(other):
+            return Quantity(other, one/self)
+        return NotImplemented
+
+    def __pow__(self, power):
+        if not isinstance(power, (int, float)):
+            return NotImplemented
+        return _combine(_powers, self, power, _power)
+
+
+def _symbol_of_terms(terms):
+    """
+    Return a symbol like kg*m/s**2 from (unit, exponent) pairs.
+    """
+    def power(unit, exponent):
+        if exponent == 1:
+            return unit._symbol
+        return "%s**%g" % (unit._symbol, exponent)
+    numerator = "*".join(power(unit, exponent) for (unit, exponent)
+                         in terms if exponent > 0) or "1"
+    denominator = [power(unit, -exponent) for (unit, exponent) in terms
+                   if exponent < 0]
+    if not denominator:
+        return numerator
+    if len(denominator) == 1:
+        return "%s/%s" % (numerator, denominator[0])
+    return "%s/(%s)" % (numerator, "*".join(denominator))
+
+
+def _combined_unit(terms, dimension, factor):
+    """
+    Return the unit consisting of the given terms, with the exponents of
+    equal units added.
+    """
+    exponents = {}
+    for (unit, exponent) in terms:
+        exponents[unit] = exponents.get(unit, 0) + exponent
+    terms = tuple((unit, int(exponent) if exponent % 1 == 0 else exponent)
+                  for (unit, exponent) in exponents.items() if exponent)
+    if not terms and factor == 1:
+        return one
+    # the order of the terms does not matter, m*s is s*m
+    key = frozenset(terms)
+    combined = _combined_units.get(key)
+    if combined is None:
+        combined = _combined_units.setdefault(key, Unit(
+                _symbol_of_terms(terms), dimension, factor, terms))
+    return combined
+
+
+def _multiply(unit, other):
+    return _combined_unit(unit._terms + other._terms,
+                          unit._dimension*other._dimension,
+                          unit._factor*other._factor)
+
+
+def _divide(unit, other):
+    return _combined_unit(
+            unit._terms + tuple((named, -exponent) for (named, exponent)
+                                in other._terms),
+            unit._dimension/other._dimension, unit._factor/other._factor)
+
+
+def _power(unit, power):
+    return _combined_unit(tuple((named, exponent*power) for (named, exponent)
+                                in unit._terms),
+                          unit._dimension**power, unit._factor**power)
+
+
+# caches of the combined units, keys are pairs of units (compared by
+# identity) or of a unit and a power
+_products = {}
+_quotients = {}
+_powers = {}
+_conversion_factors = {}
+# combined and named units by the set of their terms, the named units are
+# compared by identity, so units with equal symbols are not confused
+_combined_units = {}
+# named units by their symbol
+_named_units = {}
+
+
+def _named_unit(symbol, dimension, factor):
+    """
+    Return the named unit with the given symbol, used to unpickle named
+    units. A new unit is created if none with this symbol, dimension and
+    factor is defined.
+    """
+    unit = _named_units.get(symbol)
+    if unit is None:
+        # the unit might be one of the predefined units, which are not
+        # imported yet
+        from . import unit_definitions
+        unit = _named_units.get(symbol)
+    if (unit is None or unit._dimension is not dimension
+            or unit._factor != factor):
+        unit = Unit(symbol, dimension, factor)
+    return unit
+
+
+def _combine(cache, unit, other, combination):
+    """
+    Return combination(unit, other), cached.
+    """
+    key = (unit, other)
+    result = cache.get(key)
+    if result is None:
+        # combining is deterministic, so a race only calculates it twice
+        result = cache.setdefault(key, combination(unit, other))
+    return result
+
+
+def conversion_factor(from_unit, to_unit):
+    """
+    Return the factor converting values from one unit to another. Raises
+    IncompatibleUnits if their dimensions differ.
+    """
+    key = (from_unit, to_unit)
+    factor = _conversion_factors.get(key)
+    if factor is None:
+        if from_unit._dimension is not to_unit._dimension:
+            raise IncompatibleUnits("Can not convert %s to %s." % (from_unit,
+                                                                   to_unit))
+        factor = from_unit._factor/to_unit._factor
+        _conversion_factors[key] = factor
+    return factor
+
+
+one = Unit("1", dimensionless, terms=())
+
+
+class Quantity(object):
+    """
+    A value with a unit. The value can be a float, an uncertain value, a
+    numpy array or an UncertainArray, which all share the unit.
+    """
+
+    __slots__ = ("_value", "_unit")
+
+    __array_ufunc__ = None
+
+    def __init__(self, value, unit=one):
+        """
+        Initialise a quantity. A quantity given as value is converted to
+        unit.
+        """
+        if isinstance(value, Quantity):
+            value = value.to(unit)._value
+        elif not _is_value(value):
+            raise TypeError("Can not create a quantity of the type %s."
+                            % type(value).__name__)
+        self._value = value
+        self._unit = unit
+
+    @classmethod
+    def from_values(cls, values, unit=None):
+        """
+        Create a quantity of an array from a (nested) list of quantities,
+        converted to unit, by default the unit of the first one. The array
+        is an UncertainArray if any value is uncertain. Needs numpy.
+        """
+        from ..uncertainties.uncertain_arrays import UncertainArray
+
+        values = numpy.asarray(values, dtype=object)
+        flat = values.reshape(-1)
+        if unit is None:
+            unit = flat[0]._unit if len(flat) else one
+        converted = numpy.empty(len(flat), dtype=object)
+        for (position, value) in enumerate(flat):
+            if not isinstance(value, Quantity):
+                raise TypeError("Only quantities can be given.")
+            converted[position] = value._value*conversion_factor(value._unit,
+                                                                 unit)
+        converted = converted.reshape(values.shape)
+        if any(isinstance(value, AffineApproximation) for value in converted):
+            return cls(UncertainArray.from_values(converted), unit)
+        return cls(converted.astype(float), unit)
+
+    ###########################################################################
+    # access to the data
+
+    @property
+    def value(self):
+        """
+        The value without the unit.
+        """
+        return self._value
+
+    @property
+    def unit(self):
+        return self._unit
+
+    @property
+    def dimension(self):
+        return self._unit._dimension
+
+    @property
+    def nominal_value(self):
+        """
+        The nominal value(s) as a quantity.
+        """
+        return Quantity(getattr(self._value, "n", self._value), self._unit)
+
+    n = nominal_value
+
+    @property
+    def statistical_standard_deviation(self):
+        """
+        The statistical standard deviation(s) as a quantity.
+        """
+        return Quantity(getattr(self._value, "stat", 0.), self._unit)
+
+    stat = statistical_standard_deviation
+
+    @property
+    def systematic_standard_deviation(self):
+        """
+        The systematic standard deviation(s) as a quantity.
+        """
+        return Quantity(getattr(self._value, "sys", 0.), self._unit)
+
+    sys = systematic_standard_deviation
+
+    def to(self, unit):
+        """
+        Return this quantity converted to unit.
+        """
+        if unit is self._unit:
+            return self
+        return Quantity(self._value*conversion_factor(self._unit, unit), unit)
+
+    def value_in(self, unit):
+        """
+        Return the value converted to unit, without the unit.
+        """
+        return self.to(unit)._value
+
+    def to_base_units(self):
+        """
+        Return this quantity in the coherent SI unit of its dimension.
+        """
+        dimension = self._unit._dimension
+        unit = _base_units.get(dimension)
+        if unit is None:
+            unit = Unit(_symbol_of_exponents(
+                    zip(BASE_DIMENSIONS, dimension._exponents)), dimension)
+            unit = _base_units.setdefault(dimension, unit)
+        return self.to(unit)
+
+    def __repr__(self):
+        return "Quantity(%r, %s)" % (self._value, self._unit)
+
+    def __str__(self):
+        return "%s %s" % (self._value, self._unit)
+
+    ###########################################################################
+    # arrays
+
+    def __len__(self):
+        return len(self._value)
+
+    def __getitem__(self, key):
+        return Quantity(self._value[key], self._unit)
+
+    def __iter__(self):
+        for value in self._value:
+            yield Quantity(value, self._unit)
+
+    ###########################################################################
+    # arithmetics
+
+    def _converted_value(self, other):
+        """
+        Return the value of other, which is added to or compared with this
+        quantity, in the unit of this quantity. Returns NotImplemented for
+        unsupported types.
+        """
+        if isinstance(other, Quantity):
+            if other._unit is self._unit:
+                return other._value
+            return other._value*conversion_factor(other._unit, self._unit)
+        if _is_value(other):
+            # a plain value is a dimensionless quantity
+            return other/conversion_factor(one, self._unit)
+        return NotImplemented
+
+    def __add__(self, other):
+        other = self._converted_value(other)
+        if other is NotImplemented:
+            return NotImplemented
+        return Quantity(self._value + other, self._unit)
+
+    def __radd__(self, other):
+        other = self._converted_value(other)
+        if other is NotImplemented:
+            return NotImplemented
+        return Quantity(other + self._value, self._unit)
+
+    def __sub__(self, other):
+        other = self._converted_value(other)
+        if other is NotImplemented:
+            return NotImplemented
+        return Quantity(self._value - other, self._unit)
+
+    def __rsub__(self, other):
+        other = self._converted_value(other)
+        if other is NotImplemented:
+            return NotImplemented
+        return Quantity(other - self._value, self._unit)
+
+    def __mul__(self, other):
+        if isinstance(other, Quantity):
+            return Quantity(self._value*other._value, self._unit*other._unit)
+        if isinstance(other, Unit):
+            return Quantity(self._value, self._unit*other)
+        if _is_value(other):
+            return Quantity(self._value*other, self._unit)
+        return NotImplemented
+
+    def __rmul__(self, other):
+        if isinstance(other, Unit):
+            return Quantity(self._value, other*self._unit)
+        if _is_value(other):
+            return Quantity(other*self._value, self._unit)
+        return NotImplemented
+
+    def __truediv__(self, other):
+        if isinstance(other, Quantity):
+            return Quantity(self._value/other._value, self._unit/other._unit)
+        if isinstance(other, Unit):
+            return Quantity(self._value, self._unit/other)
+        if _is_value(other):
+            return Quantity(self._value/other, self._unit)
+        return NotImplemented
+
+    def __rtruediv__(self, other):
+        if isinstance(other, Unit):
+            return Quantity(1/self._value, other/self._unit)
+        if _is_value(other):
+            return Quantity(other/self._value, one/self._unit)
+        return NotImplemented
+
+    def __pow__(self, power):
+        if isinstance(power, Quantity):
+            power = power.value_in(one)
+        if not isinstance(power, (int, float)):
+            raise TypeError("The power of a quantity must be a number.")
+        return Quantity(self._value**power, self._unit**power)
+
+    def __pos__(self):
+        return self
+
+    def __neg__(self):
+        return Quantity(-self._value, self._unit)
+
+    def __abs__(self):
+        return Quantity(abs(self._value), self._unit)
+
+    ###########################################################################
+    # comparison, the values are compared in the unit of this quantity
+
+    def _compare(self, other, comparison):
+        other = self._converted_value(other)
+        if other is NotImplemented:
+            return NotImplemented
+        return comparison(self._value, other)
+
+    def __eq__(self, other):
+        try:
+            return self._compare(other, lambda x, y: x == y)
+        except IncompatibleUnits:
+            # quantities of different dimensions are never equal
+            return False
+
+    def __ne__(self, other):
+        try:
+            return self._compare(other, lambda x, y: x != y)
+        except IncompatibleUnits:
+            return True
+
+    def __lt__(self, other):
+        return self._compare(other, lambda x, y: x < y)
+
+    def __le__(self, other):
+        return self._compare(other, lambda x, y: x <= y)
+
+    def __gt__(self, other):
+        return self._compare(other, lambda x, y: x > y)
+
+    def __ge__(self, other):
+        return self._compare(other, lambda x, y: x >= y)
+
+    __hash__ = None
+
+
+# coherent SI units of the dimensions, used by to_base_units
+_base_units = {dimensionless: one}
+
+
+def _is_value(x):
+    """
+    True if x can be the value of a quantity.
+    """
+    if isinstance(x, (AffineApproximation,) + FLOAT_LIKE_TYPES):
+        return True
+    if numpy is not None and isinstance(x, numpy.ndarray):
+        return True
+    # an UncertainArray, without importing uncertain_arrays
+    return hasattr(x, "jacobian") and hasattr(x, "nominal_values")
+
+
+__all__ = ["Dimension", "Unit", "Quantity", "IncompatibleUnits",
+           "conversion_factor", "dimensionless", "one"]
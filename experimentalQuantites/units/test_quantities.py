@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing units and quantities
+
+@author: d0cod3r
+"""
+
+import pickle
+
+import numpy
+
+from ..uncertainties.uncertain_values import UncertainVariable
+from ..uncertainties.uncertain_arrays import uarray
+from .quantities import (Dimension, Unit, Quantity, IncompatibleUnits,
+                         conversion_factor, one, _combined_units)
+from .unit_definitions import (m, km, s, h, kg, N, length, time, unit)
+
+
+a = UncertainVariable(20, 2, .2)
+
+
+def test_dimensions():
+    assert Dimension((1,)) is length
+    assert (length/time)*time is length
+    assert (length**2)**.5 is length
+    assert pickle.loads(pickle.dumps(length)) is length
+    try:
+        length**.5
+    except IncompatibleUnits:
+        pass
+    else:
+        assert False
+
+
+def test_units():
+    assert str(kg*m/s**2) == "kg*m/s**2"
+    assert (kg*m/s**2).dimension is N.dimension
+    # combined units are cached
+    assert m/s is m/s
+    assert m/m is one
+    assert m*m/m is m and (m*s)/s is m
+    assert m*s is s*m
+    # units with the same symbol are different units
+    first = Unit("x", length, 2.)
+    second = Unit("x", length, 3.)
+    assert (first*first).factor == 4 and (second*second).factor == 9
+    assert first*first/first is first
+    assert conversion_factor(km/h, m/s) == 1/3.6
+    assert unit("km") is km
+    # unpickled units are the same objects
+    assert pickle.loads(pickle.dumps(m)) is m
+    restored = pickle.loads(pickle.dumps(m/s))
+    assert restored is m/s
+    assert pickle.loads(pickle.dumps(one)) is one
+    size = len(_combined_units)
+    x = Quantity(2., m)
+    assert (x/pickle.loads(pickle.dumps(x))).unit is one
+    assert len(_combined_units) == size
+
+
+def test_quantities():
+    x = a*m
+    assert isinstance(x, Quantity) and x.unit is m
+    assert (x + 1*km).value.n == 1020
+    assert (1*km + x).unit is km
+    assert (x - x).value.stat == 0
+    y = (x/(2*s)).to(km/h)
+    assert abs(y.value.n - 36) < 1e-12
+    assert abs(y.stat.value - 3.6) < 1e-12
+    assert (x*x).unit is m**2
+    assert 2*km > x and x.n == 20*m and x != 20*s
+    try:
+        x + 1*s
+    except IncompatibleUnits:
+        pass
+    else:
+        assert False
+
+
+def test_arrays():
+    x = uarray([1., 2., 3.], stat=.1)*km
+    assert x.unit is km and len(x) == 3
+    y = x.to(m)
+    assert numpy.allclose(y.value.n, [1000, 2000, 3000])
+    assert numpy.allclose(y.stat.value, 100)
+    assert y[1].value.n == 2000
+    z = numpy.array([1., 2.])*s
+    assert isinstance(z, Quantity) and z.unit is s
+    w = Quantity.from_values([a*m, 1*km, 2*m])
+    assert w.unit is m
+    assert numpy.allclose(w.value.n, [20, 1000, 2])
+    assert numpy.allclose(w.value.stat, [2, 0, 0])
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+ In this file, the dimensions and units of the SI and some common other
+ units are defined. All units can be looked up by their symbol in UNITS,
+ e.g. UNITS["km"], or with the function unit.
+
+ @author: d0cod3r
+"""
+
+
+from math import pi
+
+from .quantities import Dimension, Unit, one, dimensionless
+
+
+###############################################################################
+# dimensions
+
+length = Dimension((1,))
+mass = Dimension((0, 1))
+time = Dimension((0, 0, 1))
+current = Dimension((0, 0, 0, 1))
+temperature = Dimension((0, 0, 0, 0, 1))
+amount_of_substance = Dimension((0, 0, 0, 0, 0, 1))
+luminous_intensity = Dimension((0, 0, 0, 0, 0, 0, 1))
+
+area = length**2
+volume = length**3
+frequency = time**-1
+velocity = length/time
+acceleration = velocity/time
+force = mass*acceleration
+pressure = force/area
+energy = force*length
+power = energy/time
+charge = current*time
+voltage = power/current
+resistance = voltage/current
+capacitance = charge/voltage
+magnetic_flux_density = voltage*time/area
+
+
+###############################################################################
+# units
+
+UNITS = {}
+
+PREFIXES = {"T": 1e12, "G": 1e9, "M": 1e6, "k": 1e3, "h": 1e2, "d": 1e-1,
+            "c": 1e-2, "m": 1e-3, "u": 1e-6, "n": 1e-9, "p": 1e-12,
+            "f": 1e-15}
+
+def _define(symbol, dimension, factor=1.):
+    """
+    Create a unit and add it to UNITS.
+    """
+    unit = Unit(symbol, dimension, factor)
+    UNITS[symbol] = unit
+    return unit
+
+def _define_prefixed(symbol, dimension, factor=1.,
+                     prefixes=("G", "M", "k", "c", "m", "u", "n", "p")):
+    """
+    Create a unit and its prefixed versions, return them as a list.
+    """
+    return ([_define(symbol, dimension, factor)]
+            + [_define(prefix + symbol, dimension, factor*PREFIXES[prefix])
+               for prefix in prefixes])
+
+UNITS["1"] = one
+
+# every unit is available under its symbol, except min, which is minute
+
+# base units
+(m, km, cm, mm, um, nm, pm) = _define_prefixed(
+        "m", length, prefixes=("k", "c", "m", "u", "n", "p"))
+(g, kg, mg, ug) = _define_prefixed("g", mass, 1e-3,
+                                   prefixes=("k", "m", "u"))
+(s, ms, us, ns, ps) = _define_prefixed("s", time,
+                                       prefixes=("m", "u", "n", "p"))
+(A, mA, uA, nA) = _define_prefixed("A", current, prefixes=("m", "u", "n"))
+K = _define("K", temperature)
+(mol, mmol) = _define_prefixed("mol", amount_of_substance, prefixes=("m",))
+cd = _define("cd", luminous_intensity)
+
+# derived units
+(Hz, kHz, MHz, GHz) = _define_prefixed("Hz", frequency,
+                                       prefixes=("k", "M", "G"))
+(N, kN) = _define_prefixed("N", force, prefixes=("k",))
+(Pa, hPa, kPa, MPa) = _define_prefixed("Pa", pressure,
+                                       prefixes=("h", "k", "M"))
+(J, kJ, MJ) = _define_prefixed("J", energy, prefixes=("k", "M"))
+(W, mW, kW, MW) = _define_prefixed("W", power, prefixes=("m", "k", "M"))
+(C, nC) = _define_prefixed("C", charge, prefixes=("n",))
+(V, mV, kV) = _define_prefixed("V", voltage, prefixes=("m", "k"))
+(ohm, kohm, Mohm) = _define_prefixed("ohm", resistance, prefixes=("k", "M"))
+(F, uF, nF, pF) = _define_prefixed("F", capacitance, prefixes=("u", "n", "p"))
+(T, mT) = _define_prefixed("T", magnetic_flux_density, prefixes=("m",))
+
+# other units
+minute = _define("min", time, 60)
+h = _define("h", time, 3600)
+l = _define("l", volume, 1e-3)
+ml = _define("ml", volume, 1e-6)
+(eV, keV, MeV, GeV) = _define_prefixed("eV", energy, 1.602176634e-19,
+                                       prefixes=("k", "M", "G"))
+bar = _define("bar", pressure, 1e5)
+rad = _define("rad", dimensionless)
+deg = _define("deg", dimensionless, pi/180)
+
+
+def unit(symbol):
+    """
+    Return the unit with the given symbol from UNITS.
+    """
+    try:
+        return UNITS[symbol]
+    except KeyError:
+        raise ValueError("Unknown unit %r." % symbol) from None
+
+
+# the dimensions are not exported, their names would hide e.g. the module
+# time
+__all__ = ["UNITS", "PREFIXES", "unit", "minute"] + list(UNITS)
+__all__.remove("1")
+__all__.remove("min")